@@ -0,0 +1,37 @@
+import sys, tracemalloc
+import pithermalcam as ptc
+
+# Count memory allocated per steady-state frame against a synthetic sensor, with and without preallocated buffers
+# Exits non-zero if the preallocated pipeline makes any large allocation once it's warmed up
+WARMUP_FRAMES = 10
+FRAMES = 30
+LARGE_ALLOCATION = 64*1024  # Bytes; a 24x32 float64 frame is 6KB, an 800x600 image 1.4MB
+
+
+def measure(preallocate, interpolation_index, filter_image):
+    cam = ptc.pithermalcam(sensor=ptc.SyntheticSensor(realtime=False, seed=0), preallocate=preallocate)
+    cam._interpolation_index = interpolation_index
+    cam.filter_image = filter_image
+    for _ in range(WARMUP_FRAMES):
+        cam.update_image_frame()
+    tracemalloc.start()
+    largest = 0
+    for _ in range(FRAMES):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        cam.update_image_frame()
+        largest = max(largest, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    return largest
+
+
+failed = False
+print(f'{"Interpolation":<16}{"Filter":<8}{"Fresh arrays":>16}{"Preallocated":>16}')
+for index, name in enumerate(ptc.pithermalcam._interpolation_list_name):
+    for filter_image in (False, True):
+        fresh = measure(False, index, filter_image)
+        preallocated = measure(True, index, filter_image)
+        failed |= preallocated > LARGE_ALLOCATION
+        print(f'{name:<16}{str(filter_image):<8}{fresh/1024:>13.1f} KB{preallocated/1024:>13.1f} KB')
+print('Peak bytes allocated during a single steady-state frame.')
+sys.exit(1 if failed else 0)
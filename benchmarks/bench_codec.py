@@ -0,0 +1,52 @@
+import argparse, time, zlib
+import numpy as np
+import pithermalcam as ptc
+from pithermalcam.codec import FrameEncoder, FrameDecoder
+from bench_render_matrix import load_frames
+
+# Compression ratio and encode/decode throughput of the delta codec on recorded (or synthetic) frames,
+# against plain int16 centi-degrees with and without zlib
+# e.g. python benchmarks/bench_codec.py --source my_recording.rec
+
+
+def run(frames, encoder):
+    start = time.perf_counter()
+    encoded = [encoder.encode(frame)[1] for frame in frames]
+    encode_time = time.perf_counter() - start
+    decoder = FrameDecoder()
+    out = np.zeros((24, 32), dtype=np.float32)
+    worst = 0.0
+    start = time.perf_counter()
+    for data in encoded:
+        decoder.decode(data, out)
+    decode_time = time.perf_counter() - start
+    for data, frame in zip(encoded, frames):
+        worst = max(worst, float(np.abs(decoder.decode(data) - frame).max()))
+    return sum(len(data) for data in encoded), encode_time, decode_time, worst
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the raw frame codec')
+    parser.add_argument('--source', default='synthetic', help="'synthetic', a recording, or a .npy/.npz file of frames")
+    parser.add_argument('--frames', type=int, default=1000)
+    args = parser.parse_args()
+    frames = load_frames(args.source, args.frames)
+    count = len(frames)
+    int16_bytes = count*24*32*2
+
+    print(f'{count} frames from {args.source}; float32 {count*24*32*4/1024:.0f} KB, int16 {int16_bytes/1024:.0f} KB')
+    print(f'{"Codec":<28}{"KB":>8}{"vs int16":>10}{"B/frame":>9}{"enc frames/s":>14}{"dec frames/s":>14}{"max error C":>13}')
+    quantized = [np.rint(frame/0.01).astype('<i2').tobytes() for frame in frames]
+    start = time.perf_counter()
+    size = sum(len(zlib.compress(data, 6)) for data in quantized)
+    elapsed = time.perf_counter() - start
+    print(f'{"int16 + zlib 6":<28}{size/1024:>8.0f}{int16_bytes/size:>9.2f}x{size/count:>9.0f}{count/elapsed:>14.0f}{"":>14}{0.005:>13.4f}')
+    for level in (1, 6, 9):
+        for interval in (1, 8, 32, 128):
+            size, encode_time, decode_time, worst = run(frames, FrameEncoder(keyframe_interval=interval, level=level))
+            name = f'delta, key/{interval}, zlib {level}'
+            print(f'{name:<28}{size/1024:>8.0f}{int16_bytes/size:>9.2f}x{size/count:>9.0f}{count/encode_time:>14.0f}{count/decode_time:>14.0f}{worst:>13.4f}')
+
+
+if __name__ == '__main__':
+    main()
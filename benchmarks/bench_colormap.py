@@ -0,0 +1,33 @@
+import time
+import numpy as np
+import cv2
+import cmapy
+import pithermalcam as ptc
+from pithermalcam.colormaps import colormaps
+
+# Compare rebuilding the colormap LUT through cmapy every frame (the old behaviour) with the cached registry LUTs
+# Runs against synthetic frames, so it works on or off the Pi
+FRAMES = 200
+
+sensor = ptc.SyntheticSensor(realtime=False, seed=0)
+raw = np.zeros((24*32,), dtype=np.float32)
+frames = []
+for _ in range(FRAMES):
+    sensor.getFrame(raw)
+    frames.append(np.uint8((raw - raw.min())*255/(raw.max() - raw.min())).reshape(24, 32))
+
+
+def per_frame_ms(lookup):
+    start = time.perf_counter()
+    for i, frame in enumerate(frames):
+        name = ptc.pithermalcam._colormap_list[i % len(ptc.pithermalcam._colormap_list)]
+        cv2.applyColorMap(frame, lookup(name))
+    return (time.perf_counter() - start)*1000/FRAMES
+
+
+rebuilt = per_frame_ms(cmapy.cmap)
+per_frame_ms(colormaps.get)  # Warm the cache so only steady-state frames are timed
+cached = per_frame_ms(colormaps.get)
+print(f'cmapy.cmap every frame: {rebuilt:.3f} ms/frame')
+print(f'Cached registry LUT:    {cached:.3f} ms/frame')
+print(f'Saving:                 {rebuilt - cached:.3f} ms/frame ({rebuilt/cached:.0f}x faster colorizing)')
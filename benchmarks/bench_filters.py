@@ -0,0 +1,82 @@
+import argparse, time
+import numpy as np
+import cv2
+import pithermalcam as ptc
+from pithermalcam.pipeline import FramePipeline
+from pithermalcam.colormaps import colormaps
+from pithermalcam.denoise import TemporalFilter
+
+# Compare the filter modes on synthetic frames whose noise-free scene is known: 'bilateral' smooths the 800x600
+# image after upscaling, 'temporal' smooths each of the 24x32 temperatures over time before anything else.
+# Every mode is rendered in gray over one fixed temperature range, so the error against the noise-free render is in C.
+# e.g. python benchmarks/bench_filters.py --scene static --noise 0.5
+TEMP_RANGE = (18.0, 38.0)
+
+
+def synthetic_frames(count, noise, static=False):
+    """(count,24,32) frames of the synthetic scene, either with its warm spot wandering about or held still"""
+    sensor = ptc.SyntheticSensor(realtime=False, seed=0, noise=0 if static else noise)
+    frames = np.zeros((count, 24, 32), dtype=np.float32)
+    for frame in frames[:1] if static else frames:
+        sensor.getFrame(frame)
+    if static:
+        frames[1:] = frames[0]
+        frames += np.random.RandomState(0).normal(0, noise, frames.shape).astype(np.float32)
+    return frames
+
+
+def render(pipeline, temps, interpolation_index, bilateral):
+    raw = pipeline.rescale(temps, *TEMP_RANGE)
+    return pipeline.render(raw, colormaps.get('gray'), interpolation_index, ptc.pithermalcam._interpolation_list[interpolation_index],
+                           bilateral, temps=temps, temp_range=TEMP_RANGE)
+
+
+def run(mode, noisy, clean, interpolation_index, warmup):
+    """Mean filter time per frame in ms, and RMS error against the noise-free scene overall and on the warm spot"""
+    pipeline, truth_pipeline = FramePipeline(800, 600), FramePipeline(800, 600)
+    denoiser = TemporalFilter()
+    denoised = np.empty_like(noisy[0])
+    denoise_times, errors, moving_errors = [], [], []
+    for n, (frame, truth) in enumerate(zip(noisy, clean)):
+        if n == warmup:  # Let the temporal filter settle, and leave one-off setup out of the timings
+            pipeline.metrics = ptc.Metrics()
+        start = time.perf_counter()
+        temps = denoiser.update(frame, out=denoised) if mode == 'temporal' else frame
+        denoise_times.append(time.perf_counter() - start)
+        image = render(pipeline, temps, interpolation_index, mode == 'bilateral')
+        if n < warmup:
+            continue
+        difference = image[..., 0].astype(np.float32) - render(truth_pipeline, truth, interpolation_index, False)[..., 0]
+        difference *= (TEMP_RANGE[1] - TEMP_RANGE[0])/255
+        errors.append(np.sqrt(np.mean(difference*difference)))
+        # The warm spot is the only thing moving, so this is where lag or smearing would show
+        hot = cv2.resize((np.fliplr(truth) > TEMP_RANGE[0] + 8).astype(np.uint8), (800, 600), interpolation=cv2.INTER_NEAREST)
+        moving_errors.append(np.sqrt(np.mean(difference[hot > 0]**2)))
+    if mode == 'bilateral':
+        filter_ms = pipeline.metrics.summary()['stages']['filter']['mean']*1000
+    else:
+        filter_ms = np.mean(denoise_times[warmup:])*1000
+    return filter_ms, float(np.mean(errors)), float(np.mean(moving_errors))
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the bilateral and temporal filter modes')
+    parser.add_argument('--frames', type=int, default=200)
+    parser.add_argument('--noise', type=float, default=0.3, help='synthetic sensor noise, standard deviation in C')
+    parser.add_argument('--scene', choices=('moving', 'static'), default='moving',
+                        help="the synthetic sensor's wandering warm spot, or its first frame held still")
+    parser.add_argument('--interpolation', type=int, default=3, help='index into pithermalcam._interpolation_list')
+    args = parser.parse_args()
+    warmup = 20
+    noisy = synthetic_frames(args.frames + warmup, args.noise, args.scene == 'static')
+    clean = synthetic_frames(args.frames + warmup, 0.0, args.scene == 'static')
+
+    print(f'{args.frames} synthetic frames of a {args.scene} scene, noise {args.noise}C, {ptc.pithermalcam._interpolation_list_name[args.interpolation]} to 800x600')
+    print(f'{"Filter":<12}{"filter ms/frame":>17}{"RMS error C":>13}{"warm spot RMS C":>17}')
+    for mode in ('off', 'bilateral', 'temporal'):
+        filter_ms, error, hot_error = run(mode, noisy, clean, args.interpolation, warmup)
+        print(f'{mode:<12}{filter_ms:>17.3f}{error:>13.3f}{hot_error:>17.3f}')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,139 @@
+import argparse, json, platform, sys, time, tracemalloc
+import numpy as np
+import cv2
+import pithermalcam as ptc
+from pithermalcam.pipeline import FramePipeline
+from pithermalcam.recording import MAGIC, RecordingReader
+from pithermalcam.denoise import FILTER_MODES
+
+# Time pithermalcam's full processing (rescale, colormap, interpolation, filter and text) for every
+# interpolation mode x colormap x filter mode x output resolution, on synthetic or recorded 24x32 frames.
+# Results go to a JSON file; pass an earlier one as --baseline to list combinations that got slower.
+# e.g. python benchmarks/bench_render_matrix.py --output before.json
+#      python benchmarks/bench_render_matrix.py --output after.json --baseline before.json
+RESOLUTIONS = ('320x240', '640x480', '800x600')
+WARMUP_FRAMES = 3
+MEMORY_FRAMES = 3
+
+
+def load_frames(source, count):
+    """(count,24,32) float32 frames from the synthetic sensor, a recording, or a .npy/.npz file"""
+    if source == 'synthetic':
+        sensor = ptc.SyntheticSensor(realtime=False, seed=0)
+        frames = np.zeros((count, 24, 32), dtype=np.float32)
+        for frame in frames:
+            sensor.getFrame(frame)
+        return frames
+    with open(source, 'rb') as f:
+        is_recording = f.read(len(MAGIC)) == MAGIC
+    if is_recording:
+        return RecordingReader(source).frames(0, count)
+    return ptc.ReplaySensor(source)._frames[:count]
+
+
+def percentiles_ms(samples):
+    samples = np.asarray(samples)*1000
+    p50, p90, p99 = np.percentile(samples, (50, 90, 99))
+    return {'mean_ms': float(samples.mean()), 'p50_ms': float(p50), 'p90_ms': float(p90), 'p99_ms': float(p99), 'max_ms': float(samples.max())}
+
+
+def measure(cam, frames, interpolation_index, colormap_index, filter_image, width, height, preallocate):
+    cam._interpolation_index = interpolation_index
+    cam._colormap_index = colormap_index
+    cam.filter_image = filter_image
+    cam.metrics = ptc.Metrics()
+    cam._pipeline = FramePipeline(width, height, preallocate=preallocate, metrics=cam.metrics)
+    for _ in range(WARMUP_FRAMES):
+        cam.update_image_frame()
+    cam.metrics = cam._pipeline.metrics = ptc.Metrics()  # Leave the warmup (and one-off operator setup) out of the stage timings
+
+    latencies = []
+    for _ in range(len(frames)):
+        start = time.perf_counter()
+        cam.update_image_frame()
+        latencies.append(time.perf_counter() - start)
+    result = percentiles_ms(latencies)
+    result['stages_p50_ms'] = {stage: stats['p50']*1000 for stage, stats in cam.get_metrics()['stages'].items()}
+
+    # Peak memory separately, since tracing allocations slows everything down
+    tracemalloc.start()
+    peak = 0
+    for _ in range(MEMORY_FRAMES):
+        tracemalloc.reset_peak()
+        before = tracemalloc.get_traced_memory()[0]
+        cam.update_image_frame()
+        peak = max(peak, tracemalloc.get_traced_memory()[1] - before)
+    tracemalloc.stop()
+    result['peak_memory_bytes'] = peak
+    return result
+
+
+def key(result):
+    return (result['interpolation'], result['colormap'], result['filter'], result['resolution'])
+
+
+def compare(results, baseline_path, tolerance):
+    """Print combinations whose median latency grew by more than tolerance over the baseline; returns how many"""
+    with open(baseline_path) as f:
+        baseline = {key(result): result for result in json.load(f)['results']}
+    regressions = 0
+    for result in results:
+        before = baseline.get(key(result))
+        if before is None:
+            continue
+        ratio = result['p50_ms']/before['p50_ms']
+        if ratio > 1 + tolerance:
+            regressions += 1
+            print(f'SLOWER {"/".join(str(k) for k in key(result))}: {before["p50_ms"]:.2f} -> {result["p50_ms"]:.2f} ms ({ratio:.2f}x)')
+    print(f'{regressions} of {len(results)} combinations more than {tolerance:.0%} slower than {baseline_path}')
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark the full render matrix')
+    parser.add_argument('--source', default='synthetic', help="'synthetic', a recording, or a .npy/.npz file of frames")
+    parser.add_argument('--frames', type=int, default=20, help='timed frames per combination')
+    parser.add_argument('--resolutions', nargs='+', default=RESOLUTIONS, help='output sizes as WIDTHxHEIGHT')
+    parser.add_argument('--colormaps', nargs='+', default=ptc.pithermalcam._colormap_list)
+    parser.add_argument('--interpolations', nargs='+', type=int, default=range(len(ptc.pithermalcam._interpolation_list)),
+                        help='indexes into pithermalcam._interpolation_list')
+    parser.add_argument('--filter', choices=('all', 'off', 'bilateral', 'temporal'), default='all')
+    parser.add_argument('--fresh-arrays', action='store_true', help='allocate new arrays each frame instead of preallocating')
+    parser.add_argument('--output', default='render_matrix.json')
+    parser.add_argument('--baseline', help='earlier results file to compare against')
+    parser.add_argument('--tolerance', type=float, default=0.2, help='slowdown over the baseline to report, as a fraction')
+    args = parser.parse_args()
+
+    frames = load_frames(args.source, args.frames)
+    filters = FILTER_MODES if args.filter == 'all' else (args.filter,)
+    cam = ptc.pithermalcam(sensor=ptc.ReplaySensor(frames, realtime=False), preallocate=not args.fresh_arrays)
+    for colormap in args.colormaps:
+        if colormap not in cam._colormap_list:
+            cam.add_colormap(colormap)
+
+    results = []
+    combinations = [(i, c, f, r) for r in args.resolutions for i in args.interpolations for c in args.colormaps for f in filters]
+    for n, (interpolation_index, colormap, filter_image, resolution) in enumerate(combinations, 1):
+        width, height = (int(size) for size in resolution.split('x'))
+        result = {'interpolation': cam._interpolation_list_name[interpolation_index], 'colormap': colormap,
+                  'filter': filter_image, 'resolution': resolution}
+        result.update(measure(cam, frames, interpolation_index, cam._colormap_list.index(colormap), filter_image,
+                              width, height, not args.fresh_arrays))
+        results.append(result)
+        print(f'[{n}/{len(combinations)}] {resolution:<9}{result["interpolation"]:<16}{colormap:<10}{filter_image if filter_image != "off" else "":<10}'
+              f'p50 {result["p50_ms"]:8.2f} ms  p99 {result["p99_ms"]:8.2f} ms  peak {result["peak_memory_bytes"]/1024:8.1f} KB')
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S'), 'source': args.source, 'frames': len(frames),
+              'preallocate': not args.fresh_arrays,
+              'environment': {'python': platform.python_version(), 'numpy': np.__version__, 'opencv': cv2.__version__,
+                              'machine': platform.machine(), 'platform': platform.platform()},
+              'results': results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=1)
+    print(f'Wrote {len(results)} results to {args.output}')
+    if args.baseline and compare(results, args.baseline, args.tolerance):
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -3,12 +3,32 @@
 # Effectively using this init in the same manner as a C header file. If there's a more pythonic way to do this, it should change to that.
 from pithermalcam.pi_therm_cam import pithermalcam
 from pithermalcam import web_server
+from pithermalcam.sensors import SensorBackend, I2CSensor, SyntheticSensor, ReplaySensor, get_sensor
+from pithermalcam.acquisition import FrameRing, Acquisition, RetryPolicy
+from pithermalcam.recording import RecordingWriter, RecordingReader
+from pithermalcam.playback import PlaybackSensor, render_recording
+from pithermalcam.metrics import Metrics
+from pithermalcam.raw_stream import RawFrameBroadcaster, encode_frame, decode_frame, is_keyframe
+from pithermalcam.codec import FrameEncoder, FrameDecoder
+from pithermalcam.denoise import TemporalFilter
+from pithermalcam.roi import RoiStats
+from pithermalcam.alarms import AlarmRule, AlarmEngine
+from pithermalcam.rollup import RollupStore
+from pithermalcam.snapshots import SnapshotWriter
+from pithermalcam.burst import BurstCapture
 
+# The library's public names, including the re-exports above
+__all__ = ['pithermalcam', 'web_server', 'SensorBackend', 'I2CSensor', 'SyntheticSensor', 'ReplaySensor', 'get_sensor',
+           'FrameRing', 'Acquisition', 'RetryPolicy', 'RecordingWriter', 'RecordingReader', 'PlaybackSensor', 'render_recording',
+           'Metrics', 'RawFrameBroadcaster', 'encode_frame', 'decode_frame', 'is_keyframe', 'FrameEncoder', 'FrameDecoder',
+           'TemporalFilter', 'RoiStats', 'AlarmRule', 'AlarmEngine', 'RollupStore', 'SnapshotWriter', 'BurstCapture',
+           'test_camera', 'display_camera_live', 'stream_camera_online']
 
-def test_camera():
+
+def test_camera(sensor=None):
     """Check for an average temperature value to ensure the camera is connected and working."""
     try:
-        thermcam = pithermalcam()  # Instantiate class
+        thermcam = pithermalcam(sensor=sensor)  # Instantiate class
         temp_c = None
         temp_f = None
         temp_c, temp_f = thermcam.get_mean_temp()
@@ -25,17 +45,21 @@ def test_camera():
         raise(e)
 
 
-def display_camera_live(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/'):
+def display_camera_live(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None):
     """Display the camera live onscreen"""
-    thermcam = pithermalcam(output_folder=output_folder)  # Instantiate class
+    thermcam = pithermalcam(output_folder=output_folder, sensor=sensor)  # Instantiate class
     thermcam.display_camera_onscreen()
 
 
-def stream_camera_online(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/'):
-    """Start a flask server streaming the camera live"""
+def stream_camera_online(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None, use_asyncio:bool = False,
+                         subpages:bool = False):
+    """
+    Start a flask server streaming the camera live; use_asyncio serves every viewer from one thread instead of one each,
+    and subpages publishes a frame after each half of the sensor's chess pattern instead of each whole frame
+    """
     # This is a clunky way to do this, the better approach would likely to be restructuring web_server.py with the Flask Blueprint approach
     # If the code were restructure for this, the code would be much more complex and opaque for running directly though
-    web_server.start_server(output_folder=output_folder)
+    web_server.start_server(output_folder=output_folder, sensor=sensor, use_asyncio=use_asyncio, subpages=subpages)
 
 # Add attributes to existing pithermalcam object
 setattr(pithermalcam, 'stream_camera_online', stream_camera_online)
@@ -0,0 +1,273 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Sensor acquisition for the MLX90640 Thermal Camera
+# Reads raw temperature frames into a ring buffer, separately from rendering and streaming
+##################################
+import time, threading, logging, traceback
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+    from pithermalcam.metrics import Metrics
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+    from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+# The errors the camera throws from time to time, by the name they're counted under:
+# math domain errors from bad data, I2C I/O errors, and the driver's 'Too many retries'/'Frame data error'
+READ_ERRORS = {ValueError: 'value', OSError: 'os', RuntimeError: 'runtime'}
+
+
+def _error_kind(error):
+    return next(kind for error_type, kind in READ_ERRORS.items() if isinstance(error, error_type))
+
+
+class FrameRing:
+    """
+    Bounded ring of float32 (24,32) temperature frames, each tagged with a monotonic timestamp and a sequence ID.
+    Sequence IDs start at 1 and only ever go up; once the ring is full, each new frame overwrites the oldest.
+    One writer fills the next slot in place and then commits it; any number of readers can copy frames out.
+    Handing out a slot marks the frame in it as gone first, and readers check a frame is still there after copying it,
+    so a copy is never torn between the old frame and the new one.
+    """
+
+    def __init__(self, capacity:int = 16):
+        if capacity < 2:
+            raise ValueError('The ring needs room for at least two frames')
+        self.capacity = capacity
+        self.frames = np.zeros((capacity, SENSOR_ROWS, SENSOR_COLS), dtype=np.float32)
+        self.timestamps = np.zeros((capacity,), dtype=np.float64)
+        self.seqs = np.zeros((capacity,), dtype=np.int64)
+        self._seq = 0
+        self._condition = threading.Condition()
+
+    @property
+    def seq(self):
+        """Sequence ID of the newest committed frame, 0 while the ring is empty"""
+        return self._seq
+
+    def next_slot(self):
+        """The buffer the next frame should be written into: the oldest frame's slot, which stops being readable from here on"""
+        with self._condition:
+            index = (self._seq + 1) % self.capacity
+            self.seqs[index] = -1
+        return self.frames[index]
+
+    def commit(self, timestamp:float = None):
+        """Publish the frame written into next_slot() and wake any waiting readers. Returns its sequence ID."""
+        with self._condition:
+            seq = self._seq + 1
+            index = seq % self.capacity
+            self.timestamps[index] = time.monotonic() if timestamp is None else timestamp
+            self.seqs[index] = seq
+            self._seq = seq
+            self._condition.notify_all()
+        return seq
+
+    def push(self, frame, timestamp:float = None):
+        """Copy a frame into the ring and commit it"""
+        self.next_slot()[...] = np.reshape(frame, (SENSOR_ROWS, SENSOR_COLS))
+        return self.commit(timestamp)
+
+    def read(self, seq:int, out=None):
+        """
+        Copy frame seq into out (a new array if not given) and return (timestamp, frame),
+        or None if that frame has already been overwritten or doesn't exist yet.
+        """
+        index = seq % self.capacity
+        with self._condition:
+            if seq < 1 or self.seqs[index] != seq:
+                return None
+            timestamp = self.timestamps[index]
+        if out is None:
+            out = self.frames[index].copy()
+        else:
+            np.copyto(np.reshape(out, (SENSOR_ROWS, SENSOR_COLS)), self.frames[index])
+        if self.seqs[index] != seq:  # The writer took the slot while we were copying, so the copy may be torn
+            return None
+        return timestamp, out
+
+    def latest(self, out=None):
+        """Return (seq, timestamp, frame) for the newest frame, copied into out if given, or None while the ring is empty"""
+        with self._condition:
+            seq = self._seq
+            result = self.read(seq, out)
+        if result is None:
+            return None
+        return (seq,) + result
+
+    def wait_for(self, after_seq:int = 0, timeout:float = None, out=None):
+        """
+        Block until a frame newer than after_seq is available, then return the newest frame as latest() does.
+        Returns None if nothing newer arrives within timeout.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > after_seq, timeout):
+                return None
+            return self.latest(out)
+
+    def available(self):
+        """Sequence IDs currently held, oldest first"""
+        with self._condition:
+            return list(range(max(1, self._seq - self.capacity + 1), self._seq + 1))
+
+
+class RetryPolicy:
+    """
+    How failed sensor reads are retried. Each frame gets up to max_retries more attempts, waiting backoff seconds
+    before the first and backoff_factor times longer before each one after, up to max_backoff.
+    After step_down_after frames in a row fail every attempt, the sensor is asked to slow down (see SensorBackend.step_down),
+    as errors that persist usually mean the I2C bus can't keep up.
+    """
+
+    def __init__(self, max_retries:int = 3, backoff:float = 0.01, backoff_factor:float = 2.0, max_backoff:float = 0.5,
+                 step_down_after:int = 5):
+        self.max_retries = max_retries
+        self.backoff = backoff
+        self.backoff_factor = backoff_factor
+        self.max_backoff = max_backoff
+        self.step_down_after = step_down_after
+
+    def delay(self, retry:int):
+        """Seconds to wait before retry number retry (from 0)"""
+        return min(self.backoff*self.backoff_factor**retry, self.max_backoff)
+
+
+class Acquisition:
+    """
+    Reads sensor frames into a FrameRing and hands each new frame to registered raw-data consumers.
+    start() runs the reads on a background thread that does nothing else, so slow rendering never delays the next read;
+    without it, read_frame() does one blocking read on the caller's thread.
+    Consumers are called as consumer(seq, timestamp, frame) on the reading thread; frame is the ring's own (24,32)
+    buffer, so they should be quick and copy anything they keep.
+    Read times go into metrics as the i2c_read stage, along with frames_acquired and frames_errored counts.
+    Failed reads are retried as retry_policy says, and each failed attempt is counted by type in metrics as
+    read_errors_<kind>, and read_retries_<kind> if it's retried (kinds as in READ_ERRORS). frames_errored counts
+    frames that failed every attempt, once each.
+    With subpages set, each read takes one subpage rather than a whole frame and publishes the last frame with that
+    half of its pixels replaced. Frames then come twice as often and are half as old, at the cost of the two halves
+    of each one being read a subpage period apart.
+    """
+
+    def __init__(self, sensor, capacity:int = 16, metrics=None, subpages:bool = False, retry_policy:RetryPolicy = None):
+        if subpages and not sensor.supports_subpages:
+            raise ValueError(f'{type(sensor).__name__} can only be read a whole frame at a time')
+        self.sensor = sensor
+        self.subpages = subpages
+        self.ring = FrameRing(capacity)
+        self.metrics = Metrics() if metrics is None else metrics
+        self.retry_policy = RetryPolicy() if retry_policy is None else retry_policy
+        self.errors = 0
+        self._failures_in_a_row = 0
+        self._subpages_read = set()
+        self._consumers = []
+        self._thread = None
+        self._running = False
+
+    @property
+    def running(self):
+        """True while the background acquisition thread is reading the sensor"""
+        return self._running
+
+    def add_consumer(self, consumer):
+        """Call consumer(seq, timestamp, frame) for every new frame"""
+        self._consumers = self._consumers + [consumer]  # Replace rather than mutate, so the reading thread can iterate without a lock
+
+    def remove_consumer(self, consumer):
+        self._consumers = [c for c in self._consumers if c is not consumer]
+
+    def _read_subpage(self, slot):
+        """Fill slot with the newest frame updated by the next subpage; the first read waits for both subpages"""
+        self.ring.read(self.ring.seq, out=slot)  # The other subpage's pixels carry over from the newest frame
+        self._subpages_read.add(self.sensor.getSubpage(slot))
+        while len(self._subpages_read) < 2:
+            self._subpages_read.add(self.sensor.getSubpage(slot))
+
+    def _read_with_retries(self, slot):
+        """Read into slot, retrying as the policy allows; the last error propagates once retries run out"""
+        policy = self.retry_policy
+        for retry in range(policy.max_retries + 1):
+            start = time.perf_counter()
+            try:
+                if self.subpages:
+                    self._read_subpage(slot)
+                else:
+                    self.sensor.getFrame(slot)
+                self._failures_in_a_row = 0
+                return start
+            except tuple(READ_ERRORS) as e:
+                kind = _error_kind(e)
+                self.metrics.inc(f'read_errors_{kind}')
+                if retry == policy.max_retries:
+                    self._read_failed()
+                    raise
+                self.metrics.inc(f'read_retries_{kind}')
+                logger.info(f'Sensor read error ({e}); retrying')
+                time.sleep(policy.delay(retry))
+
+    def _read_failed(self):
+        """Count a frame that failed every attempt, and slow the sensor down if that keeps happening"""
+        self.metrics.inc('frames_errored')
+        self._failures_in_a_row += 1
+        if self._failures_in_a_row >= self.retry_policy.step_down_after:
+            self._failures_in_a_row = 0
+            setting = self.sensor.step_down()
+            if setting is not None:
+                self.metrics.inc('sensor_step_downs')
+                print(f"Persistent sensor read errors; slowed down to {setting}")
+                logger.warning(f'Persistent sensor read errors; slowed down to {setting}')
+
+    def read_frame(self):
+        """
+        Read one frame (or subpage) from the sensor into the ring, retrying failed reads, and pass it to the consumers.
+        Returns its sequence ID; the last error propagates if every attempt fails.
+        """
+        slot = self.ring.next_slot()
+        start = self._read_with_retries(slot)
+        self.metrics.lap('i2c_read', start)
+        self.metrics.inc('frames_acquired')
+        timestamp = time.monotonic()
+        seq = self.ring.commit(timestamp)
+        for consumer in self._consumers:
+            try:
+                consumer(seq, timestamp, slot)
+            except Exception:
+                logger.warning(traceback.format_exc())
+        return seq
+
+    def start(self):
+        """Start reading on a background thread"""
+        if self._running:
+            return
+        self._running = True
+        self._thread = threading.Thread(target=self._run, name='pithermalcam-acquisition')
+        self._thread.daemon = True
+        self._thread.start()
+
+    def stop(self):
+        """Stop the background thread after its current read"""
+        self._running = False
+        if self._thread is not None and self._thread is not threading.current_thread():
+            self._thread.join(timeout=2*self.sensor.frame_period + 1)
+        self._thread = None
+
+    def _run(self):
+        try:
+            while self._running:
+                try:
+                    self.read_frame()
+                # Every retry failed; readers keep the last good frame meanwhile, so note it and carry on
+                except tuple(READ_ERRORS) as e:
+                    self.errors += 1
+                    print(f"Sensor read error ({e}); continuing...")
+                    logger.info(traceback.format_exc())
+                except EOFError:  # A replayed recording ran out
+                    break
+        except Exception:
+            logger.exception('Acquisition stopped by an unexpected error')
+        finally:
+            # However the thread ends, running must say so; unless stop() and start() already replaced it
+            if self._thread in (None, threading.current_thread()):
+                self._running = False
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Temperature alarms for the MLX90640 Thermal Camera
+# Threshold and rate-of-change rules, all evaluated together on every raw frame, raising events to callbacks
+##################################
+import time, threading, logging, traceback
+from collections import deque
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS, SENSOR_PIXELS
+    from pithermalcam.roi import definition_mask
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS, SENSOR_PIXELS
+    from roi import definition_mask
+
+logger = logging.getLogger(__name__)
+
+STATISTICS = ('max', 'min', 'mean')
+
+
+class AlarmRule:
+    """
+    One declarative alarm rule. It watches the max, min or mean temperature (statistic) of its region, or with window set
+    the rate that statistic is changing in C per second, measured over the last window seconds.
+    It raises once that value is above (or below) its threshold for hold seconds in a row, and clears once the value is
+    back the other side of threshold by more than hysteresis for clear_hold seconds in a row.
+    region is None for the whole frame, or a (24,32) boolean mask in raw frame (sensor) orientation.
+    """
+
+    def __init__(self, name:str, above:float = None, below:float = None, statistic:str = 'max', window:float = None,
+                 hysteresis:float = 0.0, hold:float = 0.0, clear_hold:float = 0.0, region=None):
+        if (above is None) == (below is None):
+            raise ValueError('An alarm rule needs either an above or a below threshold')
+        if statistic not in STATISTICS:
+            raise ValueError(f"Unknown statistic {statistic}; expected one of {', '.join(STATISTICS)}")
+        if window is not None and window <= 0:
+            raise ValueError('A rate of change window must be longer than 0 seconds')
+        if hysteresis < 0 or hold < 0 or clear_hold < 0:
+            raise ValueError('Hysteresis and hold times cannot be negative')
+        if region is not None:
+            region = np.asarray(region, dtype=bool).reshape(SENSOR_ROWS, SENSOR_COLS)
+            if not region.any():
+                raise ValueError(f'The region of alarm rule {name} covers no sensor pixels')
+        self.name = name
+        self.above = None if above is None else float(above)
+        self.below = None if below is None else float(below)
+        self.statistic = statistic
+        self.window = None if window is None else float(window)
+        self.hysteresis = float(hysteresis)
+        self.hold = float(hold)
+        self.clear_hold = float(clear_hold)
+        self.region = region
+
+    @property
+    def threshold(self):
+        return self.below if self.above is None else self.above
+
+    def definition(self):
+        """The rule as a dict that AlarmEngine.add() takes back; the region is left out when it's the whole frame"""
+        definition = {'statistic': self.statistic, 'hysteresis': self.hysteresis, 'hold': self.hold, 'clear_hold': self.clear_hold}
+        definition['above' if self.below is None else 'below'] = self.threshold
+        if self.window is not None:
+            definition['window'] = self.window
+        return definition
+
+
+class AlarmEngine:
+    """
+    Evaluates alarm rules on every raw frame; register update() with pithermalcam.add_raw_frame_consumer.
+    Rules are compiled into arrays when added or removed, so each frame costs a few array operations over the 24x32
+    temperatures for all the rules together, however many there are. Rate-of-change rules read their starting value from
+    a history of each rule's statistic, history samples taken at least max_window/(history - 1) seconds apart by frame
+    timestamp. It reaches back max_window seconds whatever the frame rate, including after the sensor is slowed down,
+    and add_rule refuses longer windows, which would otherwise never fire.
+    Raised and cleared alarms become events: dicts of id, rule, type ('raised' or 'cleared'), value, threshold, seq,
+    timestamp (monotonic, as the frame's) and time (wall clock). Each is passed to every callback added, on the acquisition
+    thread, and the newest max_events are kept for events() to poll.
+    mirrored means masks are given with x running as in the camera's images, as for RoiStats.
+    """
+
+    def __init__(self, rois=None, history:int = 256, max_events:int = 256, mirrored:bool = True, max_window:float = 60.0):
+        if history < 2:
+            raise ValueError('The alarm history needs room for at least two frames')
+        if max_window <= 0:
+            raise ValueError('The longest rate of change window must be longer than 0 seconds')
+        self.rois = rois  # A RoiStats whose regions rules can name
+        self.history = history
+        self.max_window = float(max_window)  # The longest rate of change window, in seconds, that the history reaches back over
+        self._spacing = self.max_window/(history - 1)  # Seconds between history samples, at least
+        self.mirrored = mirrored
+        self._lock = threading.Lock()
+        self._rules = {}
+        self._active = {}  # Rule name -> the event that raised it, for rules currently in alarm
+        self._compiled = None
+        self._callbacks = []
+        self._events = deque(maxlen=max_events)
+        self._event_id = 0
+        self._event_condition = threading.Condition()
+
+    def __len__(self):
+        return len(self._rules)
+
+    @property
+    def names(self):
+        return list(self._rules)
+
+    def add_rule(self, name:str, **kwargs):
+        """
+        Add (or replace) a rule; takes AlarmRule's arguments, with region in raw frame orientation. Returns the rule.
+        Raises ValueError for a rate of change window longer than max_window.
+        """
+        rule = AlarmRule(name, **kwargs)
+        if rule.window is not None and rule.window > self.max_window:
+            raise ValueError(f'A rate of change window can be at most {self.max_window:g} seconds')
+        with self._lock:
+            self._rules[name] = rule
+            self._compile()
+        return rule
+
+    def add(self, name:str, definition:dict):
+        """
+        Add a rule from a dict like those from JSON: AlarmRule's arguments, e.g. {"above": 70, "hold": 2}, plus optionally
+        where it applies: "roi" naming one of self.rois's regions, or a "rectangle", "polygon" or "mask" as RoiStats.add
+        takes, in the image's orientation. Without either it applies to the whole frame. Raises ValueError for anything invalid.
+        """
+        arguments = {key: definition[key] for key in ('above', 'below', 'statistic', 'window', 'hysteresis', 'hold', 'clear_hold')
+                     if key in definition}
+        try:
+            if 'roi' in definition:
+                if self.rois is None or definition['roi'] not in self.rois.names:
+                    raise ValueError(f"no ROI {definition['roi']}")
+                arguments['region'] = self.rois.mask(definition['roi'])
+            elif definition.keys() & {'rectangle', 'polygon', 'mask'}:
+                mask = definition_mask(definition)
+                arguments['region'] = mask[:, ::-1] if self.mirrored else mask
+            for key in ('above', 'below', 'window', 'hysteresis', 'hold', 'clear_hold'):
+                if arguments.get(key) is not None:
+                    arguments[key] = float(arguments[key])
+            return self.add_rule(name, **arguments)
+        except (TypeError, ValueError) as e:
+            raise ValueError(f'Invalid alarm rule {name}: {e}')
+
+    def remove(self, name:str):
+        """Remove a rule, clearing it without an event if it was raised; KeyError if there's none by that name"""
+        with self._lock:
+            del self._rules[name]
+            self._active.pop(name, None)
+            self._compile()
+
+    def definitions(self):
+        """Each rule as a dict add() takes, with its region (if any) as a mask in the orientation rules are added in"""
+        with self._lock:
+            rules = dict(self._rules)
+        definitions = {}
+        for name, rule in rules.items():
+            definitions[name] = rule.definition()
+            if rule.region is not None:
+                definitions[name]['mask'] = (rule.region[:, ::-1] if self.mirrored else rule.region).astype(np.uint8).tolist()
+        return definitions
+
+    def active(self):
+        """The event that raised each rule currently in alarm, by rule name"""
+        with self._lock:
+            return dict(self._active)
+
+    def add_callback(self, callback):
+        """Call callback(event) for every alarm raised or cleared, on the acquisition thread, so it should be quick"""
+        self._callbacks = self._callbacks + [callback]  # Replace rather than mutate, so update() can iterate without a lock
+
+    def remove_callback(self, callback):
+        self._callbacks = [c for c in self._callbacks if c is not callback]
+
+    def _compile(self):
+        """
+        Stack every rule into arrays for update(), carrying each rule's alarm state over and starting the statistic
+        history afresh. Called with the lock held; update() takes the same lock, so it never sees this half done.
+        """
+        if not self._rules:
+            self._compiled = None
+            return
+        names = list(self._rules)
+        rules = [self._rules[name] for name in names]
+        masks = np.stack([np.ones(SENSOR_PIXELS, dtype=bool) if rule.region is None else rule.region.reshape(-1) for rule in rules])
+        windows = np.array([np.nan if rule.window is None else rule.window for rule in rules])
+        previous = self._compiled
+        pending = np.full(len(names), np.nan)
+        clearing = np.full(len(names), np.nan)
+        if previous is not None:  # Keep the hold timers of rules that were already there
+            for i, name in enumerate(names):
+                if name in previous['names']:
+                    j = previous['names'].index(name)
+                    pending[i], clearing[i] = previous['pending'][j], previous['clearing'][j]
+        self._compiled = {
+            'names': names,
+            'outside': ~masks,
+            'weights': (masks/masks.sum(axis=1)[:, None]).astype(np.float32),
+            'statistic': np.array([STATISTICS.index(rule.statistic) for rule in rules]),
+            'windows': windows,
+            'is_rate': ~np.isnan(windows),
+            # Compare sign*value against sign*threshold, so 'below' rules work the same way as 'above' ones
+            'sign': np.array([1.0 if rule.below is None else -1.0 for rule in rules]),
+            'threshold': np.array([rule.threshold for rule in rules]),
+            'hysteresis': np.array([rule.hysteresis for rule in rules]),
+            'hold': np.array([rule.hold for rule in rules]),
+            'clear_hold': np.array([rule.clear_hold for rule in rules]),
+            'active': np.array([name in self._active for name in names]),
+            'pending': pending,  # When each rule's condition started holding, NaN while it doesn't
+            'clearing': clearing,  # When each raised rule's clear condition started holding
+            'values': np.empty((len(names), SENSOR_PIXELS), dtype=np.float32),
+            'history': np.zeros((self.history, len(names))),
+            'times': np.full(self.history, np.inf),
+            'count': 0,
+            'last_sample': -np.inf,
+        }
+
+    def update(self, seq:int, timestamp:float, frame):
+        """Consumer entry point: evaluate every rule against one raw frame, at sensor rate"""
+        with self._lock:
+            compiled = self._compiled
+            if compiled is None:
+                return
+            events = self._evaluate(compiled, seq, timestamp, np.reshape(frame, (SENSOR_PIXELS,)))
+        for event in events:
+            self._publish(event)
+
+    def _statistics(self, compiled, frame):
+        """Every rule's statistic of its own region, as one array"""
+        values = compiled['values']
+        values[...] = frame
+        np.copyto(values, -np.inf, where=compiled['outside'])
+        maximums = values.max(axis=1)
+        np.copyto(values, np.inf, where=compiled['outside'])
+        minimums = values.min(axis=1)
+        means = compiled['weights'] @ frame
+        return np.choose(compiled['statistic'], (maximums, minimums, means)).astype(np.float64)
+
+    def _rates(self, compiled, timestamp, statistics):
+        """
+        Return how fast each rate rule's statistic changed, in C per second, since the newest history sample at least its
+        window ago, and add this frame's statistics to the history if the newest sample is far enough back.
+        NaN for other rules, and until the history reaches back that far.
+        """
+        history, times = compiled['history'], compiled['times']
+        rates = np.full(len(statistics), np.nan)
+        if compiled['is_rate'].any():
+            order = np.argsort(times)  # Oldest first; unfilled slots sort to the end as +inf
+            ordered_times = times[order]
+            position = np.searchsorted(ordered_times, timestamp - np.nan_to_num(compiled['windows']), side='right') - 1
+            found = compiled['is_rate'] & (position >= 0)
+            rows = order[np.maximum(position, 0)]
+            elapsed = timestamp - times[rows]
+            with np.errstate(divide='ignore', invalid='ignore'):
+                rates = np.where(found & (elapsed > 0), (statistics - history[rows, np.arange(len(statistics))])/elapsed, np.nan)
+        # Sampling by time rather than every frame keeps the history max_window long at any frame rate
+        if timestamp - compiled['last_sample'] >= self._spacing:
+            index = compiled['count'] % self.history
+            history[index] = statistics
+            times[index] = timestamp
+            compiled['count'] += 1
+            compiled['last_sample'] = timestamp
+        return rates
+
+    def _evaluate(self, compiled, seq, timestamp, frame):
+        """Advance every rule's state by one frame and return the events that caused"""
+        statistics = self._statistics(compiled, frame)
+        values = np.where(compiled['is_rate'], self._rates(compiled, timestamp, statistics), statistics)
+        sign, threshold, active = compiled['sign'], compiled['threshold'], compiled['active']
+        with np.errstate(invalid='ignore'):  # NaN rates (not enough history yet) neither raise nor clear
+            over = sign*values > sign*threshold
+            under = sign*values < sign*threshold - compiled['hysteresis']
+        # Hold timers: when the condition started holding, forgotten as soon as it stops
+        pending = np.where(~active & over, np.fmin(compiled['pending'], timestamp), np.nan)
+        clearing = np.where(active & under, np.fmin(compiled['clearing'], timestamp), np.nan)
+        raised = ~active & over & (timestamp - pending >= compiled['hold'])
+        cleared = active & under & (timestamp - clearing >= compiled['clear_hold'])
+        compiled['pending'] = np.where(raised, np.nan, pending)
+        compiled['clearing'] = np.where(cleared, np.nan, clearing)
+        compiled['active'] = (active | raised) & ~cleared
+        events = []
+        for i in np.flatnonzero(raised | cleared):
+            name = compiled['names'][i]
+            event = {'rule': name, 'type': 'raised' if raised[i] else 'cleared', 'value': float(values[i]),
+                     'threshold': float(threshold[i]), 'seq': seq, 'timestamp': timestamp, 'time': time.time()}
+            if raised[i]:
+                self._active[name] = event
+            else:
+                self._active.pop(name, None)
+            events.append(event)
+        return events
+
+    def _publish(self, event):
+        with self._event_condition:
+            self._event_id += 1
+            event['id'] = self._event_id
+            self._events.append(event)
+            self._event_condition.notify_all()
+        logger.info(f"Alarm {event['rule']} {event['type']} at {event['value']:.2f} (threshold {event['threshold']:g})")
+        for callback in self._callbacks:
+            try:
+                callback(event)
+            except Exception:
+                logger.warning(traceback.format_exc())
+
+    @property
+    def last_event_id(self):
+        """ID of the newest event, 0 before the first"""
+        return self._event_id
+
+    def events(self, after:int = 0, timeout:float = None):
+        """
+        Events with IDs above after, oldest first, from the newest max_events. With timeout, wait up to that long for
+        one if there are none yet, for long polling.
+        """
+        with self._event_condition:
+            if timeout:
+                self._event_condition.wait_for(lambda: self._event_id > after, timeout)
+            return [event for event in self._events if event['id'] > after]
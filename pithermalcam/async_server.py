@@ -0,0 +1,300 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Single-threaded asyncio web server for MLX90640 Thermal Camera w Raspberry Pi
+# Serves the same routes and page as web_server.py, but every connection shares one event loop
+# instead of holding a thread each, so a Pi Zero or Pi 3 can take many more viewers
+##################################
+import asyncio, base64, hashlib, logging, struct, threading, time, traceback
+from concurrent.futures import ThreadPoolExecutor
+from urllib.parse import urlsplit, parse_qs
+try:  # If called as an imported module
+    from pithermalcam import web_server
+    from pithermalcam.raw_stream import is_keyframe
+    from pithermalcam.rollup import ROLLUP_PATH
+    from pithermalcam.burst import BURST_SECONDS
+except ImportError:  # If run directly
+    import web_server
+    from raw_stream import is_keyframe
+    from rollup import ROLLUP_PATH
+    from burst import BURST_SECONDS
+
+logger = logging.getLogger(__name__)
+
+STREAM_HEADERS = (b'HTTP/1.1 200 OK\r\n'
+                  b'Content-Type: multipart/x-mixed-replace; boundary=frame\r\n'
+                  b'Cache-Control: no-cache\r\n'
+                  b'Connection: close\r\n\r\n')
+WEBSOCKET_GUID = b'258EAFA5-E914-47DA-95CA-C5AB0DC85B11'
+WS_BINARY, WS_CLOSE, WS_PING, WS_PONG = 0x2, 0x8, 0x9, 0xA
+FLASK_WORKERS = 8  # Threads for the Flask views, some of which (/api/alarms?wait=) hold one for up to 30 seconds
+
+
+def _websocket_frame(payload:bytes, opcode:int = WS_BINARY):
+    """One unmasked, unfragmented WebSocket frame, as a server sends them"""
+    if len(payload) < 126:
+        header = struct.pack('!BB', 0x80 | opcode, len(payload))
+    elif len(payload) < 65536:
+        header = struct.pack('!BBH', 0x80 | opcode, 126, len(payload))
+    else:
+        header = struct.pack('!BBQ', 0x80 | opcode, 127, len(payload))
+    return header + payload
+
+
+async def _read_websocket_frame(reader):
+    """Read one frame from a client and return (opcode, unmasked payload)"""
+    first, second = await reader.readexactly(2)
+    length = second & 0x7f
+    if length == 126:
+        length, = struct.unpack('!H', await reader.readexactly(2))
+    elif length == 127:
+        length, = struct.unpack('!Q', await reader.readexactly(8))
+    mask = await reader.readexactly(4) if second & 0x80 else None
+    payload = await reader.readexactly(length)
+    if mask:
+        payload = bytes(b ^ mask[i % 4] for i, b in enumerate(payload))
+    return first & 0x0f, payload
+
+
+class _HubWatcher:
+    """
+    Wakes the event loop whenever the camera thread publishes to a hub (or the acquisition thread to the raw frame
+    broadcaster), so streaming clients never poll
+    """
+
+    def __init__(self, hub, loop):
+        self.hub = hub
+        self.loop = loop
+        self._future = loop.create_future()
+        hub.add_listener(self._published)
+
+    def _published(self):  # On the camera thread
+        self.loop.call_soon_threadsafe(self._wake)
+
+    def _wake(self):
+        future, self._future = self._future, self.loop.create_future()
+        future.set_result(None)
+
+    async def wait(self, after_seq:int, timeout:float):
+        """Wait until the hub has a frame newer than after_seq (or is closed); False on timeout"""
+        if self.hub.seq > after_seq or self.hub.closed:
+            return True
+        return await self.next(timeout)
+
+    async def next(self, timeout:float):
+        """Wait for the next publish (or close); False on timeout"""
+        try:
+            await asyncio.wait_for(asyncio.shield(self._future), timeout)
+            return True
+        except asyncio.TimeoutError:
+            return False
+
+    def close(self):
+        self.hub.remove_listener(self._published)
+
+
+class AsyncStreamServer:
+    """
+    Streams /video_feed to every client from one event loop, and hands every other route to web_server's Flask views.
+    The camera loop (web_server.pull_images) runs on its own thread and publishes to the hubs as usual. The Flask views
+    run on a pool of flask_workers threads of their own, so long polls can only hold up each other, and JPEG encoding
+    on the loop's default executor; the loop itself only moves bytes.
+    Sends are awaited with drain(), so a client's stats and quality level follow its real socket backpressure.
+    """
+
+    def __init__(self, flask_workers:int = FLASK_WORKERS):
+        self.flask_workers = flask_workers
+        self._watchers = {}
+        self._server = None
+        self._loop = None
+        self._flask_executor = None
+
+    def _watcher(self, hub):
+        watcher = self._watchers.get(hub)
+        if watcher is None:
+            watcher = self._watchers[hub] = _HubWatcher(hub, self._loop)
+        return watcher
+
+    def _forget_closed_hubs(self):
+        """Drop watchers for hubs that have gone, e.g. evicted renditions"""
+        for hub, watcher in list(self._watchers.items()):
+            if hub.closed:
+                watcher.close()
+                del self._watchers[hub]
+
+    async def serve(self, host:str, port:int):
+        self._loop = asyncio.get_running_loop()
+        web_server.raw_socket = True  # /ws/raw is served here, with or without flask-sock
+        self._flask_executor = ThreadPoolExecutor(self.flask_workers, thread_name_prefix='pithermalcam-flask')
+        self._server = await asyncio.start_server(self._handle, host, port)
+        camera = threading.Thread(target=web_server.pull_images, name='pithermalcam-camera')
+        camera.daemon = True
+        camera.start()
+        try:
+            async with self._server:
+                try:
+                    await self._server.serve_forever()
+                except asyncio.CancelledError:
+                    pass
+            await self._loop.run_in_executor(None, camera.join)
+        finally:
+            self._flask_executor.shutdown(wait=False)
+
+    async def _handle(self, reader, writer):
+        peer = writer.get_extra_info('peername')
+        try:
+            request_line = (await reader.readline()).decode('latin-1').split()
+            headers = {}
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b'\n', b''):
+                    break
+                name, _, value = line.decode('latin-1').partition(':')
+                headers[name.strip().lower()] = value.strip()
+            if len(request_line) < 2:
+                return
+            method, target = request_line[0], request_line[1]
+            url = urlsplit(target)
+            if url.path == '/video_feed':
+                await self._stream(writer, url.query, peer[0] if peer else '')
+            elif url.path == '/ws/raw':
+                await self._raw_socket(reader, writer, headers, parse_qs(url.query).get('codec', [None])[0] == 'delta')
+            elif url.path == '/exit':
+                await self._respond(writer, 200, 'text/html; charset=utf-8', b'Server shutting down...')
+                self.shutdown()
+            else:
+                body = await reader.readexactly(int(headers.get('content-length', 0)))  # e.g. a PUT to /api/roi
+                await self._flask(writer, method, url, headers, peer[0] if peer else '', body)
+        except (ConnectionError, asyncio.IncompleteReadError):
+            pass
+        except Exception:
+            logger.warning(traceback.format_exc())
+        finally:
+            writer.close()
+
+    async def _respond(self, writer, status:int, content_type:str, body:bytes, reason:str = 'OK'):
+        writer.write(f'HTTP/1.1 {status} {reason}\r\nContent-Type: {content_type}\r\n'
+                     f'Content-Length: {len(body)}\r\nConnection: close\r\n\r\n'.encode('latin-1') + body)
+        await writer.drain()
+
+    async def _flask(self, writer, method:str, url, headers:dict, remote_addr:str, body:bytes = b''):
+        """Run a request through web_server's Flask app on an executor thread and write out its response"""
+        def call():
+            with web_server.app.test_client() as client:
+                return client.open(url.path, method=method, query_string=url.query, headers=headers, data=body,
+                                   environ_base={'REMOTE_ADDR': remote_addr})
+        response = await self._loop.run_in_executor(self._flask_executor, call)
+        body = response.get_data()
+        head = [f'HTTP/1.1 {response.status}']
+        head += [f'{name}: {value}' for name, value in response.headers if name.lower() not in ('content-length', 'connection')]
+        head += [f'Content-Length: {len(body)}', 'Connection: close']
+        writer.write(('\r\n'.join(head) + '\r\n\r\n').encode('latin-1') + body)
+        await writer.drain()
+
+    async def _stream(self, writer, query:str, remote_addr:str):
+        """Push each new frame to one client, at the quality level its connection can keep up with"""
+        hub = web_server.hub
+        if query:  # Query parameters pick a rendition, as in web_server.video_feed
+            args = {name: values[0] for name, values in parse_qs(query).items()}
+            try:
+                hub = web_server.renditions.get(web_server.renditions.key_from_args(args, web_server.thermcam)).hub
+            except ValueError as e:
+                return await self._respond(writer, 400, 'text/plain', str(e).encode(), 'Bad Request')
+            except RuntimeError as e:
+                return await self._respond(writer, 503, 'text/plain', str(e).encode(), 'Service Unavailable')
+        self._forget_closed_hubs()
+        watcher = self._watcher(hub)
+        writer.write(STREAM_HEADERS)
+        await writer.drain()
+        client = hub.connect(remote_addr)
+        try:
+            seq = 0
+            while not hub.closed:
+                if not await watcher.wait(seq, timeout=1.0):
+                    continue
+                # The first client to want a frame encodes it, so keep that off the loop too
+                seq, jpeg = await self._loop.run_in_executor(None, hub.get_jpeg, seq, 0, client.level)
+                if jpeg is None:
+                    continue
+                start = time.perf_counter()
+                writer.write(b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                await writer.drain()  # Only waits once the transport's buffer is full, i.e. the client is behind
+                client.sent(seq, len(jpeg), hub.metrics.lap('network_send', start) - start, hub.frame_interval)
+                hub.metrics.inc('frames_streamed')
+        finally:
+            hub.disconnect(client)
+
+    async def _raw_socket(self, reader, writer, headers:dict, delta:bool = False):
+        """Upgrade to a WebSocket and push each sensor frame as a binary message (see raw_stream.py), delta-coded if asked"""
+        key = headers.get('sec-websocket-key')
+        if key is None or headers.get('upgrade', '').lower() != 'websocket':
+            return await self._respond(writer, 400, 'text/plain', b'Expected a WebSocket upgrade', 'Bad Request')
+        accept = base64.b64encode(hashlib.sha1(key.encode('latin-1') + WEBSOCKET_GUID).digest())
+        writer.write(b'HTTP/1.1 101 Switching Protocols\r\nUpgrade: websocket\r\nConnection: Upgrade\r\n'
+                     b'Sec-WebSocket-Accept: ' + accept + b'\r\n\r\n')
+        await writer.drain()
+        raw_frames = web_server.delta_frames if delta else web_server.raw_frames
+        watcher = self._watcher(raw_frames)
+        receiving = asyncio.ensure_future(self._websocket_receive(reader, writer))
+        raw_frames.subscribe()
+        try:
+            seq = 0
+            keyframe_seq = 0 if delta else None  # Deltas only decode against the keyframe they follow, so track it
+            while not raw_frames.closed and not receiving.done():
+                if not await watcher.wait(seq, timeout=1.0):
+                    continue
+                # Already packed on the acquisition thread; a keyframe comes first if this client hasn't had it yet
+                seq, data = raw_frames.get(seq, timeout=0, keyframe_seq=keyframe_seq)
+                if data is None:  # Nothing packed since the stream was last idle
+                    await watcher.next(timeout=1.0)
+                    continue
+                if delta and is_keyframe(data):
+                    keyframe_seq = seq
+                writer.write(_websocket_frame(data))
+                await writer.drain()
+        finally:
+            raw_frames.unsubscribe()
+            receiving.cancel()
+
+    async def _websocket_receive(self, reader, writer):
+        """Answer pings and return once the client closes the socket; browsers don't send anything else here"""
+        try:
+            while True:
+                opcode, payload = await _read_websocket_frame(reader)
+                if opcode == WS_PING:
+                    writer.write(_websocket_frame(payload, WS_PONG))
+                elif opcode == WS_CLOSE:
+                    writer.write(_websocket_frame(payload[:2], WS_CLOSE))
+                    return
+        except (ConnectionError, asyncio.IncompleteReadError):
+            return
+
+    def shutdown(self):
+        """Stop the camera loop and the server, and end every stream"""
+        web_server.thermcam = None
+        web_server.hub.close()
+        web_server.renditions.close()
+        web_server.raw_frames.close()
+        web_server.delta_frames.close()
+        if self._server is not None:
+            self._server.close()  # Ends serve_forever; the streams see their hubs close and finish on their own
+
+
+async def serve(host:str, port:int = 8000):
+    """Serve web_server's camera (set up with web_server.setup_camera) until /exit is requested"""
+    await AsyncStreamServer().serve(host, port)
+
+
+def start_server(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None, subpages:bool = False,
+                 rollup_path:str = ROLLUP_PATH, burst_seconds=None):
+    web_server.start_server(output_folder=output_folder, sensor=sensor, use_asyncio=True, subpages=subpages,
+                            rollup_path=rollup_path, burst_seconds=burst_seconds)
+
+
+# If this is the main thread, simply start the server
+# Optionally pass 'synthetic' or a file of recorded frames to run without the camera, and --subpages or --burst as for web_server.py
+if __name__ == '__main__':
+    import sys
+    args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+    start_server(sensor=args[0] if args else None, subpages='--subpages' in sys.argv, rollup_path=None if args else ROLLUP_PATH,
+                 burst_seconds=BURST_SECONDS if '--burst' in sys.argv else None)
@@ -0,0 +1,208 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Pre-trigger burst capture for the MLX90640 Thermal Camera
+# Keeps the last few seconds of raw frames in memory, to record what led up to a save or an alarm as well as what followed
+##################################
+import math, os, time, queue, threading, logging, traceback
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+    from pithermalcam.recording import RecordingWriter
+    from pithermalcam.snapshots import SnapshotNames
+    from pithermalcam.metrics import Metrics
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+    from recording import RecordingWriter
+    from snapshots import SnapshotNames
+    from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+SCALE = 0.01  # Frames are held as int16 hundredths of a degree C, as recordings store them
+FRAME_BYTES = SENSOR_ROWS*SENSOR_COLS*np.dtype(np.int16).itemsize
+BURST_SECONDS = (10.0, 5.0)  # A sensible (pre, post) trigger window, e.g. for web_server.py --burst
+
+
+class BurstCapture:
+    """
+    A fixed-size ring of the most recent raw frames, from which trigger() saves the pre_seconds before it and the
+    post_seconds after it as a recording (see recording.py) in output_folder, named burst_<date>_<time>.rec.
+    Register update() with pithermalcam.add_raw_frame_consumer. The ring holds (pre_seconds + 2*post_seconds) of frames,
+    as int16 centi-degrees, but never more than max_memory bytes; if that's too small the pre-trigger window is shortened,
+    and then the extensions below. It's sized for frame_rate to begin with; after that how many seconds it holds is
+    worked out from the timestamps of the frames in it, and it grows if frames come faster than that (as far as max_memory
+    allows). Once the post-trigger frames are in, the window is copied out of the ring on the acquisition thread and
+    written to disk on a background thread, so neither the trigger nor acquisition waits on the SD card.
+    A trigger while a burst is still collecting its post-trigger frames extends that burst rather than starting another,
+    by up to another post_seconds (the extra ring space is for that).
+    At most max_pending bursts wait to be written at once; more are dropped, counted as bursts_dropped.
+    """
+
+    def __init__(self, output_folder:str, pre_seconds:float = 10.0, post_seconds:float = 5.0, frame_rate:float = 8.0,
+                 max_memory:int = 8*2**20, dtype:str = 'int16', max_pending:int = 4, metrics=None):
+        if pre_seconds < 0 or post_seconds < 0:
+            raise ValueError('Burst windows cannot be negative')
+        self.output_folder = output_folder
+        self.pre_seconds = pre_seconds
+        self.post_seconds = post_seconds
+        self.dtype = dtype
+        self.metrics = Metrics() if metrics is None else metrics
+        self.frame_rate = frame_rate  # Only until there are frames to measure the rate from
+        self._wanted = pre_seconds + 2*post_seconds  # Seconds the ring should hold
+        self._max_capacity = max_memory//FRAME_BYTES
+        self._capped = False
+        capacity = self._capacity_for(1/frame_rate)
+        if capacity < 2:
+            raise ValueError(f'A burst needs at least {2*FRAME_BYTES} bytes of memory')
+        self._frames = np.zeros((capacity, SENSOR_ROWS, SENSOR_COLS), dtype=np.int16)
+        self._seqs = np.zeros(capacity, dtype=np.int64)
+        self._timestamps = np.full(capacity, -np.inf)
+        self._count = 0
+        self._latest = -np.inf
+        self._scaled = np.zeros((SENSOR_ROWS, SENSOR_COLS), dtype=np.float32)
+        self._lock = threading.Lock()
+        self._collecting = None  # The burst still waiting for post-trigger frames: {'path', 'start', 'end', 'reason'}
+        self._names = SnapshotNames('burst_', '.rec')
+        self._queue = queue.Queue(max_pending)
+        self._thread = None
+        self.last_path = None
+
+    @property
+    def capacity(self):
+        """Frames the ring holds"""
+        return len(self._frames)
+
+    @property
+    def window(self):
+        """The longest stretch the ring holds, in seconds, at the rate frames have been coming in"""
+        return (self.capacity - 1)*self._frame_period()
+
+    def _frame_period(self):
+        """Mean seconds between the frames in the ring, or 1/frame_rate until there are two"""
+        held = min(self._count, self.capacity)
+        if held < 2:
+            return 1/self.frame_rate
+        oldest = self._timestamps[self._count % self.capacity if self._count >= self.capacity else 0]
+        return (self._latest - oldest)/(held - 1)
+
+    def _capacity_for(self, frame_period:float):
+        """Frames needed to hold the wanted seconds at frame_period apart, or as many as max_memory allows"""
+        wanted = math.ceil(self._wanted/frame_period) + 1 if frame_period > 0 else self._max_capacity
+        if wanted > self._max_capacity and not self._capped:
+            self._capped = True
+            logger.warning(f'Burst memory limited to {self._max_capacity*FRAME_BYTES} bytes: '
+                           f'only {(self._max_capacity - 1)*frame_period:.1f}s of frames kept')
+        return min(wanted, self._max_capacity)
+
+    def _grow(self, capacity:int):
+        """With the lock held: move the frames into a bigger ring, oldest first"""
+        order = np.argsort(self._seqs)  # Only called once the ring is full
+        frames = np.zeros((capacity, SENSOR_ROWS, SENSOR_COLS), dtype=np.int16)
+        seqs = np.zeros(capacity, dtype=np.int64)
+        timestamps = np.full(capacity, -np.inf)
+        frames[:len(order)], seqs[:len(order)], timestamps[:len(order)] = self._frames[order], self._seqs[order], self._timestamps[order]
+        self._frames, self._seqs, self._timestamps = frames, seqs, timestamps
+        self._count = len(order)
+
+    @property
+    def memory(self):
+        """Bytes the ring takes"""
+        return self._frames.nbytes
+
+    @property
+    def pending(self):
+        """Bursts triggered and not yet written, including one still collecting frames"""
+        return self._queue.unfinished_tasks + (self._collecting is not None)
+
+    def update(self, seq:int, timestamp:float, frame):
+        """Consumer entry point: keep one raw frame, and hand off a burst whose post-trigger window it completes"""
+        np.multiply(np.reshape(frame, (SENSOR_ROWS, SENSOR_COLS)), 1/SCALE, out=self._scaled)
+        np.rint(self._scaled, out=self._scaled)
+        np.clip(self._scaled, -32768, 32767, out=self._scaled)
+        with self._lock:
+            # Before overwriting the oldest frame, check the ring still reaches back far enough at the rate frames come in
+            if self._count >= self.capacity and self.capacity < self._max_capacity and self.window < self._wanted:
+                # With a quarter to spare, so jitter in the frame rate doesn't mean growing a frame at a time
+                self._grow(self._capacity_for(self._frame_period()/1.25))
+            index = self._count % self.capacity
+            np.copyto(self._frames[index], self._scaled, casting='unsafe')
+            self._seqs[index] = seq
+            self._timestamps[index] = timestamp
+            self._count += 1
+            self._latest = timestamp
+            self._finish_if_complete()
+
+    def trigger(self, reason:str = 'manual', timestamp:float = None):
+        """
+        Save the frames from pre_seconds before timestamp (a time.monotonic() value, now by default) to post_seconds
+        after it. Returns the path the recording will be written to, which is the current burst's if one's still collecting.
+        """
+        timestamp = time.monotonic() if timestamp is None else timestamp
+        with self._lock:
+            burst = self._collecting
+            if burst is not None:
+                # Extend the burst being collected, as far as the ring can hold it
+                burst['end'] = min(max(burst['end'], timestamp + self.post_seconds), burst['start'] + self.window)
+                burst['reason'] += f', {reason}'
+            else:
+                path = self._names.next(self.output_folder) + '.rec'
+                start = max(timestamp - self.pre_seconds, timestamp + self.post_seconds - self.window)
+                burst = self._collecting = {'path': path, 'start': start, 'end': timestamp + self.post_seconds, 'reason': reason}
+                self.metrics.inc('bursts_triggered')
+                logger.info(f'Burst capture triggered by {reason}; saving to {path}')
+            self.last_path = burst['path']
+            self._finish_if_complete()
+        return burst['path']
+
+    def _finish_if_complete(self):
+        """With the lock held: once the newest frame is past the collecting burst's end, copy its frames out and queue them"""
+        burst = self._collecting
+        if burst is None or self._latest < burst['end']:
+            return
+        self._collecting = None
+        keep = (self._timestamps >= burst['start']) & (self._timestamps <= burst['end'])
+        order = np.flatnonzero(keep)[np.argsort(self._seqs[keep])]
+        burst.update(frames=self._frames[order], seqs=self._seqs[order], timestamps=self._timestamps[order])
+        try:
+            self._queue.put_nowait(burst)
+        except queue.Full:
+            self.metrics.inc('bursts_dropped')
+            logger.warning(f"Burst {burst['path']} dropped; {self._queue.maxsize} are still waiting to be written")
+            return
+        if self._thread is None or not self._thread.is_alive():
+            self._thread = threading.Thread(target=self._run, name='pithermalcam-bursts')
+            self._thread.daemon = True
+            self._thread.start()
+
+    def _run(self):
+        while True:
+            burst = self._queue.get()
+            try:
+                with self.metrics.time('burst_write'):
+                    self._write(burst)
+                self.metrics.inc('bursts_saved')
+                print(f"Burst of {len(burst['frames'])} frames ({burst['reason']}) saved to {burst['path']}")
+            except Exception:
+                self.metrics.inc('burst_errors')
+                logger.warning(traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    def _write(self, burst:dict):
+        os.makedirs(os.path.dirname(burst['path']) or '.', exist_ok=True)
+        writer = RecordingWriter(burst['path'], dtype=self.dtype)
+        try:
+            for seq, timestamp, frame in zip(burst['seqs'], burst['timestamps'], burst['frames']):
+                writer.write(int(seq), float(timestamp), frame*np.float32(SCALE))
+        finally:
+            writer.close()
+
+    def flush(self, timeout:float = None):
+        """Wait until every burst already handed off is written, or timeout seconds pass; returns whether they all were"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
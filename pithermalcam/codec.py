@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Temporal delta codec for raw MLX90640 frames
+# Quantizes to centi-degrees, stores most frames as the difference from the last keyframe, and deflates the result
+##################################
+import zlib
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+
+SCALE = 0.01  # C per stored unit
+KEYFRAME, DELTA = 0, 1
+
+
+def _shuffle(values):
+    """int16 values as all their low bytes then all their high bytes, which deflate much better for small numbers"""
+    return values.astype('<i2').view(np.uint8).reshape(-1, 2).T.tobytes()
+
+
+def _unshuffle(data:bytes, count:int):
+    planes = np.frombuffer(data, dtype=np.uint8).reshape(2, count)
+    return np.ascontiguousarray(planes.T).view('<i2').reshape(-1)
+
+
+def quantize(frame):
+    """Temperatures in C as int32 centi-degrees"""
+    return np.rint(np.reshape(frame, (-1,))/SCALE).astype(np.int32)
+
+
+class FrameEncoder:
+    """
+    Compresses a sequence of frames. Every keyframe_interval-th frame is a keyframe, stored whole; the rest store their
+    difference from the last keyframe, so any frame decodes from itself and its keyframe alone and a reader can join
+    at any keyframe. Each encoded frame is one kind byte followed by the deflated, byte-shuffled int16 values.
+    Quantizing to 0.01C is the only loss.
+    """
+
+    def __init__(self, keyframe_interval:int = 32, level:int = 6):
+        self.keyframe_interval = keyframe_interval
+        self.level = level
+        self._keyframe = None
+        self._since_keyframe = 0
+
+    def reset(self):
+        """Make the next frame a keyframe"""
+        self._keyframe = None
+
+    def encode(self, frame):
+        """Encode one frame of temperatures in C. Returns (is_keyframe, bytes)."""
+        values = quantize(frame)
+        if self._keyframe is not None and self._since_keyframe < self.keyframe_interval:
+            delta = values - self._keyframe
+            if np.abs(delta).max() <= 32767:
+                self._since_keyframe += 1
+                return False, bytes((DELTA,)) + zlib.compress(_shuffle(delta), self.level)
+        # Keyframe: first frame, interval reached, or a change too big for int16
+        np.clip(values, -32768, 32767, out=values)
+        self._keyframe = values
+        self._since_keyframe = 1
+        return True, bytes((KEYFRAME,)) + zlib.compress(_shuffle(values), self.level)
+
+
+class FrameDecoder:
+    """Decodes FrameEncoder output, remembering the last keyframe for the delta frames that follow it"""
+
+    def __init__(self, shape=(SENSOR_ROWS, SENSOR_COLS)):
+        self.shape = shape
+        self._keyframe = None
+
+    @staticmethod
+    def is_keyframe(data:bytes):
+        return data[0] == KEYFRAME
+
+    def decode(self, data:bytes, out=None):
+        """Decode one frame into out (a new float32 array if not given) in C. Raises ValueError for a delta without its keyframe."""
+        values = _unshuffle(zlib.decompress(data[1:]), self.shape[0]*self.shape[1])
+        if data[0] == KEYFRAME:
+            self._keyframe = values.astype(np.int32)
+            values = self._keyframe
+        elif self._keyframe is None:
+            raise ValueError('Delta frame before any keyframe')
+        else:
+            values = self._keyframe + values
+        return np.multiply(values.reshape(self.shape), SCALE, out=out, dtype=np.float32, casting='unsafe')
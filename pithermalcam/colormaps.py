@@ -0,0 +1,74 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Colormap lookup tables for the MLX90640 Thermal Camera
+# Each map is built once and reused, rather than rebuilt through cmapy/matplotlib every frame
+##################################
+import threading
+import numpy as np
+import cmapy
+
+
+class ColormapRegistry:
+    """
+    Cache of cv2.applyColorMap user LUTs, (256,1,3) uint8 arrays in BGR order, keyed by colormap name.
+    Any matplotlib colormap name works (see cmapy), as does any map added with register().
+    Appending '_r' to a name gives the reversed map.
+    """
+
+    def __init__(self):
+        self._luts = {}
+        self._custom = {}
+        self._lock = threading.Lock()
+
+    def get(self, name:str):
+        """Return the LUT for a colormap, building it on first use"""
+        lut = self._luts.get(name)
+        if lut is None:
+            with self._lock:
+                lut = self._luts.get(name)
+                if lut is None:
+                    lut = self._build(name)
+                    self._luts[name] = lut
+        return lut
+
+    def register(self, name:str, colors, rgb_order:bool = True):
+        """
+        Add or replace a custom colormap. colors is either a full 256-entry LUT or a list of control colors
+        (0-255 per channel) that get linearly interpolated from the coldest to the hottest end.
+        Colors are RGB by default, set rgb_order to False if they are already BGR.
+        """
+        colors = np.asarray(colors, dtype=np.float64).reshape(-1, 3)
+        if len(colors) < 2:
+            raise ValueError('A colormap needs at least two colors')
+        if len(colors) != 256:
+            positions = np.linspace(0, 1, len(colors))
+            steps = np.linspace(0, 1, 256)
+            colors = np.stack([np.interp(steps, positions, colors[:, channel]) for channel in range(3)], axis=1)
+        if rgb_order:
+            colors = colors[:, ::-1]
+        lut = np.ascontiguousarray(np.clip(np.rint(colors), 0, 255).astype(np.uint8).reshape(256, 1, 3))
+        lut.setflags(write=False)
+        with self._lock:
+            self._custom[name] = lut
+            # Drop anything cached under this name, including its reversed version
+            self._luts.pop(name, None)
+            self._luts.pop(name + '_r', None)
+
+    def names(self):
+        """Names of the colormaps built or registered so far"""
+        return sorted(set(self._luts) | set(self._custom))
+
+    def _build(self, name:str):
+        if name in self._custom:
+            return self._custom[name]
+        if name.endswith('_r') and name[:-2] in self._custom:
+            lut = np.ascontiguousarray(self._custom[name[:-2]][::-1])
+        else:
+            lut = cmapy.cmap(name)
+        lut.setflags(write=False)
+        return lut
+
+
+# Shared by every camera instance in the process, so each LUT is only ever built once
+colormaps = ColormapRegistry()
@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Temporal noise filtering for the MLX90640 Thermal Camera
+# Smooths each of the 768 pixels over time, at sensor resolution, before anything is upscaled
+##################################
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+
+# 'bilateral' smooths the finished image spatially (FramePipeline.render); 'temporal' smooths the temperatures over time
+FILTER_MODES = ('off', 'bilateral', 'temporal')
+_ON, _OFF = ('1', 'true', 'on', 'yes'), ('0', 'false', 'no', 'none', '')
+
+
+def filter_mode(value):
+    """Normalize a filter setting to one of FILTER_MODES. True and False, the original on/off switch, mean bilateral and off."""
+    if isinstance(value, str):
+        value = value.lower()
+        if value in FILTER_MODES:
+            return value
+        if value in _ON:
+            return 'bilateral'
+        if value in _OFF:
+            return 'off'
+        raise ValueError(f'filter must be one of {", ".join(FILTER_MODES)}')
+    return 'bilateral' if value else 'off'
+
+
+class TemporalFilter:
+    """
+    A scalar Kalman filter per pixel, run on all of them at once. Each pixel's estimate is pulled toward every new
+    reading by a gain that settles where the sensor noise and the expected drift balance out (about 0.2 with the
+    defaults, averaging roughly the last ten frames). A reading further from its estimate than motion_threshold
+    standard deviations is taken as a real change, e.g. something moving through the view, and replaces the estimate
+    outright, so moving edges don't smear while static areas stay quiet.
+    noise and drift are standard deviations in C: the sensor's frame-to-frame noise and how far the true temperature
+    may wander between frames. Non-finite readings pass straight through.
+    """
+
+    def __init__(self, noise:float = 0.25, drift:float = 0.05, motion_threshold:float = 3.0, shape=(SENSOR_ROWS, SENSOR_COLS)):
+        self.noise = noise
+        self.drift = drift
+        self.motion_threshold = motion_threshold
+        self.shape = tuple(shape)
+        self._estimate = np.zeros(self.shape, dtype=np.float32)
+        self._variance = np.zeros(self.shape, dtype=np.float32)
+        self._innovation = np.empty(self.shape, dtype=np.float32)
+        self._gain = np.empty(self.shape, dtype=np.float32)
+        self._scratch = np.empty(self.shape, dtype=np.float32)
+        self._still = np.empty(self.shape, dtype=bool)
+        self._started = False
+
+    def reset(self):
+        """Start again from the next frame"""
+        self._started = False
+
+    def update(self, frame, out=None):
+        """Take in one frame of temperatures in C and return the filtered frame, written into out if given"""
+        frame = np.reshape(frame, self.shape)
+        estimate, variance = self._estimate, self._variance
+        r = self.noise*self.noise
+        if not self._started:
+            np.copyto(estimate, frame)
+            variance.fill(r)
+            self._started = True
+        else:
+            variance += self.drift*self.drift
+            innovation = np.subtract(frame, estimate, out=self._innovation)
+            # Still pixels: innovation^2 within threshold^2 * (variance + r). NaN compares False, so passes through as motion.
+            limit = np.add(variance, r, out=self._scratch)
+            np.divide(variance, limit, out=self._gain)
+            limit *= self.motion_threshold*self.motion_threshold
+            np.less_equal(np.square(innovation, out=innovation), limit, out=self._still)
+            np.subtract(frame, estimate, out=innovation)
+            innovation *= self._gain
+            estimate += innovation
+            variance *= np.subtract(1, self._gain, out=self._gain)
+            np.invert(self._still, out=self._still)  # Now the moving pixels, which take the reading as it is
+            np.copyto(estimate, frame, where=self._still)
+            np.copyto(variance, r, where=self._still)
+        if out is None:
+            return estimate.copy()
+        np.copyto(out, estimate.reshape(np.shape(out)))
+        return out
@@ -0,0 +1,41 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Precomputed spline interpolation for the MLX90640 Thermal Camera
+# Does the same upscaling as scipy's ndimage.zoom as two small matrix multiplies per frame
+##################################
+import numpy as np
+from scipy import ndimage
+
+
+def zoom_matrix(in_size:int, out_size:int, order:int = 3):
+    """
+    The (out_size, in_size) matrix that resamples a 1-D signal exactly as ndimage.zoom does.
+    zoom is linear, so column i is simply the zoom of a unit impulse at position i.
+    """
+    impulses = np.eye(in_size)
+    return np.stack([ndimage.zoom(impulses[i], out_size/in_size, order=order) for i in range(in_size)], axis=1)
+
+
+class SeparableZoom:
+    """
+    ndimage.zoom for a fixed input and output shape, precomputed. zoom's spline prefilter and interpolation work along
+    each axis separately, so the whole operation is rows @ frame @ cols; building the two matrices costs a few
+    scipy calls once, and every frame after that is a pair of small float32 matrix multiplies.
+    With flip_horizontal set, the result is also mirrored left-right for free by reversing the column operator.
+    """
+
+    def __init__(self, in_shape, out_shape, order:int = 3, flip_horizontal:bool = False):
+        self.in_shape = tuple(in_shape)
+        self.out_shape = tuple(out_shape)
+        self.rows = zoom_matrix(in_shape[0], out_shape[0], order).astype(np.float32)
+        cols = zoom_matrix(in_shape[1], out_shape[1], order)
+        if flip_horizontal:
+            cols = cols[::-1]
+        self.cols = np.ascontiguousarray(cols.T, dtype=np.float32)
+        self._partial = np.empty((out_shape[0], in_shape[1]), dtype=np.float32)
+
+    def __call__(self, frame, out=None):
+        """Interpolate frame, writing into out (a float32 array of out_shape) if given"""
+        np.matmul(self.rows, frame, out=self._partial)
+        return np.matmul(self._partial, self.cols, out=out)
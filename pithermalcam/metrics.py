@@ -0,0 +1,137 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Performance metrics for the MLX90640 Thermal Camera
+# Per-stage latency histograms and frame/client counters, readable from Python or as Prometheus-style text
+##################################
+import time, threading
+from contextlib import contextmanager
+import numpy as np
+
+# Stages timed along the way from sensor to browser, in pipeline order
+STAGES = ('i2c_read', 'denoise', 'rescale', 'colormap', 'resize', 'filter', 'overlay', 'jpeg_encode', 'network_send')
+# Upper bounds of the histogram buckets, in seconds
+BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5)
+
+
+class LatencyHistogram:
+    """
+    Latency samples for one stage. Bucket counts, count and sum cover everything since startup;
+    the last `window` samples are also kept so percentiles reflect recent behaviour.
+    """
+
+    def __init__(self, window:int = 512):
+        self._window = np.zeros((window,), dtype=np.float64)
+        self._buckets = np.zeros((len(BUCKETS) + 1,), dtype=np.int64)  # Last one is +Inf
+        self._bounds = np.array(BUCKETS)
+        self.count = 0
+        self.sum = 0.0
+        self._lock = threading.Lock()
+
+    def observe(self, seconds:float):
+        with self._lock:
+            self._window[self.count % len(self._window)] = seconds
+            self._buckets[np.searchsorted(self._bounds, seconds)] += 1
+            self.count += 1
+            self.sum += seconds
+
+    def recent(self):
+        """The samples currently in the rolling window"""
+        with self._lock:
+            return self._window[:min(self.count, len(self._window))].copy()
+
+    def cumulative_buckets(self):
+        """(upper bound, count of samples at or under it) pairs, ending with +Inf"""
+        with self._lock:
+            counts = np.cumsum(self._buckets)
+        return list(zip(BUCKETS + (float('inf'),), counts.tolist()))
+
+    def summary(self):
+        """Rolling-window statistics in seconds, plus totals since startup"""
+        recent = self.recent()
+        result = {'count': self.count, 'sum': self.sum, 'window': len(recent)}
+        if len(recent):
+            p50, p90, p99 = np.percentile(recent, (50, 90, 99))
+            result.update(mean=float(recent.mean()), p50=float(p50), p90=float(p90), p99=float(p99), max=float(recent.max()))
+        return result
+
+
+class Metrics:
+    """
+    Registry of stage latencies, counters and gauges for one camera.
+    Stages are timed with observe()/time(); counters only go up; gauges are set to a value or to a function
+    that's called whenever the metrics are read (e.g. to count connected clients).
+    """
+
+    def __init__(self, window:int = 512):
+        self._window = window
+        self._histograms = {}
+        self._counters = {}
+        self._gauges = {}
+        self._lock = threading.Lock()
+
+    def histogram(self, stage:str):
+        histogram = self._histograms.get(stage)
+        if histogram is None:
+            with self._lock:
+                histogram = self._histograms.setdefault(stage, LatencyHistogram(self._window))
+        return histogram
+
+    def observe(self, stage:str, seconds:float):
+        self.histogram(stage).observe(seconds)
+
+    def lap(self, stage:str, start:float):
+        """Record the time since start (a time.perf_counter() value) against stage, and return the current perf_counter"""
+        now = time.perf_counter()
+        self.observe(stage, now - start)
+        return now
+
+    @contextmanager
+    def time(self, stage:str):
+        """Time the body of a with block"""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(stage, time.perf_counter() - start)
+
+    def inc(self, counter:str, amount:int = 1):
+        with self._lock:
+            self._counters[counter] = self._counters.get(counter, 0) + amount
+
+    def set_gauge(self, gauge:str, value):
+        self._gauges[gauge] = value
+
+    def _gauge_values(self):
+        return {name: (value() if callable(value) else value) for name, value in list(self._gauges.items())}
+
+    def summary(self):
+        """All metrics as a dict: per-stage latency summaries (seconds), counters and gauges"""
+        ordered = [stage for stage in STAGES if stage in self._histograms] + sorted(set(self._histograms) - set(STAGES))
+        return {'stages': {stage: self._histograms[stage].summary() for stage in ordered},
+                'counters': dict(self._counters),
+                'gauges': self._gauge_values()}
+
+    def render_text(self, prefix:str = 'pithermalcam'):
+        """Render all metrics in the Prometheus text exposition format"""
+        lines = [f'# HELP {prefix}_stage_seconds Time spent in each processing stage since startup.',
+                 f'# TYPE {prefix}_stage_seconds histogram']
+        summary = self.summary()
+        for stage in summary['stages']:
+            histogram = self._histograms[stage]
+            for bound, count in histogram.cumulative_buckets():
+                le = '+Inf' if bound == float('inf') else repr(bound)
+                lines.append(f'{prefix}_stage_seconds_bucket{{stage="{stage}",le="{le}"}} {count}')
+            lines.append(f'{prefix}_stage_seconds_sum{{stage="{stage}"}} {histogram.sum:.6f}')
+            lines.append(f'{prefix}_stage_seconds_count{{stage="{stage}"}} {histogram.count}')
+        lines += [f'# HELP {prefix}_stage_recent_seconds Percentiles over the most recent samples of each stage.',
+                  f'# TYPE {prefix}_stage_recent_seconds summary']
+        for stage, stats in summary['stages'].items():
+            for quantile in ('p50', 'p90', 'p99'):
+                if quantile in stats:
+                    lines.append(f'{prefix}_stage_recent_seconds{{stage="{stage}",quantile="0.{quantile[1:]}"}} {stats[quantile]:.6f}')
+        for name, value in sorted(summary['counters'].items()):
+            lines += [f'# TYPE {prefix}_{name}_total counter', f'{prefix}_{name}_total {value}']
+        for name, value in sorted(summary['gauges'].items()):
+            lines += [f'# TYPE {prefix}_{name} gauge', f'{prefix}_{name} {value}']
+        return '\n'.join(lines) + '\n'
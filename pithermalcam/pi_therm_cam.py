@@ -3,14 +3,36 @@
 ##################################
 # MLX90640 Thermal Camera w Raspberry Pi
 ##################################
-import time,board,busio, traceback
+import time, traceback
 import numpy as np
-import adafruit_mlx90640
-import datetime as dt
 import cv2
 import logging
-import cmapy
-from scipy import ndimage
+try:  # If called as an imported module
+    from pithermalcam.sensors import get_sensor
+    from pithermalcam.colormaps import colormaps
+    from pithermalcam.pipeline import FramePipeline
+    from pithermalcam.acquisition import Acquisition, READ_ERRORS
+    from pithermalcam.recording import RecordingWriter
+    from pithermalcam.metrics import Metrics
+    from pithermalcam.denoise import TemporalFilter, FILTER_MODES, filter_mode
+    from pithermalcam.roi import RoiStats
+    from pithermalcam.alarms import AlarmEngine
+    from pithermalcam.rollup import RollupStore
+    from pithermalcam.snapshots import SnapshotWriter
+    from pithermalcam.burst import BurstCapture
+except ImportError:  # If run directly
+    from sensors import get_sensor
+    from colormaps import colormaps
+    from pipeline import FramePipeline
+    from acquisition import Acquisition, READ_ERRORS
+    from recording import RecordingWriter
+    from metrics import Metrics
+    from denoise import TemporalFilter, FILTER_MODES, filter_mode
+    from roi import RoiStats
+    from alarms import AlarmEngine
+    from rollup import RollupStore
+    from snapshots import SnapshotWriter
+    from burst import BurstCapture
 
 # Set up logging
 logging.basicConfig(filename='pithermcam.log',filemode='a',
@@ -27,40 +49,143 @@ class pithermalcam:
     _current_frame_processed=False  # Tracks if the current processed image matches the current raw image
     i2c=None
     mlx=None
+    sensor=None
     clamp_temp_min = 0
     clamp_temp_max = 100
     _temp_min=None
     _temp_max=None
     _raw_image=None
+    _temps=None
+    _raw_seq=0
+    _stale=False
+    _last_pull=None
     _image=None
+    _recorder=None
     _file_saved_notification_start=None
     _displaying_onscreen=False
     _exit_requested=False
 
-    def __init__(self,use_f:bool = False, filter_image:bool = False, image_width:int=1200,
-                image_height:int=900, output_folder:str = '/home/pi/pithermalcam/saved_snapshots/'):
+    def __init__(self,use_f:bool = False, filter_image = False, image_width:int=1200,
+                image_height:int=900, output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None,
+                preallocate:bool = False, acquisition_thread:bool = False, buffer_frames:int = 16, subpages:bool = False,
+                wait_for_first_frame:bool = True, retry_policy=None, rollup_path:str = None, snapshot_format:str = 'npz',
+                burst_seconds=None, burst_memory:int = 8*2**20):
         self.use_f=use_f
         self.filter_image=filter_image
         self.image_width=image_width
         self.image_height=image_height
         self.output_folder=output_folder
+        self.snapshot_format=snapshot_format
 
+        self._colormap_list = list(self._colormap_list)  # Per-instance copy so added colormaps don't leak between cameras
         self._colormap_index = 0
         self._interpolation_index = 3
-        self._setup_therm_cam()
+        self.metrics = Metrics()  # Stage timings and frame counters; see get_metrics()
+        # Snapshots are written on a background thread, so saving never holds up the frame loop; see save_image()
+        self._snapshots = SnapshotWriter(output_folder, raw_format=snapshot_format, metrics=self.metrics)
+        # With preallocate, frames are drawn into two alternating buffers; otherwise each frame is a new array
+        self._pipeline = FramePipeline(800, 600, preallocate=preallocate, metrics=self.metrics)
+        # Temporal filtering works on the 24x32 temperatures, so it's run on every frame pulled whatever the mode,
+        # keeping it settled for any view that switches to it
+        self._denoiser = TemporalFilter()
+        self._denoised = np.zeros_like(self._pipeline.temps)
+        self._setup_therm_cam(sensor, buffer_frames, subpages, retry_policy)
+        # Statistics for named regions, worked out on every frame read whether or not anything's rendered; see get_roi_stats()
+        self.rois = RoiStats()
+        self.add_raw_frame_consumer(self.rois.update)
+        # Alarm rules, also evaluated on every frame read; see thermcam.alarms.add_rule and add_callback
+        self.alarms = AlarmEngine(rois=self.rois)
+        self.add_raw_frame_consumer(self.alarms.update)
+        # Per-second, minute and hour min/max/mean of the frame and each region, saved to rollup_path if given; see get_history
+        self.rollup = RollupStore(rois=self.rois, path=rollup_path)
+        self.add_raw_frame_consumer(self.rollup.update)
+        # With burst_seconds (pre, post) given, the last pre seconds of frames are kept in memory and saved with the
+        # post seconds after each snapshot or alarm; off by default
+        self.burst = None
+        if burst_seconds is not None:
+            self.burst = BurstCapture(output_folder, *burst_seconds, frame_rate=1/self._acquisition_period(),
+                                      max_memory=burst_memory, metrics=self.metrics)
+            self.add_raw_frame_consumer(self.burst.update)
+            self.alarms.add_callback(self._burst_on_alarm)
+        if acquisition_thread:
+            self.start_acquisition()
         self._t0 = time.time()
-        self.update_image_frame()
+        if wait_for_first_frame:  # Otherwise the first frame is read whenever one's first asked for
+            self.update_image_frame()
+
+    @property
+    def filter_image(self):
+        """The filter mode, one of 'off', 'bilateral' and 'temporal'; True and False still work when setting it"""
+        return self._filter_image
+
+    @filter_image.setter
+    def filter_image(self, value):
+        self._filter_image = filter_mode(value)
 
     def __del__(self):
         logger.debug("ThermalCam Object deleted.")
 
-    def _setup_therm_cam(self):
-        """Initialize the thermal camera"""
-        # Setup camera
-        self.i2c = busio.I2C(board.SCL, board.SDA, frequency=800000)  # setup I2C
-        self.mlx = adafruit_mlx90640.MLX90640(self.i2c)  # begin MLX90640 with I2C comm
-        self.mlx.refresh_rate = adafruit_mlx90640.RefreshRate.REFRESH_8_HZ  # set refresh rate
-        time.sleep(0.1)
+    def _setup_therm_cam(self, sensor=None, buffer_frames:int = 16, subpages:bool = False, retry_policy=None):
+        """
+        Initialize the thermal camera, or whichever sensor backend was passed in to stand in for it.
+        With subpages, a new frame is published after each half of the sensor's chess pattern rather than each whole frame.
+        retry_policy (an acquisition.RetryPolicy) sets how failed reads are retried.
+        """
+        # Setup camera; defaults to the MLX90640 over I2C at 8Hz
+        self.sensor = get_sensor(sensor)
+        self.mlx = self.sensor  # Backends share the driver's getFrame interface
+        self.i2c = getattr(self.sensor, 'i2c', None)
+        # All reads go through here into a ring of recent raw frames, whether on a background thread or not
+        self._acquisition = Acquisition(self.sensor, capacity=buffer_frames, metrics=self.metrics, subpages=subpages,
+                                        retry_policy=retry_policy)
+        self.metrics.set_gauge('frame_stale', lambda: int(self._stale))
+
+    def _acquisition_period(self):
+        """Seconds between frames published, which is a subpage period in subpage mode"""
+        return self.sensor.subpage_period if self._acquisition.subpages else self.sensor.frame_period
+
+    def _burst_on_alarm(self, event):
+        if event['type'] == 'raised':
+            self.burst.trigger(f"alarm {event['rule']}", event['timestamp'])
+
+    def start_acquisition(self):
+        """
+        Read the sensor continuously on a background thread. Rendering, streaming and the getters then take the newest
+        buffered frame instead of reading the sensor themselves, so a slow render doesn't make us miss sensor frames.
+        """
+        self._acquisition.start()
+
+    def stop_acquisition(self):
+        """Go back to reading the sensor directly on each frame pull"""
+        self._acquisition.stop()
+
+    def add_raw_frame_consumer(self, consumer):
+        """Call consumer(seq, timestamp, temps) for every frame read, at sensor rate; see Acquisition.add_consumer"""
+        self._acquisition.add_consumer(consumer)
+
+    def remove_raw_frame_consumer(self, consumer):
+        self._acquisition.remove_consumer(consumer)
+
+    def start_recording(self, path:str, dtype:str = 'int16'):
+        """
+        Append every raw frame read from now on to a radiometric recording at path (see recording.py),
+        keeping the actual temperatures rather than a rendered image. Returns the writer.
+        """
+        self.stop_recording()
+        self._recorder = RecordingWriter(path, dtype=dtype)
+        self.add_raw_frame_consumer(self._recorder.write)
+        return self._recorder
+
+    def stop_recording(self):
+        """Stop recording and write out any frames still buffered"""
+        if self._recorder is not None:
+            self.remove_raw_frame_consumer(self._recorder.write)
+            self._recorder.close()
+            self._recorder = None
+
+    def _frame_timeout(self):
+        """How long to wait on the acquisition thread for a frame before giving up"""
+        return 2*self.sensor.frame_period + 1
 
     def _c_to_f(self,temp:float):
         """ Convert temperature from C to F """
@@ -79,62 +204,103 @@ class pithermalcam:
             self.clamp_temp_max = self.clamp_temp_max - 1
 
 
+    def _temp_range(self, temps):
+        """The min and max of temps, held within the clamp temperatures"""
+        return max(np.min(temps), self.clamp_temp_min), min(np.max(temps), self.clamp_temp_max)
+
     def get_mean_temp(self):
         """
         Get mean temp of entire field of view. Return both temp C and temp F.
         """
-        frame = np.zeros((24*32,))  # setup array for storing all 768 temperatures
-        while True:
+        if self._acquisition.running:  # Use the newest buffered frame rather than reading the sensor again
+            latest = self._acquisition.ring.wait_for(0, timeout=self._frame_timeout())
+            if latest is None:
+                raise RuntimeError('No frame from the sensor')
+            frame = latest[2]
+        else:
             try:
-                self.mlx.getFrame(frame)  # read MLX temperatures into frame var
-                break
-            except ValueError:
-                continue  # if error, just read again
+                seq = self._acquisition.read_frame()  # read MLX temperatures into the frame buffer, retrying as the policy allows
+            except tuple(READ_ERRORS):
+                seq = self._acquisition.ring.seq  # Fall back on the last good frame, if there's been one
+                if not seq:
+                    raise
+            frame = self._acquisition.ring.read(seq)[1]
 
         temp_c = np.mean(frame)
         temp_f=self._c_to_f(temp_c)
         return temp_c, temp_f
 
-    def _pull_raw_image(self):
-        """Get one pull of the raw image data, converting temp units if necessary"""
-        # Get image
-        self._raw_image = np.zeros((24*32,))
+    def get_roi_stats(self):
+        """
+        Min, max, mean and percentiles in C of each region added to self.rois (e.g. thermcam.rois.add_rectangle('pump', 4, 2, 6, 5)),
+        as of the newest frame read: {'seq', 'timestamp', 'regions': {name: {'min', 'max', 'mean', 'pixels', 'p5', 'p50', 'p95'}}}
+        """
+        if not self._acquisition.running and self._acquisition.ring.seq == 0:
+            self._pull_raw_image()
+        return self.rois.stats()
+
+    def get_history(self, region:str = 'frame', start:float = None, end:float = None, resolution:int = None):
+        """
+        Min, max and mean temperature in C of the whole frame or a region of interest over time, e.g. per minute over the
+        past day with get_history(start=-86400, resolution=60). Returns an array of rollup.RECORD_DTYPE; see RollupStore.query
+        """
+        return self.rollup.query(region, start, end, resolution)
+
+    def _pull_raw_image(self, wait:bool = True):
+        """
+        Get one pull of the raw image data, converting temp units if necessary.
+        With the acquisition thread running, take the newest buffered frame instead of reading the sensor;
+        if wait is set, block until there's one newer than the last pulled.
+        """
+        # Get image into the pipeline's temperature buffer
+        frame = self._pipeline.temps
         try:
-            self.mlx.getFrame(self._raw_image)  # read mlx90640
-            self._temp_min = np.min(self._raw_image)
-            if(self._temp_min < self.clamp_temp_min):
-                self._temp_min = self.clamp_temp_min
-            self._temp_max = np.max(self._raw_image)
-            if(self._temp_max > self.clamp_temp_max):
-                self._temp_max = self.clamp_temp_max
-            self._raw_image=self._temps_to_rescaled_uints(self._raw_image,self._temp_min,self._temp_max)
+            if self._acquisition.running:
+                latest = self._acquisition.ring.wait_for(self._raw_seq if wait else 0, timeout=self._frame_timeout(), out=frame)
+                if latest is None:
+                    self._stale = True  # The sensor's stopped delivering; keep showing the last good frame, marked as such
+                    return
+                if latest[0] == self._raw_seq:
+                    return  # Nothing new from the sensor; keep the current frame
+                # Sensor frames skipped because rendering fell behind; pauses of a second or more (nobody watching) don't count
+                if self._raw_seq and time.monotonic() - self._last_pull < 1:
+                    self.metrics.inc('frames_dropped', latest[0] - self._raw_seq - 1)
+                self._last_pull = time.monotonic()
+                self._raw_seq = latest[0]
+            else:
+                self._raw_seq = self._acquisition.read_frame()  # read mlx90640
+                self._acquisition.ring.read(self._raw_seq, out=frame)
+            with self.metrics.time('denoise'):
+                self._denoiser.update(frame, out=self._denoised)
+            self._temps = self._denoised if self.filter_image == 'temporal' else frame
+            self._temp_min, self._temp_max = self._temp_range(self._temps)
+            with self.metrics.time('rescale'):
+                self._raw_image=self._temps_to_rescaled_uints(self._temps,self._temp_min,self._temp_max)
+            self._stale = False
             self._current_frame_processed=False  # Note that the newly updated raw frame has not been processed
-        except ValueError:
-            print("Math error; continuing...")
-            self._raw_image = np.zeros((24*32,))  # If something went wrong, make sure the raw image has numbers
-            logger.info(traceback.format_exc())
-        except OSError:
-            print("IO Error; continuing...")
-            self._raw_image = np.zeros((24*32,))  # If something went wrong, make sure the raw image has numbers
+        except tuple(READ_ERRORS):
+            # Every retry failed. Keep the last good frame, marked stale, rather than flashing a blank one
+            print("Sensor read error; showing the last good frame...")
             logger.info(traceback.format_exc())
+            self._stale = True
+            self._current_frame_processed=False  # Redraw it with the stale marker
+            if self._raw_image is None:  # Nothing good yet, so make sure there's something to draw
+                self._raw_image = np.zeros((24,32), dtype=np.uint8)
+                self._temps = self._pipeline.temps
+                self._temp_min, self._temp_max = self.clamp_temp_min, self.clamp_temp_max
+
+    @property
+    def stale(self):
+        """True while the sensor is failing and the frame shown is the last good one"""
+        return self._stale
 
     def _process_raw_image(self):
         """Process the raw temp data to a colored image. Filter if necessary"""
-        # Image processing
-        # Can't apply colormap before ndimage, so reversed in first two options, even though it seems slower
-        if self._interpolation_index==5:  # Scale via scipy only - slowest but seems higher quality
-            self._image = ndimage.zoom(self._raw_image,25)  # interpolate with scipy
-            self._image = cv2.applyColorMap(self._image, cmapy.cmap(self._colormap_list[self._colormap_index]))
-        elif self._interpolation_index==6:  # Scale partially via scipy and partially via cv2 - mix of speed and quality
-            self._image = ndimage.zoom(self._raw_image,10)  # interpolate with scipy
-            self._image = cv2.applyColorMap(self._image, cmapy.cmap(self._colormap_list[self._colormap_index]))
-            self._image = cv2.resize(self._image, (800,600), interpolation=cv2.INTER_CUBIC)
-        else:
-            self._image = cv2.applyColorMap(self._raw_image, cmapy.cmap(self._colormap_list[self._colormap_index]))
-            self._image = cv2.resize(self._image, (800,600), interpolation=self._interpolation_list[self._interpolation_index])
-        self._image = cv2.flip(self._image, 1)
-        if self.filter_image:
-            self._image=cv2.bilateralFilter(self._image,15,80,80)
+        colormap = colormaps.get(self._colormap_list[self._colormap_index])  # Cached LUT, only built the first time it's used
+        # The spline modes interpolate the real temperatures and quantize afterwards, rather than upscaling the uint8 image
+        self._image = self._pipeline.render(self._raw_image, colormap, self._interpolation_index,
+                                            self._interpolation_list[self._interpolation_index], self.filter_image,
+                                            temps=self._temps, temp_range=(self._temp_min, self._temp_max))
 
     def get_raw_image(self, size_x=180, size_y=180):
         if self._image is not None:
@@ -143,18 +309,51 @@ class pithermalcam:
 
     def _add_image_text(self):
         """Set image text content"""
-        if self.use_f:
-            temp_min=self._c_to_f(self._temp_min)
-            temp_max=self._c_to_f(self._temp_max)
-            text = f'Tmin={temp_min:+.1f}F - Tmax={temp_max:+.1f}F - FPS={1/(time.time() - self._t0):.1f} - Interpolation: {self._interpolation_list_name[self._interpolation_index]} - Colormap: {self._colormap_list[self._colormap_index]} - Filtered: {self.filter_image}'
-        else:
-            text = f'Tmin={self._temp_min:+.1f}C - Tmax={self._temp_max:+.1f}C - FPS={1/(time.time() - self._t0):.1f} - Interpolation: {self._interpolation_list_name[self._interpolation_index]} - Colormap: {self._colormap_list[self._colormap_index]} - Filtered: {self.filter_image}'
-        cv2.putText(self._image, text, (30, 18), cv2.FONT_HERSHEY_SIMPLEX, .4, (255, 255, 255), 1)
+        start = time.perf_counter()
+        self._draw_image_text(self._image, self._colormap_list[self._colormap_index], self._interpolation_index,
+                              self.filter_image, 1/(time.time() - self._t0))
         self._t0 = time.time()  # Update time to this pull
 
         # For a brief period after saving, display saved notification
         if self._file_saved_notification_start is not None and (time.monotonic()-self._file_saved_notification_start)<1:
             cv2.putText(self._image, 'Snapshot Saved!', (300,300),cv2.FONT_HERSHEY_SIMPLEX, .8, (255, 255, 255), 2)
+        self.metrics.lap('overlay', start)
+
+    def _draw_image_text(self, image, colormap:str, interpolation_index:int, filter_image:str, fps:float, temp_range=None):
+        """Write the temperature range (the camera's own unless given) and settings across the top of image, scaled to its width"""
+        scale = image.shape[1]/800
+        temp_min, temp_max = (self._temp_min, self._temp_max) if temp_range is None else temp_range
+        if self.use_f:
+            temp_min=self._c_to_f(temp_min)
+            temp_max=self._c_to_f(temp_max)
+            text = f'Tmin={temp_min:+.1f}F - Tmax={temp_max:+.1f}F - FPS={fps:.1f} - Interpolation: {self._interpolation_list_name[interpolation_index]} - Colormap: {colormap} - Filter: {filter_image}'
+        else:
+            text = f'Tmin={temp_min:+.1f}C - Tmax={temp_max:+.1f}C - FPS={fps:.1f} - Interpolation: {self._interpolation_list_name[interpolation_index]} - Colormap: {colormap} - Filter: {filter_image}'
+        cv2.putText(image, text, (round(30*scale), round(18*scale)), cv2.FONT_HERSHEY_SIMPLEX, .4*scale, (255, 255, 255), 1)
+        if self._stale:
+            cv2.putText(image, 'Sensor not responding - last good frame', (round(30*scale), round(40*scale)),
+                        cv2.FONT_HERSHEY_SIMPLEX, .5*scale, (0, 0, 255), 1)
+
+    def render_with(self, pipeline, colormap:str, interpolation_index:int, filter_image, fps:float):
+        """
+        Render the current raw frame with settings other than the camera's own (e.g. for a web client that asked for
+        its own size or colormap) into pipeline's buffers, leaving the camera's image and settings alone.
+        """
+        filter_image = filter_mode(filter_image)
+        temps, temp_range, raw_image = self._temps, (self._temp_min, self._temp_max), self._raw_image
+        if (filter_image == 'temporal') != (self.filter_image == 'temporal') and temps is not None:
+            # Temporally filtered where the camera isn't, or the other way round
+            temps = self._denoised if filter_image == 'temporal' else self._pipeline.temps
+            temp_range = self._temp_range(temps)
+            with self.metrics.time('rescale'):
+                raw_image = pipeline.rescale(temps, *temp_range)
+        image = pipeline.render(raw_image, colormaps.get(colormap), interpolation_index,
+                                self._interpolation_list[interpolation_index], filter_image,
+                                temps=temps, temp_range=temp_range)
+        with self.metrics.time('overlay'):
+            self._draw_image_text(image, colormap, interpolation_index, filter_image, fps, temp_range)
+        self.metrics.inc('frames_rendered')
+        return image
 
     def add_customized_text(self,text):
         """Add custom text to the center of the image, used mostly to notify user that server is off."""
@@ -182,13 +381,15 @@ class pithermalcam:
         elif key == ord("x"):  # If c is chosen cycle the colormap used
             self.change_colormap(forward=False)
         elif key == ord("f"):  # If f is chosen cycle the image filtering
-            self.filter_image = not self.filter_image
+            self.change_filter()
         elif key == ord("t"):  # If t is chosen cycle the units used for Temperature
             self.use_f = not self.use_f
         elif key == ord("u"):  # If t is chosen cycle the units used for temperature
             self.change_interpolation()
         elif key == ord("i"):  # If i is chosen cycle interpolation algorithm
             self.change_interpolation(forward=False)
+        elif key == ord("m"):  # If m is chosen print the performance metrics
+            self.print_metrics()
         elif key==27:  # Exit nicely if escape key is used
             cv2.destroyAllWindows()
             self._displaying_onscreen = False
@@ -212,6 +413,7 @@ class pithermalcam:
         print("T - Toggle Temperature Units between C/F")
         print("U - Go back to the previous Interpolation Algorithm")
         print("I - Change the Interpolation Algorithm Used")
+        print("M - Print Per-Stage Timings and Frame Counts")
         print("Double-click with Mouse - Save a Snapshot of the Current Frame")
 
     def display_next_frame_onscreen(self):
@@ -235,6 +437,18 @@ class pithermalcam:
             if self._colormap_index<0:
                 self._colormap_index=len(self._colormap_list)-1
 
+    def add_colormap(self, name:str, colors=None, rgb_order:bool = True):
+        """
+        Add a colormap to the cycle. Without colors, name is any matplotlib colormap (append '_r' to reverse it);
+        with colors, it's a custom map as described in ColormapRegistry.register. Switches to the new map.
+        """
+        if colors is not None:
+            colormaps.register(name, colors, rgb_order=rgb_order)
+        colormaps.get(name)  # Build the LUT now, and fail early on an unknown name
+        if name not in self._colormap_list:
+            self._colormap_list.append(name)
+        self._colormap_index = self._colormap_list.index(name)
+
     def change_interpolation(self, forward:bool = True):
         """Cycle interpolation. Forward by default, backwards if param set to false."""
         if forward:
@@ -246,45 +460,89 @@ class pithermalcam:
             if self._interpolation_index<0:
                 self._interpolation_index=len(self._interpolation_list)-1
 
+    def change_filter(self, forward:bool = True):
+        """Cycle the filter mode between off, bilateral and temporal. Forward by default, backwards if param set to false."""
+        index = FILTER_MODES.index(self.filter_image) + (1 if forward else -1)
+        self.filter_image = FILTER_MODES[index % len(FILTER_MODES)]
+
     def update_image_frame(self):
         """Pull raw temperature data, process it to an image, and update image text"""
         self._pull_raw_image()
         self._process_raw_image()
         self._add_image_text()
         self._current_frame_processed=True
+        self.metrics.inc('frames_rendered')
         return self._image
 
+    def get_metrics(self):
+        """
+        Return per-stage latency statistics (in seconds, over the most recent frames and since startup)
+        along with frame counters, e.g. get_metrics()['stages']['resize']['p90']
+        """
+        return self.metrics.summary()
+
+    def print_metrics(self):
+        """Print a short table of the per-stage timings and frame counters"""
+        summary = self.get_metrics()
+        print(f'{"Stage":<14}{"mean ms":>9}{"p50 ms":>9}{"p90 ms":>9}{"p99 ms":>9}')
+        for stage, stats in summary['stages'].items():
+            if stats['window']:
+                print(f'{stage:<14}{stats["mean"]*1000:>9.2f}{stats["p50"]*1000:>9.2f}{stats["p90"]*1000:>9.2f}{stats["p99"]*1000:>9.2f}')
+        for name, value in sorted(summary['counters'].items()):
+            print(f'{name}: {value}')
+
     def update_raw_image_only(self):
         """Update only raw data without any further image processing or text updating"""
-        self._pull_raw_image
+        self._pull_raw_image()
 
     def get_current_raw_image_frame(self):
-        """Return the current raw image"""
-        self._pull_raw_image
+        """Return the current raw image, from the newest buffered frame if the acquisition thread is running"""
+        self._pull_raw_image(wait=False)
         return self._raw_image
 
+    def get_latest_temperatures(self):
+        """Return (seq, timestamp, temps) for the newest frame read, temps being a (24,32) float32 copy in C"""
+        if not self._acquisition.running and self._acquisition.ring.seq == 0:
+            self._pull_raw_image()
+        return self._acquisition.ring.latest()
+
     def get_current_image_frame(self):
         """Get the processed image"""
+        if self._raw_image is None:  # Nothing read yet
+            self._pull_raw_image()
         # If the current raw image hasn't been procssed, process and return it
         if not self._current_frame_processed:
             self._process_raw_image()
             self._add_image_text()
             self._current_frame_processed=True
+            self.metrics.inc('frames_rendered')
         return self._image
 
     def save_image(self):
-        """Save the current frame as a snapshot to the output folder."""
-        fname = self.output_folder + 'pic_' + dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S') + '.jpg'
-        cv2.imwrite(fname, self._image)
-        self._file_saved_notification_start = time.monotonic()
-        print('Thermal Image ', fname)
+        """
+        Save the current frame as a snapshot to the output folder, along with the raw temperatures behind it
+        (snapshot_format 'npz' or 'png', or None for the image alone), and trigger a burst recording of the frames around it.
+        The files are written on a background thread; this returns the image's file name straight away,
+        or None if too many snapshots are already waiting.
+        """
+        image = self._image if self._image is not None else self.get_current_image_frame()
+        buffered = self._acquisition.ring.read(self._raw_seq) if self._raw_seq else None
+        # The frame the image was drawn from, as read and before any filtering
+        timestamp, temps = buffered if buffered is not None else (None, self._pipeline.temps)
+        self._snapshots.output_folder = self.output_folder
+        self._snapshots.raw_format = self.snapshot_format
+        fname = self._snapshots.save(image, temps, seq=self._raw_seq or None, timestamp=timestamp)
+        if self.burst is not None:  # Record the seconds around it too; its path is self.burst.last_path
+            self.burst.output_folder = self.output_folder
+            self.burst.trigger('save', timestamp)
+        if fname is not None:
+            self._file_saved_notification_start = time.monotonic()
+            print('Thermal Image ', fname)
+        return fname
 
     def _temps_to_rescaled_uints(self,f,Tmin,Tmax):
         """Function to convert temperatures to pixels on image"""
-        f=np.nan_to_num(f)
-        norm = np.uint8((f - Tmin)*255/(Tmax-Tmin))
-        norm.shape = (24,32)
-        return norm
+        return self._pipeline.rescale(f,Tmin,Tmax)
 
     def display_camera_onscreen(self):
         # Loop to display frames unless/until user requests exit
@@ -293,14 +551,16 @@ class pithermalcam:
                 self.display_next_frame_onscreen()
             # Catch a common I2C Error. If you get this too often consider checking/adjusting your I2C Baudrate
             except RuntimeError as e:
-                if e.message == 'Too many retries':
+                if str(e) == 'Too many retries':
                     print("Too many retries error caught, potential I2C baudrate issue: continuing...")
                     continue
                 raise
 
 if __name__ == "__main__":
     # If class is run as main, read ini and set up a live feed displayed to screen
+    # Optionally pass 'synthetic' or a file of recorded frames to run without the camera
+    import sys
     output_folder = '/home/pi/PiThermalCam/saved_snapshots/'
 
-    thermcam = pithermalcam(output_folder=output_folder)  # Instantiate class
+    thermcam = pithermalcam(output_folder=output_folder, sensor=sys.argv[1] if len(sys.argv)>1 else None)  # Instantiate class
     thermcam.display_camera_onscreen()
\ No newline at end of file
@@ -0,0 +1,126 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Frame processing pipeline for the MLX90640 Thermal Camera
+# Turns a 24x32 frame of temperatures into the colored, upscaled image
+##################################
+import time
+import numpy as np
+import cv2
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+    from pithermalcam.interpolation import SeparableZoom
+    from pithermalcam.metrics import Metrics
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+    from interpolation import SeparableZoom
+    from metrics import Metrics
+
+
+class FramePipeline:
+    """
+    Rescales, colorizes, upscales, flips and optionally smooths one frame at a time.
+    With preallocate set, every intermediate lives in a buffer created on first use and is written with out=/dst=,
+    so steady-state frames make no large allocations. The finished image alternates between output_buffers arrays,
+    so the previous frame stays intact (e.g. while it's being streamed) as the next one is drawn.
+    Without preallocate, every frame gets fresh arrays, which is safe to hold on to indefinitely.
+    The colormap, resize and filter stages of each render are timed into metrics.
+    """
+
+    def __init__(self, width:int=800, height:int=600, preallocate:bool=True, output_buffers:int=2, metrics=None):
+        self.width = width
+        self.height = height
+        self.preallocate = preallocate
+        self.metrics = Metrics() if metrics is None else metrics
+        self.temps = np.zeros((SENSOR_ROWS*SENSOR_COLS,), dtype=np.float32)  # The sensor reads straight into this
+        self._buffers = {}
+        self._zooms = {}
+        self._output_buffers = output_buffers
+        self._output_index = 0
+
+    def _buffer(self, name:str, shape, dtype=np.uint8):
+        """Return the named preallocated buffer, or None to let numpy/cv2 allocate a new array"""
+        if not self.preallocate:
+            return None
+        buffer = self._buffers.get(name)
+        if buffer is None or buffer.shape != shape or buffer.dtype != dtype:
+            buffer = self._buffers[name] = np.empty(shape, dtype=dtype)
+        return buffer
+
+    def _next_output(self):
+        """Pick the output buffer for the next image, cycling so the last one handed out isn't overwritten"""
+        self._output_index = (self._output_index + 1) % self._output_buffers
+        return self._buffer(f'output{self._output_index}', (self.height, self.width, 3))
+
+    def _zoom(self, out_shape):
+        """Precomputed, mirrored spline zoom from sensor resolution to out_shape, built the first time it's needed"""
+        zoom = self._zooms.get(out_shape)
+        if zoom is None:
+            zoom = self._zooms[out_shape] = SeparableZoom((SENSOR_ROWS, SENSOR_COLS), out_shape, flip_horizontal=True)
+        return zoom
+
+    def rescale(self, temps, temp_min:float, temp_max:float, name:str = 'rescaled'):
+        """Convert temperatures to 0-255 pixel values between temp_min and temp_max, clipping anything outside"""
+        if temps.ndim == 1:
+            temps = temps.reshape(SENSOR_ROWS, SENSOR_COLS)
+        span = temp_max - temp_min if temp_max > temp_min else 1.0
+        scaled = np.subtract(temps, temp_min, out=self._buffer(name + '_float', temps.shape, np.float32))
+        np.multiply(scaled, 255/span, out=scaled)
+        # fmax/fmin clip like np.clip but also turn NaN into 0, and unlike nan_to_num don't allocate masks
+        np.fmax(scaled, 0, out=scaled)
+        np.fmin(scaled, 255, out=scaled)
+        rescaled = self._buffer(name, temps.shape)
+        if rescaled is None:
+            return scaled.astype(np.uint8)
+        np.copyto(rescaled, scaled, casting='unsafe')
+        return rescaled
+
+    def _zoom_and_rescale(self, temps, temp_range, out_shape):
+        """Spline-interpolate real temperatures up to out_shape and only then quantize them to 0-255"""
+        temps = np.nan_to_num(temps.reshape(SENSOR_ROWS, SENSOR_COLS))
+        zoomed = self._zoom(out_shape)(temps, out=self._buffer(f'zoomed{out_shape}', out_shape, np.float32))
+        return self.rescale(zoomed, temp_range[0], temp_range[1], name=f'rescaled{out_shape}')
+
+    def render(self, raw_image, colormap, interpolation_index:int, interpolation:int, filter_image = False,
+               temps=None, temp_range=None):
+        """
+        Colorize and upscale a rescaled uint8 frame. interpolation_index 5 and 6 are the scipy spline modes,
+        anything else uses the cv2 interpolation flag passed in. The spline modes work on the real temperatures
+        and temp_range (min, max) that raw_image was rescaled from when given, and on raw_image itself otherwise.
+        filter_image True or 'bilateral' smooths the finished image; 'temporal' filtering happens to the temperatures
+        before they get here (see denoise.py). Returns the finished BGR image.
+        """
+        shape = (self.height, self.width, 3)
+        output = self._next_output()
+        filter_image = filter_image is True or filter_image == 'bilateral'
+        target = self._buffer('unfiltered', shape) if filter_image else output
+        if temps is None:
+            temps, temp_range = raw_image, (0, 255)
+        start = time.perf_counter()
+        # Can't apply colormap before interpolating, so reversed in the spline options
+        if interpolation_index==5:  # Spline scaling only - slowest but seems higher quality
+            zoomed = self._zoom_and_rescale(temps, temp_range, shape[:2])
+            resized = time.perf_counter()
+            target = cv2.applyColorMap(zoomed, colormap, dst=target)
+            colored = time.perf_counter()
+            resize_time, colormap_time = resized - start, colored - resized
+        elif interpolation_index==6:  # Scale partially via spline and partially via cv2 - mix of speed and quality
+            zoomed = self._zoom_and_rescale(temps, temp_range, (SENSOR_ROWS*10, SENSOR_COLS*10))
+            zoom_done = time.perf_counter()
+            colored = cv2.applyColorMap(zoomed, colormap, dst=self._buffer('colored10', zoomed.shape + (3,)))
+            colormap_done = time.perf_counter()
+            target = cv2.resize(colored, (self.width, self.height), dst=target, interpolation=cv2.INTER_CUBIC)
+            resize_time, colormap_time = (zoom_done - start) + (time.perf_counter() - colormap_done), colormap_done - zoom_done
+        else:
+            # Mirror at sensor resolution rather than after upscaling; it's 1/625th of the pixels
+            flipped = cv2.flip(raw_image, 1, dst=self._buffer('flipped', raw_image.shape))
+            colored = cv2.applyColorMap(flipped, colormap, dst=self._buffer('colored', flipped.shape + (3,)))
+            colormap_done = time.perf_counter()
+            target = cv2.resize(colored, (self.width, self.height), dst=target, interpolation=interpolation)
+            resize_time, colormap_time = time.perf_counter() - colormap_done, colormap_done - start
+        self.metrics.observe('colormap', colormap_time)
+        self.metrics.observe('resize', resize_time)
+        if filter_image:
+            with self.metrics.time('filter'):
+                return cv2.bilateralFilter(target, 15, 80, 80, dst=output)
+        return target
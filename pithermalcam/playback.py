@@ -0,0 +1,91 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Playback of radiometric recordings for the MLX90640 Thermal Camera
+# Feeds recorded frames back in where the sensor read happens, at original speed or as fast as possible
+##################################
+import time
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SensorBackend, _fill_frame_buffer
+    from pithermalcam.recording import RecordingReader
+except ImportError:  # If run directly
+    from sensors import SensorBackend, _fill_frame_buffer
+    from recording import RecordingReader
+
+
+class PlaybackSensor(SensorBackend):
+    """
+    Sensor backend that plays back a recording made with RecordingWriter, so everything downstream of the sensor read
+    (acquisition, rendering, streaming, raw-frame consumers) runs exactly as it would live.
+    speed 1.0 keeps the original frame timing, 2.0 plays twice as fast, and None plays as fast as the CPU allows.
+    start_time/end_time (monotonic, as stored) limit playback to part of the recording.
+    When the end is reached, playback starts over if loop is set and raises EOFError otherwise.
+    """
+
+    def __init__(self, recording, speed:float = 1.0, loop:bool = True, start_time:float = None, end_time:float = None):
+        self.reader = recording if isinstance(recording, RecordingReader) else RecordingReader(recording)
+        self.speed = speed
+        self.loop = loop
+        self._range = self.reader.find(start_time, end_time)
+        if self._range.stop <= self._range.start:
+            raise ValueError('No recorded frames in the requested range')
+        self._index = self._range.start
+        self._started = None
+        self.seq = None
+        self.timestamp = None
+        timestamps = self.reader.timestamps[self._range]
+        if len(timestamps) > 1:
+            self.refresh_hz = 2.0/float(np.median(np.diff(timestamps)))  # frame_period is two refresh periods
+        self._frame = np.zeros(self.reader.shape, dtype=np.float32)
+
+    def getFrame(self, framebuf):
+        if self._index >= self._range.stop:
+            if not self.loop:
+                raise EOFError('End of recording')
+            self._index = self._range.start
+            self._started = None
+        timestamp = float(self.reader.timestamps[self._index])
+        if self.speed:
+            # Sleep until this frame's place in the original timeline, scaled by speed
+            if self._started is None:
+                self._started = (time.monotonic(), timestamp)
+            due = self._started[0] + (timestamp - self._started[1])/self.speed
+            delay = due - time.monotonic()
+            if delay > 0:
+                time.sleep(delay)
+        self.reader.frame(self._index, out=self._frame)
+        self.seq = int(self.reader.seqs[self._index])
+        self.timestamp = timestamp
+        self._index += 1
+        _fill_frame_buffer(framebuf, self._frame)
+
+
+def render_recording(recording, speed:float = None, colormap:str = None, interpolation_index:int = None,
+                     filter_image = None, use_f:bool = None, start_time:float = None, end_time:float = None):
+    """
+    Run a recording through pithermalcam's full processing path (rescale, colormap, interpolation, filter and text)
+    and yield (recorded seq, recorded timestamp, image) for each frame, as fast as possible unless speed is given.
+    Any setting left as None keeps pithermalcam's default. The image is only valid until the next one is yielded.
+    """
+    try:  # If called as an imported module
+        from pithermalcam.pi_therm_cam import pithermalcam
+    except ImportError:  # If run directly
+        from pi_therm_cam import pithermalcam
+    sensor = PlaybackSensor(recording, speed=speed, loop=False, start_time=start_time, end_time=end_time)
+    thermcam = pithermalcam(sensor=sensor, preallocate=True)  # Renders the first frame while starting up
+    if colormap is not None:
+        thermcam.add_colormap(colormap)
+    if interpolation_index is not None:
+        thermcam._interpolation_index = interpolation_index
+    if filter_image is not None:
+        thermcam.filter_image = filter_image
+    if use_f is not None:
+        thermcam.use_f = use_f
+    thermcam._current_frame_processed = False  # Re-render that first frame with the settings above
+    while True:
+        yield sensor.seq, sensor.timestamp, thermcam.get_current_image_frame()
+        try:
+            thermcam.update_raw_image_only()
+        except EOFError:
+            return
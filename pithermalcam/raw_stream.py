@@ -0,0 +1,148 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Raw temperature stream for the MLX90640 Thermal Camera
+# Packs each sensor frame into ~1.5KB of binary for browsers that do their own rendering
+##################################
+import struct, threading
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+    from pithermalcam.codec import FrameDecoder, KEYFRAME
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+    from codec import FrameDecoder, KEYFRAME
+
+# Each message: this header, then rows*cols little-endian int16 temperatures in units of scale C, row by row
+# as the sensor reads them (the camera's own rendering mirrors them left to right).
+# On a delta-coded stream the header is followed by a codec.FrameEncoder frame instead.
+HEADER = struct.Struct('<IdHHf')  # seq, timestamp (time.monotonic), rows, cols, scale (C per unit)
+SCALE = 0.01
+
+
+def encode_frame(seq:int, timestamp:float, frame, encoder=None):
+    """Pack one (24,32) frame of temperatures in C into a raw stream message, delta-coded if given a codec.FrameEncoder"""
+    if encoder is not None:
+        return HEADER.pack(seq, timestamp, SENSOR_ROWS, SENSOR_COLS, SCALE) + encoder.encode(frame)[1]
+    temps = np.rint(np.reshape(frame, (SENSOR_ROWS, SENSOR_COLS))/SCALE)
+    np.clip(temps, -32768, 32767, out=temps)
+    return HEADER.pack(seq, timestamp, SENSOR_ROWS, SENSOR_COLS, SCALE) + temps.astype('<i2').tobytes()
+
+
+def decode_frame(data:bytes, decoder:FrameDecoder = None):
+    """
+    Unpack a raw stream message into (seq, timestamp, (rows,cols) float32 temperatures in C).
+    Messages from a delta-coded stream need the same codec.FrameDecoder passed in for every message, in order.
+    """
+    seq, timestamp, rows, cols, scale = HEADER.unpack_from(data)
+    if decoder is not None:
+        return seq, timestamp, decoder.decode(data[HEADER.size:])
+    temps = np.frombuffer(data, dtype='<i2', count=rows*cols, offset=HEADER.size).reshape(rows, cols)
+    return seq, timestamp, np.multiply(temps, scale, dtype=np.float32)
+
+
+def is_keyframe(data:bytes):
+    """Whether a message from a delta-coded stream is a keyframe, which later deltas are decoded against"""
+    return data[HEADER.size] == KEYFRAME
+
+
+class RawFrameBroadcaster:
+    """
+    Acquisition consumer that packs each new frame once, while anyone is subscribed, and hands it to every subscriber.
+    Register write() with pithermalcam.add_raw_frame_consumer. Like StreamHub, blocking readers wait on a condition
+    and listeners are called after each frame, e.g. to wake an event loop.
+    Given a codec.FrameEncoder, messages are delta-coded against the last keyframe, which is kept so that a
+    subscriber that joins partway, or falls behind and skips past a keyframe, can be sent it before any delta that
+    depends on it (see get()).
+    """
+
+    def __init__(self, encoder=None):
+        self.encoder = encoder
+        self._condition = threading.Condition()
+        self._seq = 0
+        self._data = None
+        self._keyframe = None
+        self._subscribers = 0
+        self._listeners = []
+        self._closed = False
+
+    @property
+    def seq(self):
+        """Sequence ID of the newest frame packed, 0 before the first"""
+        return self._seq
+
+    @property
+    def subscribers(self):
+        return self._subscribers
+
+    @property
+    def closed(self):
+        return self._closed
+
+    def subscribe(self):
+        with self._condition:
+            self._subscribers += 1
+
+    def unsubscribe(self):
+        with self._condition:
+            self._subscribers -= 1
+
+    def add_listener(self, listener):
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def write(self, seq:int, timestamp:float, frame):
+        """Consumer entry point, called on the acquisition thread"""
+        if self._subscribers == 0:
+            if self._data is not None:  # Nobody's listening, so the next subscriber starts afresh, from a keyframe
+                with self._condition:
+                    self._data = self._keyframe = None
+                if self.encoder is not None:
+                    self.encoder.reset()
+            return
+        data = encode_frame(seq, timestamp, frame, self.encoder)
+        with self._condition:
+            self._seq, self._data = seq, data
+            if self.encoder is not None and is_keyframe(data):
+                self._keyframe = (seq, data)
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+
+    def get(self, last_seq:int = 0, timeout:float = None, keyframe_seq:int = None):
+        """
+        Wait for a frame newer than last_seq and return (seq, message), or (last_seq, None) on timeout or close.
+        On a delta-coded stream, pass the seq of the last keyframe this subscriber was sent (0 before the first) as
+        keyframe_seq: if the newest frame depends on a later keyframe, that keyframe is returned instead, so a subscriber
+        that skips frames never decodes a delta against the wrong keyframe. Ask again with its seq for the newest frame.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: (self._seq > last_seq and self._data is not None) or self._closed, timeout) or self._closed:
+                return last_seq, None
+            if keyframe_seq is not None and self._keyframe is not None and self._keyframe[0] > keyframe_seq:
+                return self._keyframe
+            return self._seq, self._data
+
+    def frames(self):
+        """Generate (seq, message) for each new frame, for one blocking subscriber, until closed"""
+        self.subscribe()
+        try:
+            seq = 0
+            keyframe_seq = 0 if self.encoder is not None else None
+            while not self._closed:
+                seq, data = self.get(seq, timeout=1.0, keyframe_seq=keyframe_seq)
+                if data is not None:
+                    if keyframe_seq is not None and is_keyframe(data):
+                        keyframe_seq = seq
+                    yield seq, data
+        finally:
+            self.unsubscribe()
+
+    def close(self):
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
@@ -0,0 +1,252 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Radiometric recordings for the MLX90640 Thermal Camera
+# Raw temperature frames appended to a compact file, with a sidecar index of sequence IDs and timestamps
+##################################
+import os, struct, time
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS
+    from pithermalcam.codec import FrameEncoder, FrameDecoder
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS
+    from codec import FrameEncoder, FrameDecoder
+
+# File layout: a 64-byte header, then frames back to back as int16 centi-degrees C or float16 degrees C.
+# The sidecar <path>.idx holds one INDEX_DTYPE record per frame, in the same order.
+# 'delta' recordings hold codec.FrameEncoder frames instead, which vary in size, so their index records
+# (DELTA_INDEX_DTYPE) also give each frame's position in the file and the number of the keyframe it depends on.
+MAGIC = b'PTCREC1\x00'
+HEADER_SIZE = 64
+_HEADER = struct.Struct('<8s1sxHHxxdd')  # magic, dtype code, rows, cols, scale (C per unit), clock offset
+INDEX_DTYPE = np.dtype([('seq', '<i8'), ('timestamp', '<f8')])
+DELTA_INDEX_DTYPE = np.dtype([('seq', '<i8'), ('timestamp', '<f8'), ('offset', '<i8'), ('size', '<i4'), ('keyframe', '<i4')])
+_DELTA = b'z'
+_DTYPES = {'int16': (b'h', np.dtype('<i2'), 0.01), 'float16': (b'e', np.dtype('<f2'), 1.0), 'delta': (_DELTA, np.dtype('<i2'), 0.01)}
+
+
+def index_path(path:str):
+    """Path of a recording's sidecar index"""
+    return path + '.idx'
+
+
+class RecordingWriter:
+    """
+    Appends raw (24,32) temperature frames to a recording. Frames are stored as int16 centi-degrees (0.01C steps,
+    +/-327C range) or float16, about 1.5KB each, and written a chunk of chunk_frames at a time.
+    dtype 'delta' stores the same centi-degrees through codec.FrameEncoder, with a keyframe every keyframe_interval frames.
+    Opening an existing recording appends to it. write() has the same signature as an acquisition consumer,
+    so a writer can be registered with pithermalcam.add_raw_frame_consumer directly.
+    Timestamps are time.monotonic() values; the header keeps the offset to wall-clock time.
+    """
+
+    def __init__(self, path:str, dtype:str = 'int16', chunk_frames:int = 32, keyframe_interval:int = 32):
+        if dtype not in _DTYPES:
+            raise ValueError(f'Unsupported recording dtype {dtype}; use one of {", ".join(_DTYPES)}')
+        self.path = path
+        code, self.dtype, self.scale = _DTYPES[dtype]
+        self.compressed = code == _DELTA
+        if os.path.exists(path) and os.path.getsize(path) >= HEADER_SIZE:
+            header = read_header(path)
+            if header['dtype'] != self.dtype or header['compressed'] != self.compressed:
+                raise ValueError(f'{path} already holds {"delta-coded" if header["compressed"] else header["dtype"]} frames')
+            self.clock_offset = header['clock_offset']
+            _truncate_partial_frames(path, self.dtype, self.compressed)
+        else:
+            self.clock_offset = time.time() - time.monotonic()
+            with open(path, 'wb') as f:
+                f.write(_HEADER.pack(MAGIC, code, SENSOR_ROWS, SENSOR_COLS, self.scale, self.clock_offset).ljust(HEADER_SIZE, b'\x00'))
+            open(index_path(path), 'wb').close()
+        self._data_file = open(path, 'ab')
+        self._index_file = open(index_path(path), 'ab')
+        self._chunk = np.zeros((chunk_frames, SENSOR_ROWS, SENSOR_COLS), dtype=self.dtype)
+        self._chunk_index = np.zeros((chunk_frames,), dtype=DELTA_INDEX_DTYPE if self.compressed else INDEX_DTYPE)
+        self._scaled = np.zeros((SENSOR_ROWS, SENSOR_COLS), dtype=np.float32)
+        self._count = 0
+        self.frames_written = 0
+        if self.compressed:
+            # Carry on numbering from whatever's already in the file; the first frame appended is always a keyframe
+            self._encoder = FrameEncoder(keyframe_interval)
+            self._payloads = []
+            self._offset = os.path.getsize(path) - HEADER_SIZE
+            self._frame_number = os.path.getsize(index_path(path))//DELTA_INDEX_DTYPE.itemsize
+            self._keyframe_number = self._frame_number
+
+    def write(self, seq:int, timestamp:float, frame):
+        """Queue one frame for the current chunk, writing the chunk out once it's full"""
+        frame = np.reshape(frame, (SENSOR_ROWS, SENSOR_COLS))
+        if self.compressed:
+            is_keyframe, payload = self._encoder.encode(frame)
+            if is_keyframe:
+                self._keyframe_number = self._frame_number
+            self._payloads.append(payload)
+            self._chunk_index[self._count] = (seq, timestamp, self._offset, len(payload), self._keyframe_number)
+            self._offset += len(payload)
+            self._frame_number += 1
+            self._count += 1
+            if self._count == len(self._chunk_index):
+                self.flush()
+            return
+        if self.dtype.kind == 'i':
+            np.multiply(frame, 1/self.scale, out=self._scaled)
+            np.rint(self._scaled, out=self._scaled)
+            np.clip(self._scaled, -32768, 32767, out=self._scaled)
+            np.copyto(self._chunk[self._count], self._scaled, casting='unsafe')
+        else:
+            np.copyto(self._chunk[self._count], frame, casting='same_kind')
+        self._chunk_index[self._count] = (seq, timestamp)
+        self._count += 1
+        if self._count == len(self._chunk):
+            self.flush()
+
+    def flush(self):
+        """Write out the partial chunk. Frames go to disk before their index entries, so readers never index a missing frame."""
+        if self._count == 0:
+            return
+        if self.compressed:
+            self._data_file.write(b''.join(self._payloads))
+            self._payloads = []
+        else:
+            self._data_file.write(self._chunk[:self._count].tobytes())
+        self._data_file.flush()
+        self._index_file.write(self._chunk_index[:self._count].tobytes())
+        self._index_file.flush()
+        self.frames_written += self._count
+        self._count = 0
+
+    def close(self):
+        self.flush()
+        self._data_file.close()
+        self._index_file.close()
+
+
+def read_header(path:str):
+    """Parse a recording's header into a dict"""
+    with open(path, 'rb') as f:
+        magic, code, rows, cols, scale, clock_offset = _HEADER.unpack(f.read(HEADER_SIZE)[:_HEADER.size])
+    if magic != MAGIC:
+        raise ValueError(f'{path} is not a pithermalcam recording')
+    compressed = code == _DELTA
+    return {'dtype': np.dtype('<i2') if compressed else np.dtype('<' + code.decode()), 'compressed': compressed,
+            'rows': rows, 'cols': cols, 'scale': scale, 'clock_offset': clock_offset}
+
+
+def _complete_delta_records(path:str):
+    """How many index records of a delta recording have all of their frame data in the file"""
+    records = os.path.getsize(index_path(path))//DELTA_INDEX_DTYPE.itemsize
+    if records == 0:
+        return 0
+    index = np.fromfile(index_path(path), dtype=DELTA_INDEX_DTYPE, count=records)
+    ends = index['offset'] + index['size']
+    return int(np.searchsorted(ends, os.path.getsize(path) - HEADER_SIZE, side='right'))
+
+
+def _truncate_partial_frames(path:str, dtype, compressed:bool = False):
+    """Drop a half-written frame or index record left by a crash, so appending starts on a clean boundary"""
+    if compressed:
+        complete = _complete_delta_records(path)
+        index = np.fromfile(index_path(path), dtype=DELTA_INDEX_DTYPE, count=complete)
+        os.truncate(path, HEADER_SIZE + (int(index['offset'][-1] + index['size'][-1]) if complete else 0))
+        os.truncate(index_path(path), complete*DELTA_INDEX_DTYPE.itemsize)
+        return
+    frame_bytes = SENSOR_ROWS*SENSOR_COLS*dtype.itemsize
+    frames = (os.path.getsize(path) - HEADER_SIZE)//frame_bytes
+    records = os.path.getsize(index_path(path))//INDEX_DTYPE.itemsize
+    complete = min(frames, records)
+    os.truncate(path, HEADER_SIZE + complete*frame_bytes)
+    os.truncate(index_path(path), complete*INDEX_DTYPE.itemsize)
+
+
+class RecordingReader:
+    """
+    Memory-maps a recording and its index, so any frame or time range can be read without loading the whole file.
+    Frames come back as float32 degrees C. Call refresh() to pick up frames appended since it was opened.
+    A frame of a delta recording is decoded from its keyframe and itself; the last keyframe used is kept decoded.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        header = read_header(path)
+        self.dtype = header['dtype']
+        self.compressed = header['compressed']
+        self.scale = header['scale']
+        self.clock_offset = header['clock_offset']
+        self.shape = (header['rows'], header['cols'])
+        self.refresh()
+
+    def refresh(self):
+        """Re-map the files to include any frames written since the last refresh"""
+        if self.compressed:
+            self._length = _complete_delta_records(self.path)
+            if self._length == 0:  # numpy can't map zero bytes
+                self.index = np.zeros((0,), dtype=DELTA_INDEX_DTYPE)
+            else:
+                self.index = np.memmap(index_path(self.path), dtype=DELTA_INDEX_DTYPE, mode='r', shape=(self._length,))
+                self._data = np.memmap(self.path, dtype=np.uint8, mode='r', offset=HEADER_SIZE)
+            self._decoder = FrameDecoder(self.shape)
+            self._decoded_keyframe = None
+            return
+        frame_bytes = self.shape[0]*self.shape[1]*self.dtype.itemsize
+        frames = (os.path.getsize(self.path) - HEADER_SIZE)//frame_bytes
+        records = os.path.getsize(index_path(self.path))//INDEX_DTYPE.itemsize
+        self._length = min(frames, records)
+        if self._length == 0:  # numpy can't map zero bytes
+            self._data = np.zeros((0,) + self.shape, dtype=self.dtype)
+            self.index = np.zeros((0,), dtype=INDEX_DTYPE)
+        else:
+            self._data = np.memmap(self.path, dtype=self.dtype, mode='r', offset=HEADER_SIZE, shape=(self._length,) + self.shape)
+            self.index = np.memmap(index_path(self.path), dtype=INDEX_DTYPE, mode='r', shape=(self._length,))
+
+    def __len__(self):
+        return self._length
+
+    @property
+    def seqs(self):
+        return self.index['seq']
+
+    @property
+    def timestamps(self):
+        """Monotonic timestamps of every frame; add clock_offset for wall-clock time"""
+        return self.index['timestamp']
+
+    def _to_celsius(self, stored, out=None):
+        return np.multiply(stored, self.scale, out=out, dtype=np.float32)
+
+    def _payload(self, i:int):
+        record = self.index[i]
+        return bytes(self._data[record['offset']:record['offset'] + record['size']])
+
+    def frame(self, i:int, out=None):
+        """Frame i as a (24,32) float32 array of degrees C"""
+        if self.compressed:
+            i = range(len(self))[i]  # Allow negative indexes, and raise IndexError past the end
+            keyframe = int(self.index[i]['keyframe'])
+            if keyframe != self._decoded_keyframe:
+                self._decoder.decode(self._payload(keyframe))
+                self._decoded_keyframe = keyframe
+            return self._decoder.decode(self._payload(i), out)
+        return self._to_celsius(self._data[i], out)
+
+    def frames(self, start:int = 0, stop:int = None):
+        """Frames start to stop as an (N,24,32) float32 array of degrees C"""
+        if self.compressed:
+            selected = range(len(self))[start:stop]
+            frames = np.zeros((len(selected),) + self.shape, dtype=np.float32)
+            for frame, i in zip(frames, selected):
+                self.frame(i, out=frame)
+            return frames
+        return self._to_celsius(self._data[start:stop])
+
+    def find(self, start_time:float = None, end_time:float = None, wall_clock:bool = False):
+        """Return the slice of frames with timestamps in [start_time, end_time), by monotonic time or, with wall_clock, by time.time()"""
+        offset = self.clock_offset if wall_clock else 0.0
+        timestamps = self.timestamps
+        first = 0 if start_time is None else int(np.searchsorted(timestamps, start_time - offset, side='left'))
+        last = len(self) if end_time is None else int(np.searchsorted(timestamps, end_time - offset, side='left'))
+        return slice(first, last)
+
+    def time_range(self, start_time:float = None, end_time:float = None, wall_clock:bool = False):
+        """Return (seqs, timestamps, frames) for every frame between start_time and end_time, reading only those frames"""
+        selected = self.find(start_time, end_time, wall_clock)
+        return np.array(self.seqs[selected]), np.array(self.timestamps[selected]), self.frames(selected.start, selected.stop)
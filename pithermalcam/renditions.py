@@ -0,0 +1,144 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Per-client renditions for the MLX90640 Thermal Camera web servers
+# Clients pick size, JPEG quality, colormap and interpolation; each distinct combination is rendered once per frame
+##################################
+import time, threading
+from collections import namedtuple
+try:  # If called as an imported module
+    from pithermalcam.stream_hub import StreamHub
+    from pithermalcam.pipeline import FramePipeline
+    from pithermalcam.colormaps import colormaps
+    from pithermalcam.denoise import filter_mode
+except ImportError:  # If run directly
+    from stream_hub import StreamHub
+    from pipeline import FramePipeline
+    from colormaps import colormaps
+    from denoise import filter_mode
+
+RenditionKey = namedtuple('RenditionKey', ['width', 'height', 'quality', 'colormap', 'interpolation', 'filter'])
+
+MIN_SIZE, MAX_SIZE = 32, 1920
+
+
+class Rendition:
+    """One combination of render settings, with its own pipeline buffers and hub"""
+
+    def __init__(self, key:RenditionKey, condition, metrics):
+        self.key = key
+        self.pipeline = FramePipeline(key.width, key.height, preallocate=True, metrics=metrics)
+        self.hub = StreamHub(jpeg_quality=key.quality, metrics=metrics, condition=condition)
+        self.last_used = time.monotonic()
+        self._last_render = time.time()
+
+    def render(self, thermcam):
+        """Render thermcam's current raw frame with this rendition's settings and hand it to the hub"""
+        now = time.time()
+        image = thermcam.render_with(self.pipeline, self.key.colormap, self.key.interpolation, self.key.filter,
+                                     1/max(now - self._last_render, 1e-6))
+        self._last_render = now
+        # As with the camera's own image, the pipeline alternates output buffers, so the hub can keep this one
+        self.hub.publish(image)
+
+
+class RenditionCache:
+    """
+    Renditions requested through /video_feed query parameters, keyed on their settings, so clients asking for the
+    same settings share one render and one JPEG encode per frame however many of them there are.
+    All the renditions' hubs share the main hub's condition, so wait_for_viewers() wakes for a viewer on any of them.
+    A rendition nobody has watched for idle_timeout seconds is evicted, and at most max_renditions exist at once.
+    """
+
+    def __init__(self, hub:StreamHub, max_renditions:int = 8, idle_timeout:float = 30.0):
+        self.hub = hub
+        self.max_renditions = max_renditions
+        self.idle_timeout = idle_timeout
+        self._renditions = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._renditions)
+
+    @property
+    def viewers(self):
+        """Clients watching the main hub or any rendition"""
+        return self.hub.viewers + sum(rendition.hub.viewers for rendition in list(self._renditions.values()))
+
+    def wait_for_viewers(self, timeout:float = None):
+        """Block until a client is watching the main hub or any rendition. Returns False on timeout or once closed."""
+        with self.hub.condition:
+            return self.hub.condition.wait_for(lambda: self.viewers > 0 or self.hub.closed, timeout) and not self.hub.closed
+
+    def key_from_args(self, args, thermcam):
+        """
+        Build a RenditionKey from query parameters: width, height, quality (1-100), colormap (any matplotlib name),
+        interpolation (index or name) and filter (off, bilateral or temporal; 1/0 for bilateral/off). Anything not given follows the camera's current settings.
+        Raises ValueError for anything invalid.
+        """
+        width = int(args.get('width', thermcam._pipeline.width))
+        height = int(args.get('height', width*thermcam._pipeline.height//thermcam._pipeline.width))
+        if not (MIN_SIZE <= width <= MAX_SIZE and MIN_SIZE <= height <= MAX_SIZE):
+            raise ValueError(f'width and height must be between {MIN_SIZE} and {MAX_SIZE}')
+        quality = int(args.get('quality', self.hub.jpeg_quality))
+        if not 1 <= quality <= 100:
+            raise ValueError('quality must be between 1 and 100')
+        colormap = args.get('colormap', thermcam._colormap_list[thermcam._colormap_index])
+        try:
+            colormaps.get(colormap)
+        except Exception:
+            raise ValueError(f'Unknown colormap {colormap}')
+        interpolation = args.get('interpolation', thermcam._interpolation_index)
+        names = [name.lower() for name in thermcam._interpolation_list_name]
+        if str(interpolation).lower() in names:
+            interpolation = names.index(str(interpolation).lower())
+        interpolation = int(interpolation)
+        if not 0 <= interpolation < len(names):
+            raise ValueError(f'interpolation must be a name or an index below {len(names)}')
+        filter_image = filter_mode(str(args['filter'])) if 'filter' in args else thermcam.filter_image
+        return RenditionKey(width, height, quality, colormap, interpolation, filter_image)
+
+    def get(self, key:RenditionKey):
+        """The rendition for key, created if needed. Raises RuntimeError if max_renditions are all in use."""
+        with self._lock:
+            rendition = self._renditions.get(key)
+            if rendition is None:
+                if len(self._renditions) >= self.max_renditions:
+                    self._evict(idle_timeout=1.0)  # Any idle one, bar those just handed to a client that's yet to start streaming
+                if len(self._renditions) >= self.max_renditions:
+                    raise RuntimeError(f'All {self.max_renditions} renditions are in use')
+                rendition = self._renditions[key] = Rendition(key, self.hub.condition, self.hub.metrics)
+            rendition.last_used = time.monotonic()
+            return rendition
+
+    def render(self, thermcam):
+        """Render thermcam's current raw frame for every rendition somebody's watching"""
+        for rendition in list(self._renditions.values()):
+            if rendition.hub.viewers:
+                rendition.render(thermcam)
+                rendition.last_used = time.monotonic()
+
+    def evict(self):
+        """Drop renditions that have gone unwatched for idle_timeout"""
+        with self._lock:
+            self._evict(self.idle_timeout)
+
+    def _evict(self, idle_timeout:float):
+        cutoff = time.monotonic() - idle_timeout
+        for key, rendition in list(self._renditions.items()):
+            if rendition.hub.viewers == 0 and rendition.last_used <= cutoff:
+                del self._renditions[key]
+                rendition.hub.close()
+
+    def client_stats(self):
+        """Per-client send statistics for the main hub and every rendition, labelled with the rendition's settings"""
+        stats = [dict(client, rendition=None) for client in self.hub.client_stats()]
+        for key, rendition in list(self._renditions.items()):
+            stats += [dict(client, rendition=key._asdict()) for client in rendition.hub.client_stats()]
+        return stats
+
+    def close(self):
+        with self._lock:
+            for rendition in self._renditions.values():
+                rendition.hub.close()
+            self._renditions.clear()
@@ -0,0 +1,182 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Region of interest statistics for the MLX90640 Thermal Camera
+# Min, max, mean and percentiles for named areas of the view, for every ROI in one pass over each raw frame
+##################################
+import threading
+import numpy as np
+import cv2
+try:  # If called as an imported module
+    from pithermalcam.sensors import SENSOR_ROWS, SENSOR_COLS, SENSOR_PIXELS
+except ImportError:  # If run directly
+    from sensors import SENSOR_ROWS, SENSOR_COLS, SENSOR_PIXELS
+
+FRAME_REGION = 'frame'  # The whole frame, where it's named alongside regions (e.g. the temperature history); no ROI can take it
+
+
+def rectangle_mask(x:int, y:int, width:int, height:int):
+    """(24,32) boolean mask of a rectangle with its top left corner at pixel (x, y), clipped to the frame"""
+    if width < 1 or height < 1:
+        raise ValueError('ROI width and height must be at least 1')
+    mask = np.zeros((SENSOR_ROWS, SENSOR_COLS), dtype=bool)
+    # Clamp both ends, as a negative stop would count back from the far edge
+    mask[max(y, 0):max(y + height, 0), max(x, 0):max(x + width, 0)] = True
+    return mask
+
+
+def polygon_mask(points):
+    """(24,32) boolean mask of a polygon through the (x, y) points given, including the pixels its edges cross"""
+    points = np.round(np.asarray(points, dtype=np.float64)).astype(np.int32).reshape(-1, 2)
+    if len(points) < 3:
+        raise ValueError('A polygon ROI needs at least 3 points')
+    mask = np.zeros((SENSOR_ROWS, SENSOR_COLS), dtype=np.uint8)
+    cv2.fillPoly(mask, [points], 1)
+    return mask.astype(bool)
+
+
+def definition_mask(definition:dict):
+    """
+    (24,32) boolean mask from a dict like those from JSON: {'rectangle': [x, y, width, height]},
+    {'polygon': [[x, y], ...]} or {'mask': 24 rows of 32 0/1 values}. Raises ValueError for anything else.
+    """
+    try:
+        if 'rectangle' in definition:
+            return rectangle_mask(*(int(value) for value in definition['rectangle']))
+        elif 'polygon' in definition:
+            return polygon_mask(definition['polygon'])
+        elif 'mask' in definition:
+            return np.asarray(definition['mask'], dtype=bool).reshape(SENSOR_ROWS, SENSOR_COLS)
+    except TypeError as e:
+        raise ValueError(str(e))
+    raise ValueError('Expected a rectangle, polygon or mask')
+
+
+class RoiStats:
+    """
+    Named regions of the sensor's view and their statistics, updated on every raw frame.
+    Regions are rectangles, polygons or boolean masks in sensor pixels (x across 0-31, y down 0-23). With mirrored set
+    (the default) x runs as in the camera's images, which mirror the sensor left to right; otherwise as in raw frames.
+    Each region's mask is built once, when it's added. Register update() with pithermalcam.add_raw_frame_consumer and each
+    frame then costs one matrix multiply for the means and one sort for the min, max and percentiles of every region.
+    """
+
+    def __init__(self, percentiles=(5, 50, 95), mirrored:bool = True):
+        self.percentiles = tuple(percentiles)
+        self.mirrored = mirrored
+        self._lock = threading.Lock()
+        self._masks = {}
+        self._compiled = None
+        self._stats = {'seq': 0, 'timestamp': None, 'regions': {}}
+
+    def __len__(self):
+        return len(self._masks)
+
+    @property
+    def names(self):
+        return list(self._masks)
+
+    def _add(self, name:str, mask):
+        """Store a (24,32) mask, given in the image orientation, and rebuild the per-frame operators"""
+        mask = np.asarray(mask, dtype=bool).reshape(SENSOR_ROWS, SENSOR_COLS)
+        if self.mirrored:
+            mask = mask[:, ::-1]
+        if not mask.any():
+            raise ValueError(f'ROI {name} covers no sensor pixels')
+        if name == FRAME_REGION:
+            raise ValueError(f"'{FRAME_REGION}' is reserved for the whole frame")
+        with self._lock:
+            self._masks[name] = mask.copy()
+            self._compile()
+
+    def add_rectangle(self, name:str, x:int, y:int, width:int, height:int):
+        """Add (or replace) a rectangle with its top left corner at pixel (x, y)"""
+        self._add(name, rectangle_mask(x, y, width, height))
+
+    def add_polygon(self, name:str, points):
+        """Add (or replace) a polygon through the (x, y) points given, including the pixels its edges cross"""
+        self._add(name, polygon_mask(points))
+
+    def add_mask(self, name:str, mask):
+        """Add (or replace) an arbitrary (24,32) boolean mask, or anything of 768 truthy values"""
+        self._add(name, mask)
+
+    def add(self, name:str, definition:dict):
+        """Add a region from a dict as definition_mask() takes. Raises ValueError for anything invalid."""
+        try:
+            self._add(name, definition_mask(definition))
+        except ValueError as e:
+            raise ValueError(f'Invalid ROI {name}: {e}')
+
+    def mask(self, name:str):
+        """A region's (24,32) mask in raw frame (sensor) orientation; KeyError if there's none by that name"""
+        return self._masks[name].copy()
+
+    def remove(self, name:str):
+        """Remove a region; KeyError if there's none by that name"""
+        with self._lock:
+            del self._masks[name]
+            self._compile()
+
+    def definitions(self):
+        """Each region's mask as 24 rows of 32 0/1 values, in the same orientation regions are added in"""
+        with self._lock:
+            masks = dict(self._masks)
+        return {name: (mask[:, ::-1] if self.mirrored else mask).astype(np.uint8).tolist() for name, mask in masks.items()}
+
+    def _compile(self):
+        """
+        Precompute what update() needs, and swap it in whole so the acquisition thread never sees it half built:
+        the masks as rows of a matrix, pixel counts, and where each percentile falls in a region's sorted values
+        """
+        if not self._masks:
+            self._compiled = None
+            return
+        names = list(self._masks)
+        masks = np.stack([self._masks[name].reshape(-1) for name in names])
+        counts = masks.sum(axis=1)
+        positions = (counts[:, None] - 1)*np.asarray(self.percentiles, dtype=np.float64)[None, :]/100
+        lower = np.floor(positions).astype(np.intp)
+        upper = np.minimum(lower + 1, (counts - 1)[:, None])
+        self._compiled = {
+            'names': names,
+            'outside': ~masks,
+            'weights': (masks/counts[:, None]).astype(np.float32),  # Row r averages region r's pixels
+            'counts': counts,
+            'last': (counts - 1)[:, None],
+            'lower': lower,
+            'upper': upper,
+            'fraction': (positions - lower).astype(np.float32),
+            'values': np.empty((len(names), SENSOR_PIXELS), dtype=np.float32),
+        }
+
+    def update(self, seq:int, timestamp:float, frame):
+        """Consumer entry point: work out every region's statistics for one raw frame, at sensor rate"""
+        compiled = self._compiled
+        if compiled is None:
+            return
+        frame = np.reshape(frame, (SENSOR_PIXELS,))
+        means = compiled['weights'] @ frame
+        # Every region's values sorted in its own row, with the pixels outside it pushed to the end as +inf
+        values = compiled['values']
+        values[...] = frame
+        np.copyto(values, np.inf, where=compiled['outside'])
+        values.sort(axis=1)
+        minimums = values[:, 0]
+        maximums = np.take_along_axis(values, compiled['last'], axis=1)[:, 0]
+        lower = np.take_along_axis(values, compiled['lower'], axis=1)
+        upper = np.take_along_axis(values, compiled['upper'], axis=1)
+        percentiles = lower + (upper - lower)*compiled['fraction']
+        regions = {}
+        for i, name in enumerate(compiled['names']):
+            stats = {'min': float(minimums[i]), 'max': float(maximums[i]), 'mean': float(means[i]), 'pixels': int(compiled['counts'][i])}
+            stats.update((f'p{q:g}', float(percentiles[i, j])) for j, q in enumerate(self.percentiles))
+            regions[name] = stats
+        self._stats = {'seq': seq, 'timestamp': timestamp, 'regions': regions}
+
+    def stats(self):
+        """The newest statistics: {'seq', 'timestamp', 'regions': {name: {'min', 'max', 'mean', 'pixels', 'p5', ...}}} in C"""
+        stats = self._stats
+        if stats['regions'].keys() - self._masks.keys():  # A region was removed since this frame
+            stats = dict(stats, regions={name: value for name, value in stats['regions'].items() if name in self._masks})
+        return stats
@@ -0,0 +1,256 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Long-term temperature history for the MLX90640 Thermal Camera
+# Min, max and mean per region, rolled up per second, minute and hour into fixed-size rings that persist to disk
+##################################
+import os, time, threading, logging, traceback
+import numpy as np
+try:  # If called as an imported module
+    from pithermalcam.roi import FRAME_REGION
+except ImportError:  # If run directly
+    from roi import FRAME_REGION
+
+logger = logging.getLogger(__name__)
+
+ROLLUP_PATH = os.path.expanduser('~/.local/share/pithermalcam/rollup.npz')
+# (seconds per bucket, buckets kept): an hour of seconds, a week of minutes and a year of hours
+TIERS = ((1, 3600), (60, 7*24*60), (3600, 366*24))
+# One bucket as query() returns it and /api/history sends it in binary: its start as Unix time, then the temperatures in C
+# and how many frames went into it, little-endian
+RECORD_DTYPE = np.dtype([('time', '<f8'), ('min', '<f4'), ('max', '<f4'), ('mean', '<f4'), ('count', '<u4')])
+
+
+class RollupStore:
+    """
+    Fixed-memory history of the min, max and mean temperature of the whole frame (region 'frame') and of each of the
+    regions in rois, at each resolution in tiers. Register update() with pithermalcam.add_raw_frame_consumer after
+    rois.update. Each frame is only added to a running total for the current second; as each second ends it's folded into
+    a bucket of every tier at once. Every tier is a ring preallocated for max_regions regions, so memory never grows, and
+    a region's history stays queryable after the ROI is removed, until its buckets are overwritten or its row is needed:
+    once every row is taken, a new region takes over the row of the removed region updated longest ago.
+    With path set, the store is loaded from there if it was saved with the same tiers, and saved back every
+    persist_interval seconds on a background thread. Buckets are by wall clock time, so they line up across restarts.
+    """
+
+    def __init__(self, rois=None, path:str = None, tiers=TIERS, max_regions:int = 8, persist_interval:float = 300):
+        self.rois = rois
+        self.path = path
+        self.tiers = tuple((int(resolution), int(length)) for resolution, length in tiers)
+        self.max_regions = max_regions
+        self.persist_interval = persist_interval
+        self._lock = threading.Lock()
+        self._names = [FRAME_REGION]  # Each row's region; only changed under the lock, as query() and save() read it
+        self._last_updated = np.zeros(max_regions)  # When each row last had a frame, to pick which removed region's row to reuse
+        self._full_warned = set()
+        self._times = [np.full(length, -1.0) for _, length in self.tiers]  # Each slot's bucket start; shared by all regions
+        self._minimums = [np.zeros((max_regions, length), dtype=np.float32) for _, length in self.tiers]
+        self._maximums = [np.zeros((max_regions, length), dtype=np.float32) for _, length in self.tiers]
+        self._means = [np.zeros((max_regions, length), dtype=np.float32) for _, length in self.tiers]
+        self._counts = [np.zeros((max_regions, length), dtype=np.uint32) for _, length in self.tiers]
+        # The current second's running totals, per region
+        self._second = None
+        self._second_min = np.full(max_regions, np.inf)
+        self._second_max = np.full(max_regions, -np.inf)
+        self._second_sum = np.zeros(max_regions)
+        self._second_count = np.zeros(max_regions, dtype=np.uint32)
+        self._last_saved = time.time()
+        self._saving = None
+        if path is not None and os.path.exists(path):
+            self.load(path)
+
+    @property
+    def names(self):
+        """Regions with history, the whole frame first"""
+        with self._lock:
+            return list(self._names)
+
+    @property
+    def resolutions(self):
+        return [resolution for resolution, _ in self.tiers]
+
+    def _region_index(self, name:str, current):
+        """
+        A region's row in the rings, giving it one if it has none: a free row, or else the row of the region not in current
+        (the ROIs there are now) updated longest ago, whose history goes. None if every row belongs to a current region.
+        """
+        try:
+            return self._names.index(name)
+        except ValueError:
+            pass
+        if len(self._names) < self.max_regions:
+            with self._lock:
+                self._names.append(name)
+            logger.info(f'Keeping temperature history for region {name}')
+            return len(self._names) - 1
+        removed = [row for row in range(1, len(self._names)) if self._names[row] not in current]
+        if not removed:
+            if name not in self._full_warned:
+                self._full_warned.add(name)
+                logger.warning(f'No temperature history for region {name}: all {self.max_regions - 1} region rows are in use')
+            return None
+        row = min(removed, key=lambda row: self._last_updated[row])
+        logger.info(f'Keeping temperature history for region {name} in place of removed region {self._names[row]}')
+        with self._lock:
+            self._names[row] = name
+            for minimums, maximums, means, counts in zip(self._minimums, self._maximums, self._means, self._counts):
+                minimums[row], maximums[row], means[row], counts[row] = np.inf, -np.inf, 0, 0
+        self._second_min[row], self._second_max[row], self._second_sum[row], self._second_count[row] = np.inf, -np.inf, 0, 0
+        return row
+
+    def update(self, seq:int, timestamp:float, frame):
+        """Consumer entry point: add one raw frame's statistics to the current second"""
+        now = time.time()
+        second = int(now)
+        if second != self._second:
+            if self._second is not None:
+                self._fold_second()
+            self._second = second
+            if self.path is not None and now - self._last_saved >= self.persist_interval:
+                self.save_in_background()
+        rows = [0]
+        minimums, maximums, means = [float(np.min(frame))], [float(np.max(frame))], [float(np.mean(frame))]
+        if self.rois is not None:
+            stats = self.rois.stats()
+            if stats['seq'] == seq:  # Only if the ROIs have already seen this frame
+                for name, region in stats['regions'].items():
+                    row = self._region_index(name, stats['regions'])
+                    if row is not None:
+                        rows.append(row)
+                        minimums.append(region['min'])
+                        maximums.append(region['max'])
+                        means.append(region['mean'])
+        np.minimum.at(self._second_min, rows, minimums)
+        np.maximum.at(self._second_max, rows, maximums)
+        np.add.at(self._second_sum, rows, means)
+        np.add.at(self._second_count, rows, 1)
+        self._last_updated[rows] = now
+
+    def _fold_second(self):
+        """Fold the second just finished into a bucket of every tier, for every region at once"""
+        seen = self._second_count > 0
+        count = self._second_count[seen]
+        with self._lock:
+            for (resolution, length), times, minimums, maximums, means, counts in zip(
+                    self.tiers, self._times, self._minimums, self._maximums, self._means, self._counts):
+                start = float(self._second - self._second % resolution)
+                slot = int(self._second//resolution) % length
+                if times[slot] != start:  # The ring has come round: this slot's old bucket is overwritten
+                    times[slot] = start
+                    minimums[:, slot] = np.inf
+                    maximums[:, slot] = -np.inf
+                    means[:, slot] = 0
+                    counts[:, slot] = 0
+                previous = counts[seen, slot]
+                minimums[seen, slot] = np.minimum(minimums[seen, slot], self._second_min[seen])
+                maximums[seen, slot] = np.maximum(maximums[seen, slot], self._second_max[seen])
+                means[seen, slot] = (means[seen, slot]*previous + self._second_sum[seen])/(previous + count)
+                counts[seen, slot] = previous + count
+        self._second_min[:] = np.inf
+        self._second_max[:] = -np.inf
+        self._second_sum[:] = 0
+        self._second_count[:] = 0
+
+    def query(self, region:str = FRAME_REGION, start:float = None, end:float = None, resolution:int = None):
+        """
+        The buckets of region starting from start up to end (Unix times; end defaults to now), oldest first, as a
+        RECORD_DTYPE array. Negative start or end count back from now, e.g. start=-7*86400 for the past week.
+        resolution picks a tier by its seconds per bucket; by default it's the finest tier that reaches back to start.
+        Raises KeyError for a region with no history and ValueError for a resolution there's no tier for.
+        """
+        if region not in self.names:
+            raise KeyError(region)
+        now = time.time()
+        end = now if end is None else (now + end if end < 0 else end)
+        if start is None:
+            start = end - self.tiers[0][0]*self.tiers[0][1]
+        elif start < 0:
+            start = now + start
+        tier = self.resolutions.index(self.resolution_for(start, resolution))
+        with self._lock:
+            if region not in self._names:  # Its row was just taken over by a new region
+                return np.empty(0, dtype=RECORD_DTYPE)
+            row = self._names.index(region)
+            times = self._times[tier]
+            # The whole bucket containing start counts, so the first bucket is never cut off partway
+            slots = np.flatnonzero((times > start - self.tiers[tier][0]) & (times <= end) & (self._counts[tier][row] > 0))
+            slots = slots[np.argsort(times[slots])]
+            records = np.empty(len(slots), dtype=RECORD_DTYPE)
+            records['time'] = times[slots]
+            records['min'] = self._minimums[tier][row, slots]
+            records['max'] = self._maximums[tier][row, slots]
+            records['mean'] = self._means[tier][row, slots]
+            records['count'] = self._counts[tier][row, slots]
+        return records
+
+    def resolution_for(self, start:float, resolution:int = None):
+        """
+        The seconds per bucket query() uses: resolution if there's a tier at it (ValueError if not), otherwise the finest
+        tier reaching back to start (a Unix time, or seconds back from now if negative), or the coarsest if none do
+        """
+        if resolution is not None:
+            if int(resolution) not in self.resolutions:
+                raise ValueError(f"No history at {resolution}s resolution; there's {', '.join(map(str, self.resolutions))}")
+            return int(resolution)
+        now = time.time()
+        start = now + start if start < 0 else start
+        return next((res for res, length in self.tiers if now - res*length <= start), self.tiers[-1][0])
+
+    def _arrays(self):
+        """Copies of everything save() writes"""
+        arrays = {'tiers': np.array(self.tiers)}
+        with self._lock:
+            arrays['names'] = np.array(self._names)
+            for i in range(len(self.tiers)):
+                arrays[f'times{i}'] = self._times[i].copy()
+                arrays[f'min{i}'] = self._minimums[i].copy()
+                arrays[f'max{i}'] = self._maximums[i].copy()
+                arrays[f'mean{i}'] = self._means[i].copy()
+                arrays[f'count{i}'] = self._counts[i].copy()
+        return arrays
+
+    def save(self, path:str = None):
+        """Write the whole store to path (self.path by default), replacing the file only once it's complete"""
+        self._write(self.path if path is None else path, self._arrays())
+
+    def _write(self, path:str, arrays:dict):
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+        temp_path = path + '.tmp'
+        with open(temp_path, 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(temp_path, path)
+        self._last_saved = time.time()
+
+    def save_in_background(self):
+        """Copy the store and save it on another thread, so the acquisition thread only waits for the copy"""
+        if self._saving is not None and self._saving.is_alive():
+            return
+        arrays = self._arrays()
+        self._last_saved = time.time()  # Don't try again next second if this one fails
+        def write():
+            try:
+                self._write(self.path, arrays)
+            except OSError:
+                logger.warning(traceback.format_exc())
+        self._saving = threading.Thread(target=write, name='pithermalcam-rollup-save')
+        self._saving.daemon = True
+        self._saving.start()
+
+    def load(self, path:str):
+        """Replace the store's contents with a saved one; a file saved with other tiers or more regions is ignored"""
+        try:
+            with np.load(path) as saved:
+                if tuple(map(tuple, saved['tiers'].tolist())) != self.tiers or len(saved['names']) > self.max_regions:
+                    logger.warning(f'Ignoring temperature history in {path}, which was kept at other resolutions')
+                    return
+                regions = len(saved['names'])
+                with self._lock:
+                    self._names = [str(name) for name in saved['names']]
+                    for i in range(len(self.tiers)):
+                        self._times[i][:] = saved[f'times{i}']
+                        self._minimums[i][:regions] = saved[f'min{i}'][:regions]
+                        self._maximums[i][:regions] = saved[f'max{i}'][:regions]
+                        self._means[i][:regions] = saved[f'mean{i}'][:regions]
+                        self._counts[i][:regions] = saved[f'count{i}'][:regions]
+        except (OSError, KeyError, ValueError):
+            logger.warning(f'Could not load temperature history from {path}: {traceback.format_exc()}')
@@ -0,0 +1,196 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Flask routes shared by the MLX90640 Thermal Camera's web servers
+# The buttons, snapshots, metrics and JSON APIs, which only need the camera, registered on either server's app
+##################################
+from flask import Response, request, jsonify
+try:  # If called as an imported module
+    from pithermalcam.colormaps import colormaps
+    from pithermalcam.roi import FRAME_REGION
+except ImportError:  # If run directly
+    from colormaps import colormaps
+    from roi import FRAME_REGION
+
+
+def register_routes(app, thermcam):
+    """
+    Add the routes that only talk to the camera to a Flask app. thermcam is a function returning the server's current
+    pithermalcam, as servers create theirs after the app and drop it on /exit. The page, video streams and /exit stay
+    with each server, as they depend on its own stream hubs.
+    """
+
+    #background processes happen without any refreshing (for button clicks)
+    @app.route('/save')
+    def save_image():
+        # the snapshot is written in the background; reply at once with the file it's going to,
+        # and the recording of the seconds around it that's saved once the post-trigger frames are in
+        camera = thermcam()
+        fname = camera.save_image()
+        if fname is None:
+            return Response('Too many snapshots waiting to be written', status=503)
+        return jsonify(filename=fname, burst=camera.burst.last_path if camera.burst is not None else None)
+
+    @app.route('/inc_min_temp')
+    def inc_min_temp():
+        thermcam().change_min_temp()
+        return ("Increased Min Temp")
+
+    @app.route('/dec_min_temp')
+    def dec_min_temp():
+        thermcam().change_min_temp(increase=False)
+        return ("Decreased Min Temp")
+
+    @app.route('/inc_max_temp')
+    def inc_max_temp():
+        thermcam().change_max_temp()
+        return ("Increased Max Temp")
+
+    @app.route('/dec_max_temp')
+    def dec_max_temp():
+        thermcam().change_max_temp(increase=False)
+        return ("Decreased Max Temp")
+
+    @app.route('/units')
+    def change_units():
+        camera = thermcam()
+        camera.use_f = not camera.use_f
+        return ("Units changed")
+
+    @app.route('/colormap')
+    def increment_colormap():
+        thermcam().change_colormap()
+        return ("Colormap changed")
+
+    @app.route('/colormapback')
+    def decrement_colormap():
+        thermcam().change_colormap(forward=False)
+        return ("Colormap changed back")
+
+    @app.route('/filter')
+    def toggle_filter():
+        thermcam().change_filter()
+        return ("Filter Changed")
+
+    @app.route('/interpolation')
+    def increment_interpolation():
+        thermcam().change_interpolation()
+        return ("Interpolation Changed")
+
+    @app.route('/interpolationback')
+    def decrement_interpolation():
+        thermcam().change_interpolation(forward=False)
+        return ("Interpolation Changed Back")
+
+    @app.route('/metrics')
+    def metrics():
+        # per-stage latencies and frame/client counters in the Prometheus text format
+        return Response(thermcam().metrics.render_text(), mimetype='text/plain; version=0.0.4')
+
+    @app.route('/api/render_settings')
+    def render_settings():
+        # what the browser needs to draw raw frames the way the camera currently renders them
+        camera = thermcam()
+        return jsonify(colormap=camera._colormap_list[camera._colormap_index], clamp_min=camera.clamp_temp_min,
+                       clamp_max=camera.clamp_temp_max, use_f=camera.use_f,
+                       interpolation=camera._interpolation_list_name[camera._interpolation_index])
+
+    @app.route('/api/roi')
+    def roi_stats():
+        # min, max, mean and percentiles in C for each region of interest, as of the newest sensor frame;
+        # ?definitions=1 adds each region's mask
+        camera = thermcam()
+        stats = dict(camera.get_roi_stats())
+        if request.args.get('definitions'):
+            stats['definitions'] = camera.rois.definitions()
+        return jsonify(stats)
+
+    @app.route('/api/roi/<name>', methods=['PUT', 'DELETE'])
+    def roi_definition(name):
+        # PUT a JSON body of {"rectangle": [x, y, width, height]}, {"polygon": [[x, y], ...]} or {"mask": [[0, 1, ...], ...]}
+        # in sensor pixels as the image shows them, or DELETE the region
+        rois = thermcam().rois
+        if request.method == 'DELETE':
+            try:
+                rois.remove(name)
+            except KeyError:
+                return Response(f'No ROI {name}', status=404)
+            return ("ROI removed")
+        definition = request.get_json(force=True, silent=True)
+        if not isinstance(definition, dict):
+            return Response('Expected a JSON object', status=400)
+        try:
+            rois.add(name, definition)
+        except ValueError as e:
+            return Response(str(e), status=400)
+        return ("ROI set")
+
+    @app.route('/api/alarms')
+    def alarm_events():
+        # alarm events after ?after=<id> (all those kept, by default), waiting up to ?wait=<seconds> (at most 30) for one
+        # if there are none yet, plus the rules currently raised; ?definitions=1 adds every rule
+        try:
+            after = int(request.args.get('after', 0))
+            wait = min(float(request.args.get('wait', 0)), 30.0)
+        except ValueError:
+            return Response('after and wait must be numbers', status=400)
+        alarms = thermcam().alarms
+        result = {'events': alarms.events(after, timeout=wait), 'active': sorted(alarms.active()),
+                  'last_id': alarms.last_event_id}
+        if request.args.get('definitions'):
+            result['definitions'] = alarms.definitions()
+        return jsonify(result)
+
+    @app.route('/api/alarms/<name>', methods=['PUT', 'DELETE'])
+    def alarm_rule(name):
+        # PUT a JSON body like {"above": 70, "statistic": "max", "hold": 2, "hysteresis": 3, "roi": "pump"}
+        # (or "window": seconds for a rate of change in C per second), or DELETE the rule
+        alarms = thermcam().alarms
+        if request.method == 'DELETE':
+            try:
+                alarms.remove(name)
+            except KeyError:
+                return Response(f'No alarm rule {name}', status=404)
+            return ("Alarm rule removed")
+        definition = request.get_json(force=True, silent=True)
+        if not isinstance(definition, dict):
+            return Response('Expected a JSON object', status=400)
+        try:
+            alarms.add(name, definition)
+        except ValueError as e:
+            return Response(str(e), status=400)
+        return ("Alarm rule set")
+
+    @app.route('/api/history')
+    def history():
+        # min, max and mean in C of ?region= (the whole frame by default) from ?start= to ?end= (Unix times, or seconds back
+        # from now if negative; the last hour by default), at ?resolution= seconds per bucket (the finest that reaches back to start).
+        # ?format=binary sends the buckets as packed little-endian records, layout in the X-Record-Format header (see rollup.py)
+        camera = thermcam()
+        region = request.args.get('region', FRAME_REGION)
+        try:
+            start = float(request.args.get('start', -3600))
+            end = float(request.args['end']) if 'end' in request.args else None
+            resolution = int(request.args['resolution']) if 'resolution' in request.args else None
+            resolution = camera.rollup.resolution_for(start, resolution)
+            records = camera.get_history(region, start, end, resolution)
+        except ValueError as e:
+            return Response(str(e), status=400)
+        except KeyError as e:
+            return Response(f'No history for region {e}', status=404)
+        if request.args.get('format') == 'binary':
+            record_format = ','.join(f'{name}:{records.dtype[name].str}' for name in records.dtype.names)
+            return Response(records.tobytes(), mimetype='application/octet-stream',
+                            headers={'X-Record-Format': record_format, 'X-Resolution': str(resolution)})
+        return jsonify(region=region, resolution=resolution, time=records['time'].tolist(),
+                       min=records['min'].astype(float).round(2).tolist(), max=records['max'].astype(float).round(2).tolist(),
+                       mean=records['mean'].astype(float).round(2).tolist(), count=records['count'].tolist())
+
+    @app.route('/api/colormap/<name>')
+    def colormap_lut(name):
+        # 256 RGB triples, coldest first, as 768 bytes
+        try:
+            lut = colormaps.get(name)
+        except Exception:
+            return Response(f'Unknown colormap {name}', status=404)
+        return Response(lut[:, 0, ::-1].tobytes(), mimetype='application/octet-stream')
@@ -0,0 +1,369 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Sensor backends for the MLX90640 Thermal Camera
+# The I2C backend talks to the real camera; the synthetic and replay backends stand in for it off the Pi
+##################################
+import os, json, time, random, logging
+import numpy as np
+
+logger = logging.getLogger(__name__)
+
+SENSOR_ROWS = 24
+SENSOR_COLS = 32
+SENSOR_PIXELS = SENSOR_ROWS*SENSOR_COLS
+# The subpage (0 or 1) each pixel is read in, in the MLX90640's default chess pattern reading mode
+CHESS_PATTERN = (np.add.outer(np.arange(SENSOR_ROWS), np.arange(SENSOR_COLS)) % 2).astype(np.uint8)
+_SUBPAGE_PIXELS = [np.flatnonzero(CHESS_PATTERN.reshape(-1) == subpage) for subpage in (0, 1)]
+
+# Where I2CSensor keeps each camera's calibration parameters between runs, one file per serial number
+CALIBRATION_CACHE = os.path.join(os.path.expanduser('~'), '.cache', 'pithermalcam')
+MLX90640_ADDRESS = 0x33
+# What the driver works out from the EEPROM, which I2CSensor caches. Several are lists the driver defines on the class and
+# fills in place, so they're saved and restored by name, as instance attributes, rather than taken from the object's vars()
+CALIBRATION_PARAMETERS = ('kVdd', 'vdd25', 'KvPTAT', 'KtPTAT', 'vPTAT25', 'alphaPTAT', 'gainEE', 'tgc', 'cpKv', 'cpKta',
+                          'resolutionEE', 'calibrationModeEE', 'KsTa', 'ksTo', 'ct', 'alpha', 'alphaScale', 'offset', 'kta',
+                          'ktaScale', 'kv', 'kvScale', 'cpAlpha', 'cpOffset', 'ilChessC', 'brokenPixels', 'outlierPixels')
+CALIBRATION_CACHE_VERSION = 2  # Bumped whenever what's cached changes, so older files are read from the EEPROM again
+# I2C clock speeds I2CSensor steps down through when reads keep failing
+I2C_FREQUENCIES = (1000000, 800000, 400000, 100000)
+
+# Mirrors adafruit_mlx90640.RefreshRate, keyed by the rate in Hz so the fake sensors don't need the driver installed
+REFRESH_RATES = {0.5: 0b000, 1: 0b001, 2: 0b010, 4: 0b011, 8: 0b100, 16: 0b101, 32: 0b110, 64: 0b111}
+
+
+def _fill_frame_buffer(framebuf, frame):
+    """Copy a frame into a caller-supplied buffer, which may be a numpy array or a plain list like the driver expects"""
+    if isinstance(framebuf, np.ndarray):
+        framebuf.reshape(-1)[:] = frame.reshape(-1)
+    else:
+        framebuf[:] = frame.reshape(-1).tolist()
+
+
+def _fill_subpage(framebuf, frame, subpage:int):
+    """Copy just one subpage's pixels of a frame into a caller-supplied buffer, leaving the others as they are"""
+    pixels = _SUBPAGE_PIXELS[subpage]
+    values = frame.reshape(-1)[pixels]
+    if isinstance(framebuf, np.ndarray):
+        framebuf.reshape(-1)[pixels] = values
+    else:
+        for pixel, value in zip(pixels.tolist(), values.tolist()):
+            framebuf[pixel] = value
+
+
+class SensorBackend:
+    """
+    Anything that can fill a 768-element buffer with temperatures in C, the same way MLX90640.getFrame does.
+    The MLX90640 refresh rate counts subpages, so a full frame takes two refresh periods.
+    Backends with supports_subpages set can also be read one subpage, i.e. half the pixels, at a time.
+    """
+    refresh_hz = 8
+    supports_subpages = False
+
+    def getFrame(self, framebuf):
+        """Block until a full frame is available and write its 768 temperatures into framebuf"""
+        raise NotImplementedError
+
+    def getSubpage(self, framebuf):
+        """
+        Block until the next subpage is read and write the temperatures of its 384 pixels (see CHESS_PATTERN) into
+        framebuf, leaving the other half as they were. Returns which subpage it was, 0 or 1.
+        """
+        raise NotImplementedError
+
+    def close(self):
+        """Release whatever the backend holds open"""
+        pass
+
+    def step_down(self):
+        """
+        Run slower after persistent read errors. Returns a description of the new setting,
+        or None if the backend can't slow down any further.
+        """
+        return None
+
+    def _step_down_refresh_rate(self):
+        """Drop refresh_hz to the next rate down; the new rate in Hz, or None at the slowest"""
+        slower = [rate for rate in REFRESH_RATES if rate < self.refresh_hz]
+        if not slower:
+            return None
+        self.refresh_hz = max(slower)
+        return self.refresh_hz
+
+    @property
+    def frame_period(self):
+        """Seconds between full frames at the current refresh rate"""
+        return 2.0/self.refresh_hz
+
+    @property
+    def subpage_period(self):
+        """Seconds between subpages at the current refresh rate"""
+        return 1.0/self.refresh_hz
+
+
+class I2CSensor(SensorBackend):
+    """
+    The real MLX90640 on the Pi's I2C bus.
+    Setting up the driver reads the camera's whole EEPROM and works out its calibration from it, which is most of
+    the startup time. The result is kept in calibration_cache (a directory, or None not to cache), under the camera's
+    serial number and the driver version, so later starts with the same camera only read the 3-word serial number.
+    A cache written by another driver version, or another version of this format, is ignored and rewritten.
+    """
+    supports_subpages = True
+    emissivity = 0.95  # As the driver's getFrame uses
+
+    def __init__(self, frequency:int=800000, refresh_hz:float=8, calibration_cache:str = CALIBRATION_CACHE):
+        # Hardware libraries are only imported here so the rest of the package runs on machines without them
+        import board, busio
+        import adafruit_mlx90640
+        self.frequency = frequency
+        self.refresh_hz = refresh_hz
+        self.calibration_cache = calibration_cache
+        self.i2c = busio.I2C(board.SCL, board.SDA, frequency=frequency)  # setup I2C
+        self.mlx = self._open_mlx(adafruit_mlx90640)  # begin MLX90640 with I2C comm
+        self.mlx.refresh_rate = REFRESH_RATES[refresh_hz]  # set refresh rate
+        self._ta_shift = getattr(adafruit_mlx90640, 'OPENAIR_TA_SHIFT', 8)
+        self._frame_data = [0]*834  # Raw words of one subpage, reused for every read
+        time.sleep(0.1)
+
+    def _open_mlx(self, adafruit_mlx90640):
+        """The driver object for the camera, with its calibration from the cache when there's one for this camera"""
+        if self.calibration_cache is None:
+            return adafruit_mlx90640.MLX90640(self.i2c, MLX90640_ADDRESS)
+        from adafruit_bus_device.i2c_device import I2CDevice
+        # Set up just the connection, without the constructor's EEPROM read, to get the serial number
+        mlx = adafruit_mlx90640.MLX90640.__new__(adafruit_mlx90640.MLX90640)
+        mlx.i2c_device = I2CDevice(self.i2c, MLX90640_ADDRESS)
+        serial = '-'.join(f'{word:04x}' for word in mlx.serial_number)
+        version = getattr(adafruit_mlx90640, '__version__', '')
+        path = os.path.join(self.calibration_cache, f'mlx90640-{serial}.json')
+        try:
+            with open(path) as f:
+                cached = json.load(f)
+            parameters = cached['parameters']
+            if (cached.get('version') == CALIBRATION_CACHE_VERSION and cached['serial'] == serial and
+                    cached['driver_version'] == version and parameters.keys() >= set(self._calibration_names(type(mlx)))):
+                for name, value in parameters.items():
+                    setattr(mlx, name, value)  # On the instance, so the class's own lists are never touched
+                return mlx
+        except FileNotFoundError:
+            pass
+        except (OSError, ValueError, KeyError, TypeError):
+            logger.warning(f'Ignoring unreadable calibration cache {path}')
+        # First start with this camera (or driver version): read the EEPROM as usual, then keep what it worked out
+        mlx = adafruit_mlx90640.MLX90640(self.i2c, MLX90640_ADDRESS)
+        parameters = {name: getattr(mlx, name) for name in self._calibration_names(mlx)}
+        try:
+            os.makedirs(self.calibration_cache, exist_ok=True)
+            with open(path + '.tmp', 'w') as f:
+                json.dump({'version': CALIBRATION_CACHE_VERSION, 'serial': serial, 'driver_version': version,
+                           'parameters': parameters}, f)
+            os.replace(path + '.tmp', path)  # So an interrupted write never leaves a half-written cache
+        except (OSError, TypeError, ValueError):
+            logger.warning(f'Could not write calibration cache {path}', exc_info=True)
+        return mlx
+
+    @staticmethod
+    def _calibration_names(mlx):
+        """The calibration parameters a driver object (or its class, for those it declares there) has"""
+        return [name for name in CALIBRATION_PARAMETERS if hasattr(mlx, name)]
+
+    def step_down(self):
+        # A slower clock first, since that's what usually cures bus errors, then a slower refresh rate
+        slower = [frequency for frequency in I2C_FREQUENCIES if frequency < self.frequency]
+        if slower:
+            import board, busio
+            from adafruit_bus_device.i2c_device import I2CDevice
+            self.frequency = slower[0]
+            self.i2c.deinit()
+            self.i2c = busio.I2C(board.SCL, board.SDA, frequency=self.frequency)
+            self.mlx.i2c_device = I2CDevice(self.i2c, MLX90640_ADDRESS)
+            return f'I2C at {self.frequency//1000}kHz'
+        if self._step_down_refresh_rate() is None:
+            return None
+        self.mlx.refresh_rate = REFRESH_RATES[self.refresh_hz]
+        return f'{self.refresh_hz}Hz refresh'
+
+    def getFrame(self, framebuf):
+        # The driver indexes the buffer by pixel number, so it needs to be flat
+        self.mlx.getFrame(framebuf.reshape(-1) if isinstance(framebuf, np.ndarray) else framebuf)
+
+    def getSubpage(self, framebuf):
+        # getFrame does this twice; the driver only works out the pixels of the subpage in frame_data[833]
+        frame_data = self._frame_data
+        if self.mlx._GetFrameData(frame_data) < 0:
+            raise RuntimeError('Frame data error')
+        ambient = self.mlx._GetTa(frame_data) - self._ta_shift
+        self.mlx._CalculateTo(frame_data, self.emissivity, ambient,
+                              framebuf.reshape(-1) if isinstance(framebuf, np.ndarray) else framebuf)
+        return frame_data[833]
+
+    def close(self):
+        self.i2c.deinit()
+
+
+class _SimulatedSensor(SensorBackend):
+    """
+    Shared timing and fault injection for the backends that stand in for the camera.
+    With realtime set, frames are paced at the sensor's refresh rate; without it they come back as fast as possible.
+    error_rate is the chance that any one read fails the way the real I2C reads occasionally do.
+    Subpages are emulated by copying alternate halves of the chess pattern out of the backend's frames.
+    """
+    _errors = ('value', 'os', 'retries')
+    supports_subpages = True
+
+    def __init__(self, refresh_hz:float=8, realtime:bool=True, error_rate:float=0.0, seed=None):
+        self.refresh_hz = refresh_hz
+        self.realtime = realtime
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._next_frame_time = None
+        self._subpage = 0
+        self._subpage_frame = None
+
+    def _wait_for_next_frame(self, period:float = None):
+        """Sleep until the sensor would have a new frame (or, given the subpage period, subpage) ready"""
+        if not self.realtime:
+            return
+        period = self.frame_period if period is None else period
+        now = time.monotonic()
+        if self._next_frame_time is None or self._next_frame_time < now - period:
+            self._next_frame_time = now  # First read, or the caller fell behind; the sensor doesn't queue frames
+        elif self._next_frame_time > now:
+            time.sleep(self._next_frame_time - now)
+        self._next_frame_time += period
+
+    def _maybe_fail(self):
+        """Raise one of the errors the driver throws in practice, error_rate of the time"""
+        if self.error_rate <= 0 or self._random.random() >= self.error_rate:
+            return
+        error = self._random.choice(self._errors)
+        if error == 'value':
+            raise ValueError('math domain error')
+        elif error == 'os':
+            raise OSError(121, 'Remote I/O error')
+        raise RuntimeError('Too many retries')
+
+    def _next_frame(self):
+        """Return the next frame as a (24,32) float array"""
+        raise NotImplementedError
+
+    def _next_subpage_frame(self):
+        """Return the scene as of the next subpage, as a (24,32) float array. By default each frame serves both subpages."""
+        if self._subpage == 0 or self._subpage_frame is None:
+            self._subpage_frame = self._next_frame()
+        return self._subpage_frame
+
+    def getFrame(self, framebuf):
+        self._wait_for_next_frame()
+        self._maybe_fail()
+        _fill_frame_buffer(framebuf, self._next_frame())
+
+    def step_down(self):
+        refresh_hz = self._step_down_refresh_rate()
+        return None if refresh_hz is None else f'{refresh_hz}Hz refresh'
+
+    def getSubpage(self, framebuf):
+        self._wait_for_next_frame(self.subpage_period)
+        self._maybe_fail()
+        subpage = self._subpage
+        _fill_subpage(framebuf, self._next_subpage_frame(), subpage)
+        self._subpage = 1 - subpage
+        return subpage
+
+
+class SyntheticSensor(_SimulatedSensor):
+    """
+    Generates a plausible scene: a room-temperature background with a gentle gradient,
+    a warm blob wandering across the field of view, and per-pixel sensor noise.
+    """
+
+    def __init__(self, ambient:float=22.0, hotspot:float=34.0, noise:float=0.3, **kwargs):
+        super().__init__(**kwargs)
+        self.ambient = ambient
+        self.hotspot = hotspot
+        self.noise = noise
+        self._elapsed = 0.0  # Scene time, stepped on by each frame (or subpage) read
+        self._rng = np.random.RandomState(kwargs.get('seed'))  # Rather than default_rng, which needs numpy 1.17
+        rows, cols = np.mgrid[0:SENSOR_ROWS, 0:SENSOR_COLS]
+        self._rows = rows.astype(np.float32)
+        self._cols = cols.astype(np.float32)
+        self._background = (ambient + 1.5*self._rows/SENSOR_ROWS).astype(np.float32)
+        self._frame = np.empty((SENSOR_ROWS, SENSOR_COLS), dtype=np.float32)
+
+    def _next_frame(self):
+        self._elapsed += self.frame_period
+        return self._scene(self._elapsed - self.frame_period)
+
+    def _next_subpage_frame(self):
+        # Each subpage sees the scene half a frame on, so subpage reads show motion twice as often
+        self._elapsed += self.subpage_period
+        return self._scene(self._elapsed - self.subpage_period)
+
+    def _scene(self, t:float):
+        # Move the blob along a slow Lissajous path, one step per read so the scene doesn't depend on wall time
+        center_row = (SENSOR_ROWS-1)/2*(1 + 0.7*np.sin(0.45*t))
+        center_col = (SENSOR_COLS-1)/2*(1 + 0.7*np.sin(0.3*t + 1.0))
+        dist2 = (self._rows - center_row)**2 + (self._cols - center_col)**2
+        np.exp(-dist2/18.0, out=self._frame)
+        self._frame *= self.hotspot - self.ambient
+        self._frame += self._background
+        if self.noise > 0:
+            self._frame += self._rng.normal(0, self.noise, self._frame.shape).astype(np.float32)
+        return self._frame
+
+
+class ReplaySensor(_SimulatedSensor):
+    """
+    Plays back previously captured frames from an array or a .npy/.npz file.
+    Files hold an (N,768) or (N,24,32) array of temperatures in C; .npz files keep it under 'frames'.
+    """
+
+    def __init__(self, source, loop:bool=True, **kwargs):
+        super().__init__(**kwargs)
+        if isinstance(source, str):
+            source = np.load(source)
+            if isinstance(source, np.lib.npyio.NpzFile):
+                source = source['frames']
+        self._frames = np.asarray(source, dtype=np.float32).reshape(-1, SENSOR_ROWS, SENSOR_COLS)
+        if len(self._frames) == 0:
+            raise ValueError('Replay source contains no frames')
+        self.loop = loop
+        self._index = 0
+
+    def __len__(self):
+        return len(self._frames)
+
+    def _next_frame(self):
+        if self._index >= len(self._frames):
+            if not self.loop:
+                raise EOFError('End of replayed frames')
+            self._index = 0
+        frame = self._frames[self._index]
+        self._index += 1
+        return frame
+
+
+def get_sensor(source=None, **kwargs):
+    """
+    Build a sensor backend from a short description: None or 'i2c' for the real camera,
+    'synthetic' for generated frames, or the path of a recording (see recording.py) or .npy/.npz file to play back.
+    Extra keyword arguments go to the backend's constructor.
+    """
+    if isinstance(source, SensorBackend):
+        return source
+    if source is None or source == 'i2c':
+        return I2CSensor(**kwargs)
+    if source == 'synthetic':
+        return SyntheticSensor(**kwargs)
+    try:  # If called as an imported module
+        from pithermalcam.recording import MAGIC
+        from pithermalcam.playback import PlaybackSensor
+    except ImportError:  # If run directly
+        from recording import MAGIC
+        from playback import PlaybackSensor
+    with open(source, 'rb') as f:
+        is_recording = f.read(len(MAGIC)) == MAGIC
+    if is_recording:
+        return PlaybackSensor(source, **kwargs)
+    return ReplaySensor(source, **kwargs)
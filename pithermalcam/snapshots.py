@@ -0,0 +1,143 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Snapshot writing for the MLX90640 Thermal Camera
+# Rendered JPEGs and the raw temperatures behind them, written out on a background thread
+##################################
+import os, time, queue, threading, logging, traceback
+import datetime as dt
+import numpy as np
+import cv2
+try:  # If called as an imported module
+    from pithermalcam.metrics import Metrics
+except ImportError:  # If run directly
+    from metrics import Metrics
+
+logger = logging.getLogger(__name__)
+
+RAW_FORMATS = ('npz', 'png', None)
+# Raw temperatures in a 16-bit PNG are hundredths of a degree above absolute zero: C = value*PNG_SCALE + PNG_OFFSET
+PNG_SCALE = 0.01
+PNG_OFFSET = -273.15
+# npz snapshots hold int16 hundredths of a degree C, as recordings do: C = temps*scale
+NPZ_SCALE = 0.01
+
+
+class SnapshotNames:
+    """
+    Hands out file names like <prefix><date>_<time><extension>, adding _2, _3... when several are asked for within the
+    same second, so files that are still waiting to be written never share a name
+    """
+
+    def __init__(self, prefix:str = 'pic_', extension:str = '.jpg'):
+        self.prefix = prefix
+        self.extension = extension
+        self._lock = threading.Lock()
+        self._last_stamp = None
+        self._repeats = 0
+
+    def next(self, folder:str):
+        """A path, without its extension, that no earlier name or existing file has"""
+        with self._lock:
+            stamp = dt.datetime.now().strftime('%Y-%m-%d_%H-%M-%S')
+            self._repeats = self._repeats + 1 if stamp == self._last_stamp else 1
+            self._last_stamp = stamp
+            while True:
+                base = os.path.join(folder, self.prefix + stamp + (f'_{self._repeats}' if self._repeats > 1 else ''))
+                if not os.path.exists(base + self.extension):  # e.g. from before a restart within the same second
+                    return base
+                self._repeats += 1
+
+
+class SnapshotWriter:
+    """
+    Saves snapshots on a background thread, so whichever thread asks for one (a web request, the keyboard or a mouse
+    click) never waits on the SD card. save() copies the image and temperatures, queues them and returns the file name
+    they'll be written to straight away. Each snapshot is the rendered image as pic_<date>_<time>.jpg plus, unless
+    raw_format is None, the 24x32 temperatures (mirrored to line up with the image) in pic_<date>_<time>_raw.npz
+    with their scale, seq, timestamp and wall clock time, or as a 16-bit pic_<date>_<time>_raw.png scaled as
+    PNG_SCALE and PNG_OFFSET say. output_folder and raw_format can be changed between snapshots.
+    Names get a _2, _3... suffix when several snapshots land in the same second.
+    At most max_pending snapshots wait at once; more are dropped (counted as snapshots_dropped) rather than blocking.
+    """
+
+    def __init__(self, output_folder:str, raw_format:str = 'npz', max_pending:int = 16, metrics=None):
+        if raw_format not in RAW_FORMATS:
+            raise ValueError(f"Unsupported raw snapshot format {raw_format}; use 'npz', 'png' or None")
+        self.output_folder = output_folder
+        self.raw_format = raw_format
+        self.metrics = Metrics() if metrics is None else metrics
+        self._queue = queue.Queue(max_pending)
+        self._names = SnapshotNames('pic_', '.jpg')
+        self._lock = threading.Lock()
+        self._thread = None
+
+    @property
+    def pending(self):
+        """Snapshots queued and not yet written"""
+        return self._queue.unfinished_tasks
+
+    def save(self, image, temps=None, seq:int = None, timestamp:float = None):
+        """
+        Queue image (BGR) and temps ((24,32) in C, sensor orientation) to be written, and return the JPEG's path at once.
+        Returns None, and drops the snapshot, if max_pending are already waiting.
+        """
+        if self.raw_format not in RAW_FORMATS:
+            raise ValueError(f"Unsupported raw snapshot format {self.raw_format}; use 'npz', 'png' or None")
+        base = self._names.next(self.output_folder)
+        temps = None if temps is None or self.raw_format is None else np.array(temps, dtype=np.float32)
+        snapshot = (base, image.copy(), temps, self.raw_format, seq, timestamp, time.time())
+        try:
+            self._queue.put_nowait(snapshot)
+        except queue.Full:
+            self.metrics.inc('snapshots_dropped')
+            logger.warning(f'Snapshot {base} dropped; {self._queue.maxsize} are still waiting to be written')
+            return None
+        self._start()
+        return base + '.jpg'
+
+    def _start(self):
+        with self._lock:
+            if self._thread is None or not self._thread.is_alive():
+                self._thread = threading.Thread(target=self._run, name='pithermalcam-snapshots')
+                self._thread.daemon = True
+                self._thread.start()
+
+    def _run(self):
+        while True:
+            snapshot = self._queue.get()
+            try:
+                with self.metrics.time('snapshot_write'):
+                    self._write(*snapshot)
+                self.metrics.inc('snapshots_saved')
+            except Exception:
+                self.metrics.inc('snapshot_errors')
+                logger.warning(traceback.format_exc())
+            finally:
+                self._queue.task_done()
+
+    def _write(self, base:str, image, temps, raw_format:str, seq, timestamp, taken:float):
+        os.makedirs(os.path.dirname(base) or '.', exist_ok=True)
+        if not cv2.imwrite(base + '.jpg', image):
+            raise OSError(f'Could not write {base}.jpg')
+        if temps is None:
+            return
+        temps = np.fliplr(temps)  # Match the image, which mirrors the sensor left to right
+        if raw_format == 'png':
+            kelvin = np.round((temps - PNG_OFFSET)/PNG_SCALE).clip(0, 65535).astype(np.uint16)
+            if not cv2.imwrite(base + '_raw.png', kelvin):
+                raise OSError(f'Could not write {base}_raw.png')
+        else:
+            centidegrees = np.round(temps/NPZ_SCALE).clip(-32768, 32767).astype(np.int16)
+            np.savez_compressed(base + '_raw.npz', temps=centidegrees, scale=NPZ_SCALE, units='C',
+                                seq=-1 if seq is None else seq, timestamp=np.nan if timestamp is None else timestamp,
+                                time=taken)
+
+    def flush(self, timeout:float = None):
+        """Wait until every queued snapshot is written, or timeout seconds pass; returns whether they all were"""
+        deadline = None if timeout is None else time.monotonic() + timeout
+        while self._queue.unfinished_tasks:
+            if deadline is not None and time.monotonic() >= deadline:
+                return False
+            time.sleep(0.01)
+        return True
@@ -0,0 +1,220 @@
+# -*- coding: utf-8 -*-
+#!/usr/bin/python3
+##################################
+# Encode-once MJPEG hub for the MLX90640 Thermal Camera web servers
+##################################
+import time, threading
+import cv2
+try:  # If called as an imported module
+    from pithermalcam.metrics import Metrics
+except ImportError:  # If run directly
+    from metrics import Metrics
+
+# Steps a client that can't keep up goes down through, as (JPEG quality, scale); None is the hub's own quality
+LEVELS = ((None, 1.0), (75, 1.0), (50, 1.0), (50, 0.5), (30, 0.5), (30, 0.25))
+
+
+class ClientStream:
+    """
+    Send statistics and the current quality level for one streaming connection.
+    A frame is 'slow' if sending it took most of a frame interval, meaning the socket's buffers are full and the client
+    is falling behind; a couple of those in a row step the client down a level. A long run of quick sends steps it back up.
+    """
+    SLOW_FRACTION = 0.8  # Of the frame interval
+    FAST_FRACTION = 0.3
+    SLOW_FRAMES = 2  # In a row, before stepping down
+    FAST_FRAMES = 20  # In a row, before stepping back up
+
+    def __init__(self, name:str = '', adaptive:bool = True):
+        self.name = name
+        self.adaptive = adaptive
+        self.connected = time.time()
+        self.level = 0
+        self.frames_sent = 0
+        self.frames_skipped = 0
+        self.bytes_sent = 0
+        self.send_time = 0.0  # Moving average, seconds
+        self.last_seq = 0
+        self._slow = 0
+        self._fast = 0
+
+    def sent(self, seq:int, size:int, seconds:float, frame_interval:float):
+        """Record one frame sent and adjust the level"""
+        if self.last_seq:
+            self.frames_skipped += seq - self.last_seq - 1
+        self.last_seq = seq
+        self.frames_sent += 1
+        self.bytes_sent += size
+        self.send_time += 0.2*(seconds - self.send_time) if self.frames_sent > 1 else seconds
+        if not self.adaptive:
+            return
+        if seconds > self.SLOW_FRACTION*frame_interval:
+            self._slow, self._fast = self._slow + 1, 0
+            if self._slow >= self.SLOW_FRAMES and self.level < len(LEVELS) - 1:
+                self.level, self._slow = self.level + 1, 0
+        elif seconds < self.FAST_FRACTION*frame_interval:
+            self._slow, self._fast = 0, self._fast + 1
+            if self._fast >= self.FAST_FRAMES and self.level > 0:
+                self.level, self._fast = self.level - 1, 0
+        else:
+            self._slow = self._fast = 0
+
+    def stats(self, jpeg_quality:int = 95):
+        elapsed = max(time.time() - self.connected, 1e-6)
+        quality, scale = LEVELS[self.level]
+        return {'name': self.name, 'connected_seconds': round(elapsed, 1), 'frames_sent': self.frames_sent,
+                'frames_skipped': self.frames_skipped, 'level': self.level, 'jpeg_quality': min(quality or jpeg_quality, jpeg_quality),
+                'scale': scale, 'send_ms': round(self.send_time*1000, 2), 'kbps': round(self.bytes_sent*8/1000/elapsed, 1)}
+
+
+class StreamHub:
+    """
+    Hands the latest rendered frame from the camera thread to every streaming client.
+    Each published frame gets a sequence number and is JPEG-encoded at most once, by whichever client asks for it first;
+    every other client reuses those bytes. Clients block on a condition until a frame newer than the last one they sent exists.
+    The hub also counts the clients currently streaming from it, so the producer can stop rendering when nobody is watching.
+    Encode times and the time each client takes to accept a frame go into metrics as jpeg_encode and network_send.
+    Hubs can share one condition, so a producer feeding several of them can wait for a viewer on any.
+    Each client's sends are timed; one that falls behind skips to the newest frame and is stepped down through LEVELS
+    of lower JPEG quality and resolution until it keeps up, then back up once it has bandwidth again.
+    Each level is encoded at most once per frame too, so slow clients share their smaller JPEGs.
+    """
+
+    def __init__(self, jpeg_quality:int = 95, metrics=None, condition=None):
+        self.jpeg_quality = jpeg_quality
+        self.metrics = Metrics() if metrics is None else metrics
+        self._condition = threading.Condition() if condition is None else condition
+        self._frame = None
+        self._seq = 0
+        self._encoded = {}  # level: (seq, jpeg bytes)
+        self._published = None
+        self.frame_interval = 0.25  # Moving average of the time between published frames, seconds
+        self._clients = []
+        self._listeners = []
+        self._viewers = 0
+        self._closed = False
+
+    @property
+    def seq(self):
+        """Sequence number of the most recently published frame, 0 before the first one"""
+        return self._seq
+
+    @property
+    def condition(self):
+        """The condition clients wait on; pass it to other hubs to share it"""
+        return self._condition
+
+    @property
+    def closed(self):
+        return self._closed
+
+    @property
+    def viewers(self):
+        """Number of clients currently streaming from the hub"""
+        return self._viewers
+
+    def add_viewer(self):
+        """Count a consumer that isn't going through frames(), e.g. a local display"""
+        with self._condition:
+            self._viewers += 1
+            self._condition.notify_all()
+
+    def remove_viewer(self):
+        with self._condition:
+            self._viewers -= 1
+
+    def wait_for_viewers(self, timeout:float = None):
+        """Block until at least one client is watching. Returns False on timeout or once the hub is closed."""
+        with self._condition:
+            return self._condition.wait_for(lambda: self._viewers > 0 or self._closed, timeout) and not self._closed
+
+    def publish(self, frame):
+        """
+        Swap in a newly rendered frame and wake any waiting clients.
+        The hub takes ownership of frame rather than copying it, so the caller mustn't draw on it afterwards.
+        Returns the frame it replaces; encoding only happens under the hub's lock, so that buffer is free to reuse.
+        """
+        with self._condition:
+            previous = self._frame
+            self._frame = frame
+            self._seq += 1
+            now = time.monotonic()
+            if self._published is not None:
+                self.frame_interval += 0.1*(min(now - self._published, 5.0) - self.frame_interval)
+            self._published = now
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
+        return previous
+
+    def add_listener(self, listener):
+        """Call listener() on the publishing thread after every publish and on close, e.g. to wake an event loop"""
+        self._listeners = self._listeners + [listener]
+
+    def remove_listener(self, listener):
+        self._listeners = [l for l in self._listeners if l is not listener]
+
+    def get_jpeg(self, last_seq:int = 0, timeout:float = None, level:int = 0):
+        """
+        Wait for a frame newer than last_seq and return (seq, jpeg bytes), encoded at the given entry of LEVELS.
+        Returns (last_seq, None) if nothing newer shows up within timeout or the hub is closed.
+        """
+        with self._condition:
+            if not self._condition.wait_for(lambda: self._seq > last_seq or self._closed, timeout) or self._closed:
+                return last_seq, None
+            encoded = self._encoded.get(level)
+            if encoded is None or encoded[0] != self._seq:
+                # First client to want this frame at this level encodes it for everyone
+                quality, scale = LEVELS[level]
+                with self.metrics.time('jpeg_encode'):
+                    frame = self._frame
+                    if scale != 1.0:
+                        frame = cv2.resize(frame, None, fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+                    (flag, encodedImage) = cv2.imencode(".jpg", frame, [cv2.IMWRITE_JPEG_QUALITY, min(quality or self.jpeg_quality, self.jpeg_quality)])
+                encoded = self._encoded[level] = (self._seq, encodedImage.tobytes() if flag else None)
+            return encoded
+
+    def frames(self, name:str = '', adaptive:bool = True):
+        """
+        Generate the multipart MJPEG stream for one client, skipping straight to the newest frame each time.
+        The client counts as a viewer until the generator is closed, which the server does when the connection drops.
+        name labels the client in client_stats(); with adaptive off it always gets full quality.
+        """
+        client = self.connect(name, adaptive)
+        try:
+            seq = 0
+            while not self._closed:
+                seq, jpeg = self.get_jpeg(seq, timeout=1.0, level=client.level)
+                if jpeg is None:
+                    continue
+                # The server writes each chunk to the socket before asking for the next, so this times the send;
+                # once the socket's buffers are full, that's how long the client took to take the frame
+                start = time.perf_counter()
+                yield(b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + jpeg + b'\r\n')
+                client.sent(seq, len(jpeg), self.metrics.lap('network_send', start) - start, self.frame_interval)
+                self.metrics.inc('frames_streamed')
+        finally:
+            self.disconnect(client)
+
+    def connect(self, name:str = '', adaptive:bool = True):
+        """Count a new streaming client as a viewer and return its ClientStream, for servers that don't use frames()"""
+        client = ClientStream(name, adaptive)
+        self.add_viewer()
+        self._clients = self._clients + [client]
+        return client
+
+    def disconnect(self, client:ClientStream):
+        self._clients = [c for c in self._clients if c is not client]
+        self.remove_viewer()
+
+    def client_stats(self):
+        """Send statistics and current level for each client streaming from the hub"""
+        return [client.stats(self.jpeg_quality) for client in self._clients]
+
+    def close(self):
+        """Release any waiting clients and end their streams"""
+        with self._condition:
+            self._closed = True
+            self._condition.notify_all()
+        for listener in self._listeners:
+            listener()
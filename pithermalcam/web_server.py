@@ -5,15 +5,32 @@
 # If running directly, run from root folder, not pithermalcam folder
 ##################################
 try:  # If called as an imported module
-	from pi_therm_cam import pithermalcam
+	from pithermalcam.pi_therm_cam import pithermalcam
+	from pithermalcam.stream_hub import StreamHub
+	from pithermalcam.renditions import RenditionCache
+	from pithermalcam.raw_stream import RawFrameBroadcaster
+	from pithermalcam.codec import FrameEncoder
+	from pithermalcam.routes import register_routes
+	from pithermalcam.rollup import ROLLUP_PATH
+	from pithermalcam.burst import BURST_SECONDS
 except:  # If run directly
 	from pi_therm_cam import pithermalcam
-from flask import Response, request
+	from stream_hub import StreamHub
+	from renditions import RenditionCache
+	from raw_stream import RawFrameBroadcaster
+	from codec import FrameEncoder
+	from routes import register_routes
+	from rollup import ROLLUP_PATH
+	from burst import BURST_SECONDS
+from flask import Response, request, jsonify
 from flask import Flask
 from flask import render_template
+try:
+	from flask_sock import Sock
+except ImportError:  # Optional; without it only the asyncio server (async_server.py) serves the raw WebSocket stream
+	Sock = None
 import threading
-import time, socket, logging, traceback
-import cv2
+import time, socket, logging, traceback, asyncio
 
 # Set up Logger
 logging.basicConfig(filename='pithermcam.log',filemode='a',
@@ -21,10 +38,15 @@ logging.basicConfig(filename='pithermcam.log',filemode='a',
 					level=logging.WARNING,datefmt='%d-%b-%y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-# initialize the output frame and a lock used to ensure thread-safe exchanges of the output frames (useful when multiple browsers/tabs are viewing the stream)
-outputFrame = None
+# initialize the hub that hands each new frame to every browser/tab viewing the stream, encoding it only once
+hub = StreamHub()
+# clients that ask for their own size/quality/colormap/interpolation share a rendition per distinct combination
+renditions = RenditionCache(hub)
+# raw temperature frames for browsers that render themselves (see raw_stream.py and the page's render=browser mode)
+raw_frames = RawFrameBroadcaster()
+delta_frames = RawFrameBroadcaster(FrameEncoder())  # the same, delta-coded against periodic keyframes (/ws/raw?codec=delta)
 thermcam = None
-lock = threading.Lock()
+raw_socket = Sock is not None  # whether /ws/raw is served, so the page can offer render=browser; async_server.py sets it too
 
 # initialize a flask object
 app = Flask(__name__)
@@ -32,63 +54,10 @@ app = Flask(__name__)
 @app.route("/")
 def index():
 	# return the rendered template
-	return render_template("index.html")
-
-#background processes happen without any refreshing (for button clicks)
-@app.route('/save')
-def save_image():
-	thermcam.save_image()
-	return ("Snapshot Saved")
-
-@app.route('/inc_min_temp')
-def inc_min_temp():
-    thermcam.change_min_temp()
-    return ("Increased Min Temp")
-
-@app.route('/dec_min_temp')
-def dec_min_temp():
-    thermcam.change_min_temp(increase=False)
-    return ("Decreased Min Temp")
-
-@app.route('/inc_max_temp')
-def inc_max_temp():
-    thermcam.change_max_temp()
-    return ("Increased Max Temp")
-
-@app.route('/dec_max_temp')
-def dec_max_temp():
-    thermcam.change_max_temp(increase=False)
-    return ("Decreased Max Temp")
-
-@app.route('/units')
-def change_units():
-	thermcam.use_f = not thermcam.use_f
-	return ("Units changed")
-
-@app.route('/colormap')
-def increment_colormap():
-	thermcam.change_colormap()
-	return ("Colormap changed")
-
-@app.route('/colormapback')
-def decrement_colormap():
-	thermcam.change_colormap(forward=False)
-	return ("Colormap changed back")
-
-@app.route('/filter')
-def toggle_filter():
-	thermcam.filter_image=not thermcam.filter_image
-	return ("Filtering Toggled")
-
-@app.route('/interpolation')
-def increment_interpolation():
-	thermcam.change_interpolation()
-	return ("Interpolation Changed")
-
-@app.route('/interpolationback')
-def decrement_interpolation():
-	thermcam.change_interpolation(forward=False)
-	return ("Interpolation Changed Back")
+	return render_template("index.html", raw_socket=raw_socket)
+
+# the buttons, snapshots, metrics and JSON APIs, shared with the other server (see routes.py)
+register_routes(app, lambda: thermcam)
 
 @app.route('/exit')
 def appexit():
@@ -98,13 +67,42 @@ def appexit():
 		raise RuntimeError('Not running with the Werkzeug Server')
 	func()
 	thermcam = None
+	hub.close()
+	renditions.close()
+	raw_frames.close()
+	delta_frames.close()
 	return 'Server shutting down...'
 
+if Sock is not None:
+	sock = Sock(app)
+
+	@sock.route('/ws/raw')
+	def raw_frames_socket(ws):
+		# push each sensor frame as a binary message; see raw_stream.HEADER for the layout
+		frames = delta_frames if request.args.get('codec') == 'delta' else raw_frames
+		for seq, data in frames.frames():
+			ws.send(data)
+
+@app.route('/api/clients')
+def clients():
+	# send rate, skipped frames and current quality level of every client streaming video
+	return jsonify(renditions.client_stats())
+
 @app.route("/video_feed")
 def video_feed():
+	# with query parameters (e.g. /video_feed?width=320&colormap=bwr), stream a rendition with those settings
+	# rather than the camera's own, which the buttons change for everyone
+	if request.args:
+		try:
+			rendition = renditions.get(renditions.key_from_args(request.args, thermcam))
+		except ValueError as e:
+			return Response(str(e), status=400)
+		except RuntimeError as e:
+			return Response(str(e), status=503)
+		return Response(rendition.hub.frames(request.remote_addr), mimetype="multipart/x-mixed-replace; boundary=frame")
 	# return the response generated along with the specific media
 	# type (mime type)
-	return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
+	return Response(generate(request.remote_addr), mimetype="multipart/x-mixed-replace; boundary=frame")
 
 def get_ip_address():
 	"""Find the current IP address of the device"""
@@ -115,59 +113,84 @@ def get_ip_address():
 	return ip_address
 
 def pull_images():
-	global thermcam, outputFrame
-	# loop over frames from the video stream
+	global thermcam
+	# loop over frames from the video stream, but only render while someone is watching;
+	# the acquisition thread and any raw-data consumers keep running at sensor rate regardless
 	while thermcam is not None:
+		renditions.evict()
+		if not renditions.wait_for_viewers(timeout=1.0):
+			continue
 		current_frame=None
 		try:
-			current_frame = thermcam.update_image_frame()
+			if hub.viewers:
+				current_frame = thermcam.update_image_frame()
+			else:
+				thermcam.update_raw_image_only()
+			renditions.render(thermcam)
 		except Exception:
 			print("Too many retries error caught; continuing...")
 			logger.info(traceback.format_exc())
 
-		# If we have a frame, acquire the lock, set the output frame, and release the lock
+		# If we have a frame, hand it to the hub without copying; the camera alternates between two output buffers,
+		# so the one the hub releases here is the one the next frame is drawn into
 		if current_frame is not None:
-			with lock:
-				outputFrame = current_frame.copy()
-
-def generate():
-	# grab global references to the output frame and lock variables
-	global outputFrame, lock
-	# loop over frames from the output stream
-	while True:
-		# wait until the lock is acquired
-		with lock:
-			# check if the output frame is available, otherwise skip the iteration of the loop
-			if outputFrame is None:
-				continue
-			# encode the frame in JPEG format
-			(flag, encodedImage) = cv2.imencode(".jpg", outputFrame)
-			# ensure the frame was successfully encoded
-			if not flag:
-				continue
-		# yield the output frame in the byte format
-		yield(b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encodedImage) + b'\r\n')
-
-def start_server(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/'):
+			hub.publish(current_frame)
+
+def generate(name:str = ''):
+	# yield each new frame in the byte format, waiting on the hub rather than spinning;
+	# a client that can't keep up skips frames and gets smaller JPEGs until it catches up
+	yield from hub.frames(name)
+
+def setup_camera(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None, subpages:bool = False,
+				 rollup_path:str = ROLLUP_PATH, burst_seconds=None):
 	global thermcam
 	# initialize the video stream and allow the camera sensor to warmup
-	thermcam = pithermalcam(output_folder=output_folder)
+	# sensor can be any backend from sensors.py (or 'synthetic'/a replay file) to run without the camera
+	# subpages publishes a frame after each half of the sensor's chess pattern, for twice the rate at half the latency
+	# rollup_path is where the long-term temperature history is kept (None to keep it in memory only)
+	# burst_seconds (pre, post) also records the seconds around each snapshot or alarm; off unless given
+	thermcam = pithermalcam(output_folder=output_folder, sensor=sensor, preallocate=True, acquisition_thread=True, subpages=subpages,
+						   wait_for_first_frame=False, rollup_path=rollup_path, burst_seconds=burst_seconds)  # pull_images renders the first frame once it's read
+	thermcam.add_raw_frame_consumer(raw_frames.write)
+	thermcam.add_raw_frame_consumer(delta_frames.write)
+	hub.metrics = thermcam.metrics  # Encode and send timings go alongside the camera's own
+	thermcam.metrics.set_gauge('clients_connected', lambda: renditions.viewers)
+	thermcam.metrics.set_gauge('renditions', lambda: len(renditions))
 	time.sleep(0.1)
 
-	# start a thread that will perform motion detection
-	t = threading.Thread(target=pull_images)
-	t.daemon = True
-	t.start()
+def start_server(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None, use_asyncio:bool = False, subpages:bool = False,
+				 rollup_path:str = ROLLUP_PATH, burst_seconds=None):
+	setup_camera(output_folder, sensor, subpages, rollup_path, burst_seconds)
 
 	ip=get_ip_address()
 	port=8000
 
 	print(f'Server can be found at {ip}:{port}')
 
+	if use_asyncio:
+		# serve every connection from one event loop instead of a thread each; see async_server.py
+		try:
+			from pithermalcam.async_server import serve
+		except:
+			from async_server import serve
+		asyncio.run(serve(ip, port))
+		return
+
+	# start a thread that will perform motion detection
+	t = threading.Thread(target=pull_images)
+	t.daemon = True
+	t.start()
+
 	# start the flask app
 	app.run(host=ip, port=port, debug=False,threaded=True, use_reloader=False)
 
 
 # If this is the main thread, simply start the server
+# Optionally pass 'synthetic' or a file of recorded frames to run without the camera, --asyncio for the single-threaded server
+# --subpages to publish a frame per subpage and --burst to record the seconds around each snapshot or alarm.
+# Only the camera's temperature history is saved, not a stand-in's
 if __name__ == '__main__':
-	start_server()
+	import sys
+	args = [arg for arg in sys.argv[1:] if not arg.startswith('--')]
+	start_server(sensor=args[0] if args else None, use_asyncio='--asyncio' in sys.argv, subpages='--subpages' in sys.argv,
+				 rollup_path=None if args else ROLLUP_PATH, burst_seconds=BURST_SECONDS if '--burst' in sys.argv else None)
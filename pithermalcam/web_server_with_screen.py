@@ -5,12 +5,28 @@
 # If running directly, run from root folder, not pithermalcam folder
 ##################################
 try:  # If called as an imported module
-	from pi_therm_cam import pithermalcam
+	from pithermalcam.pi_therm_cam import pithermalcam
+	from pithermalcam.stream_hub import StreamHub
+	from pithermalcam.renditions import RenditionCache
+	from pithermalcam.raw_stream import RawFrameBroadcaster
+	from pithermalcam.codec import FrameEncoder
+	from pithermalcam.routes import register_routes
+	from pithermalcam.rollup import ROLLUP_PATH
 except:  # If run directly
 	from pi_therm_cam import pithermalcam
-from flask import Response, request
+	from stream_hub import StreamHub
+	from renditions import RenditionCache
+	from raw_stream import RawFrameBroadcaster
+	from codec import FrameEncoder
+	from routes import register_routes
+	from rollup import ROLLUP_PATH
+from flask import Response, request, jsonify
 from flask import Flask
 from flask import render_template
+try:
+	from flask_sock import Sock
+except ImportError:  # Optional; without it there's no raw WebSocket stream for the page's render=browser mode
+	Sock = None
 from datetime import datetime
 import threading
 import time, socket, logging, traceback
@@ -67,10 +83,16 @@ logging.basicConfig(filename='pithermcam.log',filemode='a',
 					level=logging.WARNING,datefmt='%d-%b-%y %H:%M:%S')
 logger = logging.getLogger(__name__)
 
-# initialize the output frame and a lock used to ensure thread-safe exchanges of the output frames (useful when multiple browsers/tabs are viewing the stream)
-outputFrame = None
+# initialize the hub that hands each new frame to every browser/tab viewing the stream (and the screen), encoding it only once
+hub = StreamHub()
+# clients that ask for their own size/quality/colormap/interpolation share a rendition per distinct combination
+renditions = RenditionCache(hub)
+# raw temperature frames for browsers that render themselves (see raw_stream.py and the page's render=browser mode)
+raw_frames = RawFrameBroadcaster()
+delta_frames = RawFrameBroadcaster(FrameEncoder())  # the same, delta-coded against periodic keyframes (/ws/raw?codec=delta)
+screen_seq = 0
 thermcam = None
-lock = threading.Lock()
+raw_socket = Sock is not None  # whether /ws/raw is served, so the page can offer render=browser
 
 #  display
 disp = None
@@ -82,63 +104,10 @@ app_started = False
 @app.route("/")
 def index():
 	# return the rendered template
-	return render_template("index.html")
-
-#background processes happen without any refreshing (for button clicks)
-@app.route('/save')
-def save_image():
-	thermcam.save_image()
-	return ("Snapshot Saved")
-
-@app.route('/inc_min_temp')
-def inc_min_temp():
-    thermcam.change_min_temp()
-    return ("Increased Min Temp")
-
-@app.route('/dec_min_temp')
-def dec_min_temp():
-    thermcam.change_min_temp(increase=False)
-    return ("Decreased Min Temp")
-
-@app.route('/inc_max_temp')
-def inc_max_temp():
-    thermcam.change_max_temp()
-    return ("Increased Max Temp")
-
-@app.route('/dec_max_temp')
-def dec_max_temp():
-    thermcam.change_max_temp(increase=False)
-    return ("Decreased Max Temp")
-
-@app.route('/units')
-def change_units():
-	thermcam.use_f = not thermcam.use_f
-	return ("Units changed")
-
-@app.route('/colormap')
-def increment_colormap():
-	thermcam.change_colormap()
-	return ("Colormap changed")
-
-@app.route('/colormapback')
-def decrement_colormap():
-	thermcam.change_colormap(forward=False)
-	return ("Colormap changed back")
-
-@app.route('/filter')
-def toggle_filter():
-	thermcam.filter_image=not thermcam.filter_image
-	return ("Filtering Toggled")
-
-@app.route('/interpolation')
-def increment_interpolation():
-	thermcam.change_interpolation()
-	return ("Interpolation Changed")
-
-@app.route('/interpolationback')
-def decrement_interpolation():
-	thermcam.change_interpolation(forward=False)
-	return ("Interpolation Changed Back")
+	return render_template("index.html", raw_socket=raw_socket)
+
+# the buttons, snapshots, metrics and JSON APIs, shared with the other server (see routes.py)
+register_routes(app, lambda: thermcam)
 
 @app.route('/exit')
 def appexit():
@@ -148,13 +117,42 @@ def appexit():
 		raise RuntimeError('Not running with the Werkzeug Server')
 	func()
 	thermcam = None
+	hub.close()
+	renditions.close()
+	raw_frames.close()
+	delta_frames.close()
 	return 'Server shutting down...'
 
+if Sock is not None:
+	sock = Sock(app)
+
+	@sock.route('/ws/raw')
+	def raw_frames_socket(ws):
+		# push each sensor frame as a binary message; see raw_stream.HEADER for the layout
+		frames = delta_frames if request.args.get('codec') == 'delta' else raw_frames
+		for seq, data in frames.frames():
+			ws.send(data)
+
+@app.route('/api/clients')
+def clients():
+	# send rate, skipped frames and current quality level of every client streaming video
+	return jsonify(renditions.client_stats())
+
 @app.route("/video_feed")
 def video_feed():
+	# with query parameters (e.g. /video_feed?width=320&colormap=bwr), stream a rendition with those settings
+	# rather than the camera's own, which the buttons change for everyone
+	if request.args:
+		try:
+			rendition = renditions.get(renditions.key_from_args(request.args, thermcam))
+		except ValueError as e:
+			return Response(str(e), status=400)
+		except RuntimeError as e:
+			return Response(str(e), status=503)
+		return Response(rendition.hub.frames(request.remote_addr), mimetype="multipart/x-mixed-replace; boundary=frame")
 	# return the response generated along with the specific media
 	# type (mime type)
-	return Response(generate(), mimetype="multipart/x-mixed-replace; boundary=frame")
+	return Response(generate(request.remote_addr), mimetype="multipart/x-mixed-replace; boundary=frame")
 
 def setup_rotary_input():
     global ioe, rotary_count, rotary_start_offset
@@ -258,11 +256,11 @@ def update_trackball():
 
     if trackball_state_y == 1:
         if trackball_state_x > 1:
-            increment_colormap()
+            thermcam.change_colormap()
             trackball_msg = "Colour Map Inc"
             trackball_state_x = 0
         elif trackball_state_x < -1:
-            decrement_colormap()
+            thermcam.change_colormap(forward=False)
             trackball_msg = "Colour Map Dec"
             trackball_state_x = 0
         trackball_delta_x = 0
@@ -328,7 +326,7 @@ def add_trackball_msg(draw=None):
 
 
 def update_screen(current_frame=None):
-    global disp, thermcam, rotary_count
+    global disp, thermcam, rotary_count, screen_seq
     img = Image.new('RGB', (disp.width, disp.height), color=(0, 0, 0))
 
     #if thermcam is not None:
@@ -361,9 +359,10 @@ def update_screen(current_frame=None):
         error_msg = None
         if current_frame is not None:
             try:
-                (flag, encodedImage) = cv2.imencode(".jpg", current_frame)
-                if flag:
-                    image = Image.open(io.BytesIO(bytearray(encodedImage)))
+                # Reuse the hub's JPEG for this frame, so it's shared with any browsers rather than encoded again
+                (screen_seq, encodedImage) = hub.get_jpeg(screen_seq, timeout=0)
+                if encodedImage is not None:
+                    image = Image.open(io.BytesIO(encodedImage))
 
                     # Resize the image
                     image = image.resize((disp.width, disp.height))
@@ -417,50 +416,54 @@ def get_ip_address():
         
 
 def pull_images():
-    global thermcam, outputFrame
-    # loop over frames from the video stream
+    global thermcam
+    # loop over frames from the video stream, but only render while a browser is watching or the screen shows the camera;
+    # the acquisition thread and any raw-data consumers keep running at sensor rate regardless
     while thermcam is not None:
         current_frame=None
+        renditions.evict()
+        if rotary_count != 1 and not renditions.wait_for_viewers(timeout=0.25):
+            update_screen(current_frame)  # Keep the info screens ticking over while idle
+            continue
         try:
-            current_frame = thermcam.update_image_frame()
+            if rotary_count == 1 or hub.viewers:
+                current_frame = thermcam.update_image_frame()
+            else:
+                thermcam.update_raw_image_only()
+            renditions.render(thermcam)
         except Exception:
             print("Too many retries error caught; continuing...")
             logger.info(traceback.format_exc())
 
-        # If we have a frame, acquire the lock, set the output frame, and release the lock
+        # If we have a frame, hand it to the hub without copying; the camera alternates between two output buffers,
+        # so the one the hub releases here is the one the next frame is drawn into
         if current_frame is not None:
-            with lock:
-                outputFrame = current_frame.copy()
+            hub.publish(current_frame)
 
         #update_rotary_input()
         #update_trackball()
         update_screen(current_frame)
 
-def generate():
-	# grab global references to the output frame and lock variables
-    global outputFrame, lock
+def generate(name:str = ''):
+    # yield each new frame in the byte format, waiting on the hub rather than spinning;
+    # a client that can't keep up skips frames and gets smaller JPEGs until it catches up
+    yield from hub.frames(name)
 
-    # loop over frames from the output stream
-    while True:
-        # wait until the lock is acquired
-        with lock:
-            # check if the output frame is available, otherwise skip the iteration of the loop
-            if outputFrame is None:
-                continue
-            # encode the frame in JPEG format
-            (flag, encodedImage) = cv2.imencode(".jpg", outputFrame)
-            # ensure the frame was successfully encoded
-            if not flag:
-                continue
-
-        # yield the output frame in the byte format
-        yield(b'--frame\r\n' b'Content-Type: image/jpeg\r\n\r\n' + bytearray(encodedImage) + b'\r\n')
-
-
-def start_server(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/'):
+
+def start_server(output_folder:str = '/home/pi/pithermalcam/saved_snapshots/', sensor=None, subpages:bool = False,
+				 rollup_path:str = ROLLUP_PATH, burst_seconds=None):
 	global thermcam
 	# initialize the video stream and allow the camera sensor to warmup
-	thermcam = pithermalcam(output_folder=output_folder)
+	# sensor can be any backend from sensors.py (or 'synthetic'/a replay file) to run without the camera
+	# rollup_path is where the long-term temperature history is kept (None to keep it in memory only)
+	# burst_seconds (pre, post) also records the seconds around each snapshot or alarm; off unless given
+	thermcam = pithermalcam(output_folder=output_folder, sensor=sensor, preallocate=True, acquisition_thread=True, subpages=subpages,
+						   wait_for_first_frame=False, rollup_path=rollup_path, burst_seconds=burst_seconds)  # pull_images renders the first frame once it's read
+	thermcam.add_raw_frame_consumer(raw_frames.write)
+	thermcam.add_raw_frame_consumer(delta_frames.write)
+	hub.metrics = thermcam.metrics  # Encode and send timings go alongside the camera's own
+	thermcam.metrics.set_gauge('clients_connected', lambda: renditions.viewers)
+	thermcam.metrics.set_gauge('renditions', lambda: len(renditions))
 	time.sleep(0.1)
 
 	# start a thread that will perform motion detection
@@ -23,6 +23,9 @@ setuptools.setup(
         'opencv-python',
         'cmapy',
     ],
+    extras_require={
+        'browser': ['flask-sock'],  # /ws/raw for the page's render=browser mode on the default server
+    },
     classifiers=[
         # Full list: https://pypi.org/classifiers/ or https://pypi.python.org/pypi?%3Aaction=list_classifiers
         "Programming Language :: Python",
@@ -31,7 +34,7 @@ setuptools.setup(
         "Operating System :: POSIX :: Linux",
     ],
     keywords="raspberry pi mlx90640 thermal camera ir flir",
-    python_requires='>=3.6',
+    python_requires='>=3.7',
     setup_requires=[
         "flake8"
     ],
@@ -0,0 +1,130 @@
+import threading
+import numpy as np
+import pytest
+from pithermalcam.acquisition import Acquisition, FrameRing, RetryPolicy
+from pithermalcam.sensors import CHESS_PATTERN, SyntheticSensor
+
+
+def test_next_slot_invalidates_the_oldest_frame_before_it_is_overwritten():
+    ring = FrameRing(capacity=4)
+    for value in range(1, 5):
+        ring.push(np.full((24, 32), value, dtype=np.float32))
+    assert ring.read(1) is not None
+    slot = ring.next_slot()  # Frame 1's slot
+    assert ring.read(1) is None
+    slot[...] = 5
+    assert ring.commit() == 5
+    assert ring.read(5)[1][0, 0] == 5
+    assert ring.read(2)[1][0, 0] == 2
+
+
+def test_readers_never_see_a_torn_frame():
+    ring = FrameRing(capacity=2)
+    stop = threading.Event()
+
+    def write():
+        value = 0
+        while not stop.is_set():
+            value += 1
+            slot = ring.next_slot()
+            slot[:12] = value  # Write the frame in two halves, as a slow sensor read would
+            slot[12:] = value
+            ring.commit()
+
+    writer = threading.Thread(target=write)
+    writer.start()
+    try:
+        out = np.empty((24, 32), dtype=np.float32)
+        reads = 0
+        while reads < 2000:
+            seq = ring.seq
+            result = ring.read(seq, out=out)
+            if result is not None:
+                assert (out == seq).all()
+                reads += 1
+    finally:
+        stop.set()
+        writer.join()
+
+
+def test_subpage_frames_replace_one_chess_half_at_a_time():
+    sensor = SyntheticSensor(realtime=False, seed=5)
+    subpages_read = []
+    get_subpage = sensor.getSubpage
+    sensor.getSubpage = lambda framebuf: subpages_read.append(get_subpage(framebuf)) or subpages_read[-1]
+    acquisition = Acquisition(sensor, capacity=4, subpages=True)
+    frames = []
+    acquisition.add_consumer(lambda seq, timestamp, frame: frames.append(frame.copy()))
+
+    acquisition.read_frame()
+    assert subpages_read == [0, 1]  # The first frame waits for both halves, so no pixel is left unread
+    assert (frames[0] > 15).all()
+    reference = SyntheticSensor(realtime=False, seed=5)  # Reads the same scene a subpage at a time, by hand
+    expected = np.zeros((24, 32), dtype=np.float32)
+    reference.getSubpage(expected)
+    reference.getSubpage(expected)
+    assert np.array_equal(frames[0], expected)
+
+    for n in range(1, 8):
+        acquisition.read_frame()
+        subpage = subpages_read[-1]
+        assert subpage == (n + 1) % 2 and len(subpages_read) == n + 2  # One subpage per frame from now on, alternating
+        new, carried = CHESS_PATTERN == subpage, CHESS_PATTERN != subpage
+        assert np.array_equal(frames[n][carried], frames[n - 1][carried])
+        assert not np.array_equal(frames[n][new], frames[n - 1][new])
+        assert reference.getSubpage(expected) == subpage
+        assert np.array_equal(frames[n], expected)
+
+
+class FlakySensor(SyntheticSensor):
+    """Fails the reads numbered in failing (from 0) with an I2C error"""
+
+    def __init__(self, failing, **kwargs):
+        super().__init__(realtime=False, **kwargs)
+        self.failing = set(failing)
+        self.reads = 0
+
+    def getFrame(self, framebuf):
+        self.reads += 1
+        if self.reads - 1 in self.failing:
+            raise OSError(121, 'Remote I/O error')
+        super().getFrame(framebuf)
+
+
+def test_frames_errored_counts_each_failed_frame_once():
+    # Frame 1 succeeds on its third attempt; frame 2 fails all four; frame 3 reads first time
+    sensor = FlakySensor(failing={0, 1, 3, 4, 5, 6})
+    acquisition = Acquisition(sensor, retry_policy=RetryPolicy(max_retries=3, backoff=0))
+    acquisition.read_frame()
+    with pytest.raises(OSError):
+        acquisition.read_frame()
+    acquisition.read_frame()
+    counters = acquisition.metrics.summary()['counters']
+    assert counters['frames_errored'] == 1
+    assert counters['read_errors_os'] == 6
+    assert counters['read_retries_os'] == 5
+    assert counters['frames_acquired'] == 2
+
+
+class BrokenSensor(SyntheticSensor):
+    def getFrame(self, framebuf):
+        raise AttributeError("'NoneType' object has no attribute 'readinto'")
+
+
+def test_an_unexpected_error_stops_the_thread_and_clears_running(caplog):
+    acquisition = Acquisition(BrokenSensor(realtime=False))
+    acquisition.start()
+    acquisition._thread.join(timeout=5)
+    assert not acquisition.running
+    assert 'Acquisition stopped by an unexpected error' in caplog.text and 'readinto' in caplog.text
+    acquisition.start()  # And can be started again
+    assert acquisition._thread is not None
+    acquisition.stop()
+
+
+def test_a_replay_that_runs_out_clears_running():
+    from pithermalcam.sensors import ReplaySensor
+    acquisition = Acquisition(ReplaySensor(np.zeros((3, 24, 32)), loop=False, realtime=False))
+    acquisition.start()
+    acquisition._thread.join(timeout=5)
+    assert not acquisition.running and acquisition.ring.seq == 3
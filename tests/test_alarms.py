@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+from pithermalcam.alarms import AlarmEngine
+
+
+def test_rate_window_longer_than_the_history_is_refused():
+    engine = AlarmEngine(history=41, max_window=10.0)
+    assert engine.max_window == 10.0
+    with pytest.raises(ValueError):
+        engine.add_rule('too long', above=1.0, window=10.5)
+    with pytest.raises(ValueError):
+        engine.add('too long', {'above': 1, 'window': 60})  # As a PUT to /api/alarms/<name> would
+    assert len(engine) == 0
+
+
+def test_rate_rule_with_the_longest_window_fires():
+    engine = AlarmEngine(history=41, max_window=10.0)
+    engine.add_rule('warming', above=0.5, window=engine.max_window)
+    frame = np.full((24, 32), 20.0, dtype=np.float32)
+    for seq in range(1, 80):
+        frame += 0.25  # 1C a second at 4 frames a second
+        engine.update(seq, seq/4.0, frame)
+    assert 'warming' in engine.active()
+    assert engine.active()['warming']['value'] == pytest.approx(1.0)
+
+
+@pytest.mark.parametrize('frame_rate', [16.0, 4.0, 1.0, 0.5])
+def test_rate_windows_follow_frame_timestamps_at_any_frame_rate(frame_rate):
+    # As after the sensor is stepped down to a lower refresh rate, or frames come faster than expected
+    engine = AlarmEngine(history=41, max_window=10.0)
+    engine.add_rule('warming', above=0.5, window=engine.max_window)
+    frame = np.full((24, 32), 20.0, dtype=np.float32)
+    for seq in range(1, int(20*frame_rate)):
+        frame += 1/frame_rate  # 1C a second
+        engine.update(seq, seq/frame_rate, frame)
+        if seq/frame_rate < engine.max_window:
+            assert not engine.active()
+    assert engine.active()['warming']['value'] == pytest.approx(1.0, rel=1e-4)
+    assert np.isfinite(engine._compiled['times']).sum() <= 41
@@ -0,0 +1,52 @@
+import asyncio, socket, threading, time, urllib.request
+from pithermalcam import async_server, web_server
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def test_start_server_passes_subpages_through(monkeypatch):
+    calls = []
+    monkeypatch.setattr(web_server, 'start_server', lambda **kwargs: calls.append(kwargs))
+    async_server.start_server(sensor='synthetic', subpages=True, rollup_path=None)
+    assert calls[0]['use_asyncio'] and calls[0]['subpages'] and calls[0]['rollup_path'] is None
+
+
+def test_long_polls_do_not_hold_up_the_camera_or_the_stream(tmp_path):
+    web_server.setup_camera(str(tmp_path), 'synthetic', subpages=True, rollup_path=None)
+    assert web_server.thermcam._acquisition.subpages
+    port = free_port()
+    url = f'http://127.0.0.1:{port}'
+    server = async_server.AsyncStreamServer(flask_workers=2)
+    serving = threading.Thread(target=asyncio.run, args=(server.serve('127.0.0.1', port),))
+    serving.start()
+    try:
+        for _ in range(50):
+            try:
+                urllib.request.urlopen(url + '/api/clients', timeout=1).read()
+                break
+            except OSError:
+                time.sleep(0.1)
+        # Take every Flask worker with a long poll that nothing will answer
+        polls = [threading.Thread(target=lambda: urllib.request.urlopen(url + '/api/alarms?wait=3', timeout=10).read())
+                 for _ in range(2)]
+        for poll in polls:
+            poll.start()
+        time.sleep(0.3)
+        with urllib.request.urlopen(url + '/video_feed', timeout=5) as stream:
+            start = time.monotonic()
+            frames = 0
+            while frames < 3:
+                if stream.readline().startswith(b'--frame'):
+                    frames += 1
+            assert time.monotonic() - start < 2.5  # Well before the long polls give their workers back
+        assert any(thread.name == 'pithermalcam-camera' for thread in threading.enumerate())
+        for poll in polls:
+            poll.join()
+    finally:
+        urllib.request.urlopen(url + '/exit', timeout=5).read()
+        serving.join(timeout=10)
+    assert not serving.is_alive()
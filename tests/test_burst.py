@@ -0,0 +1,105 @@
+import numpy as np
+import pytest
+from pithermalcam.burst import BurstCapture, FRAME_BYTES
+from pithermalcam.recording import RecordingReader
+
+RATE = 10.0  # Frames per second fed in, at exact timestamps
+
+
+def feed(burst, first:int, last:int, rate:float = RATE):
+    """Frames first..last (seq n at n/rate seconds), each filled with its own seq in C"""
+    for n in range(first, last + 1):
+        burst.update(n, n/rate, np.full((24, 32), n, dtype=np.float32))
+
+
+def recorded(path):
+    reader = RecordingReader(path)
+    seqs = np.asarray(reader.seqs)
+    frames = reader.frames()
+    for seq, frame in zip(seqs, frames):
+        assert np.allclose(frame, seq)  # Each frame kept its own temperatures
+    return seqs.tolist()
+
+
+def test_trigger_saves_the_pre_and_post_trigger_window(tmp_path):
+    burst = BurstCapture(str(tmp_path), pre_seconds=2, post_seconds=1, frame_rate=RATE)
+    feed(burst, 1, 50)
+    path = burst.trigger('test', timestamp=5.0)
+    assert burst.pending == 1
+    feed(burst, 51, 59)  # Not past the post-trigger window yet
+    assert burst.pending == 1
+    feed(burst, 60, 70)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(30, 61))  # 3.0s to 6.0s
+
+
+def test_trigger_while_collecting_extends_the_same_burst(tmp_path):
+    burst = BurstCapture(str(tmp_path), pre_seconds=1, post_seconds=1, frame_rate=RATE)
+    feed(burst, 1, 50)
+    path = burst.trigger('save', timestamp=5.0)
+    feed(burst, 51, 55)
+    assert burst.trigger('alarm', timestamp=5.5) == path
+    feed(burst, 56, 80)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(40, 66))  # 4.0s to 6.5s
+    assert burst.metrics.summary()['counters']['bursts_triggered'] == 1
+
+
+def test_memory_cap_shortens_the_pre_trigger_window(tmp_path):
+    burst = BurstCapture(str(tmp_path), pre_seconds=10, post_seconds=1, frame_rate=RATE, max_memory=FRAME_BYTES*16)
+    assert burst.capacity == 16 and burst.memory == FRAME_BYTES*16
+    feed(burst, 1, 100)
+    path = burst.trigger('test', timestamp=10.0)
+    feed(burst, 101, 120)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(95, 111))  # Only 1.5s fits: 0.5s before the trigger, all of the 1s after
+
+
+def test_extension_stops_at_what_the_ring_holds(tmp_path):
+    burst = BurstCapture(str(tmp_path), pre_seconds=0.5, post_seconds=1, frame_rate=RATE, max_memory=FRAME_BYTES*21)
+    feed(burst, 1, 50)
+    path = burst.trigger('first', timestamp=5.0)
+    feed(burst, 51, 58)
+    burst.trigger('second', timestamp=5.8)  # Would run to 6.8s, but the ring only holds 2s from 4.5s
+    feed(burst, 59, 90)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(45, 66))
+
+
+def test_ring_grows_when_frames_come_faster_than_the_frame_rate_given(tmp_path):
+    burst = BurstCapture(str(tmp_path), pre_seconds=2, post_seconds=1, frame_rate=RATE/4)
+    assert burst.capacity == 11  # 4s at 2.5 frames a second
+    feed(burst, 1, 50)
+    assert burst.capacity > 41 and burst.window >= 4.0
+    path = burst.trigger('test', timestamp=5.0)
+    feed(burst, 51, 70)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(30, 61))  # All of 3.0s to 6.0s, not just the last 1.6s
+
+
+def test_window_follows_frames_slower_than_the_frame_rate_given(tmp_path):
+    # As after the sensor is stepped down to a lower refresh rate
+    burst = BurstCapture(str(tmp_path), pre_seconds=0.5, post_seconds=1, frame_rate=RATE, max_memory=FRAME_BYTES*26)
+    feed(burst, 1, 50, rate=RATE/2)
+    assert burst.capacity == 26 and burst.window == pytest.approx(5.0)
+    path = burst.trigger('first', timestamp=10.0)
+    feed(burst, 51, 54, rate=RATE/2)
+    burst.trigger('second', timestamp=10.8)  # Runs to 11.8s, which the ring's 5s now reaches
+    feed(burst, 55, 70, rate=RATE/2)
+    assert burst.flush(timeout=5)
+    assert recorded(path) == list(range(48, 60))  # 9.5s to 11.8s
+    assert burst.capacity == 26
+
+
+def test_too_little_memory_is_refused(tmp_path):
+    with pytest.raises(ValueError):
+        BurstCapture(str(tmp_path), max_memory=FRAME_BYTES)
+
+
+def test_burst_capture_is_off_by_default(tmp_path):
+    from pithermalcam.pi_therm_cam import pithermalcam
+    from pithermalcam.sensors import SyntheticSensor
+    camera = pithermalcam(sensor=SyntheticSensor(realtime=False, seed=1), output_folder=str(tmp_path))
+    assert camera.burst is None
+    camera = pithermalcam(sensor=SyntheticSensor(realtime=False, seed=1), output_folder=str(tmp_path), burst_seconds=(1, 1))
+    assert camera.burst is not None and camera.burst.pre_seconds == 1
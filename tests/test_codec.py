@@ -0,0 +1,65 @@
+import numpy as np
+import pytest
+from pithermalcam.codec import FrameEncoder, FrameDecoder, quantize, SCALE, _shuffle, _unshuffle
+from pithermalcam.sensors import SyntheticSensor
+
+
+def sensor_frames(count, seed=6):
+    sensor = SyntheticSensor(realtime=False, seed=seed)
+    frames = np.zeros((count, 24, 32), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames
+
+
+def expected(frame):
+    """What decoding must give back, bit for bit: the frame's centi-degrees, scaled as the decoder does"""
+    return np.multiply(quantize(frame).reshape(24, 32), SCALE, dtype=np.float32, casting='unsafe')
+
+
+def test_byte_shuffle_round_trips_every_int16_bit_exact():
+    values = np.concatenate([np.arange(-32768, 32768, dtype=np.int32), [-1, 0, 1, 255, 256, -256]])
+    shuffled = _shuffle(values)
+    assert len(shuffled) == 2*len(values)
+    assert np.array_equal(_unshuffle(shuffled, len(values)), values)
+    # Low bytes first, then high bytes
+    assert _shuffle(np.array([0x0102, 0x0304])) == bytes([0x02, 0x04, 0x01, 0x03])
+
+
+def test_keyframes_and_deltas_decode_bit_exact():
+    frames = sensor_frames(20)
+    encoder, decoder = FrameEncoder(keyframe_interval=8), FrameDecoder()
+    kinds = []
+    out = np.zeros((24, 32), dtype=np.float32)
+    for frame in frames:
+        is_keyframe, data = encoder.encode(frame)
+        kinds.append(is_keyframe)
+        assert FrameDecoder.is_keyframe(data) == is_keyframe
+        assert decoder.decode(data, out) is out
+        assert np.array_equal(out, expected(frame))
+    assert kinds == [n % 8 == 0 for n in range(20)]
+
+
+def test_a_reader_can_join_at_any_keyframe():
+    frames = sensor_frames(12)
+    encoder = FrameEncoder(keyframe_interval=4)
+    encoded = [encoder.encode(frame)[1] for frame in frames]
+    late = FrameDecoder()
+    with pytest.raises(ValueError):
+        late.decode(encoded[5])  # A delta, with no keyframe seen yet
+    for frame, data in zip(frames[4:], encoded[4:]):
+        assert np.array_equal(late.decode(data), expected(frame))
+
+
+def test_changes_too_big_for_a_delta_become_keyframes():
+    frame = np.full((24, 32), -40.0, dtype=np.float32)
+    hot = frame.copy()
+    hot[5, 5] = 300.0  # 340C above the keyframe: more than 327.67C of int16 centi-degrees
+    encoder, decoder = FrameEncoder(keyframe_interval=32), FrameDecoder()
+    assert encoder.encode(frame)[0]
+    is_keyframe, data = encoder.encode(hot)
+    assert is_keyframe and np.array_equal(decoder.decode(data), expected(hot))
+    small = hot + 0.05
+    is_keyframe, data = encoder.encode(small)
+    assert not is_keyframe and np.array_equal(decoder.decode(data), expected(small))
+
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+from pithermalcam.denoise import TemporalFilter, filter_mode
+
+NOISE = 0.25
+
+
+def noisy(truth, rng):
+    return (truth + rng.normal(0, NOISE, truth.shape)).astype(np.float32)
+
+
+def test_static_scene_converges_and_quiets_the_noise():
+    rng = np.random.RandomState(0)
+    truth = np.linspace(20, 35, 24*32, dtype=np.float32).reshape(24, 32)
+    denoiser = TemporalFilter(noise=NOISE)
+    for _ in range(60):
+        filtered = denoiser.update(noisy(truth, rng))
+    error = filtered - truth
+    assert abs(error.mean()) < 0.02
+    assert error.std() < NOISE/2  # Averaging about the last ten frames cuts the noise to roughly a third
+    prior = denoiser._variance + denoiser.drift*denoiser.drift
+    gain = prior/(prior + NOISE*NOISE)  # What the next frame will be weighted by
+    # Settled to about 0.2 everywhere but the odd pixel a 3-sigma noise spike just reset
+    assert 0.18 < np.median(gain) < 0.22 and np.mean(np.isclose(gain, np.median(gain))) > 0.9
+
+
+def test_step_change_past_the_motion_threshold_passes_straight_through():
+    rng = np.random.RandomState(1)
+    truth = np.full((24, 32), 22.0, dtype=np.float32)
+    denoiser = TemporalFilter(noise=NOISE, motion_threshold=3.0)
+    for _ in range(30):
+        denoiser.update(noisy(truth, rng))
+    stepped = truth.copy()
+    stepped[8:16, 10:20] = 40.0  # Something hot moves into view
+    frame = noisy(stepped, rng)
+    filtered = denoiser.update(frame)
+    assert np.array_equal(filtered[8:16, 10:20], frame[8:16, 10:20])  # Not smeared toward the old 22C
+    # While the rest of the frame stays smoothed
+    assert np.abs(filtered[:8] - truth[:8]).mean() < np.abs(frame[:8] - truth[:8]).mean()/2
+
+
+def test_small_changes_are_smoothed_rather_than_passed_through():
+    denoiser = TemporalFilter(noise=NOISE, motion_threshold=3.0)
+    frame = np.full((24, 32), 22.0, dtype=np.float32)
+    for _ in range(30):
+        denoiser.update(frame)
+    filtered = denoiser.update(frame + 0.3)
+    assert np.all((filtered > 22.0) & (filtered < 22.3))
+
+
+def test_non_finite_readings_pass_through():
+    denoiser = TemporalFilter()
+    frame = np.full((24, 32), 22.0, dtype=np.float32)
+    denoiser.update(frame)
+    frame[3, 4] = np.nan
+    filtered = denoiser.update(frame)
+    assert np.isnan(filtered[3, 4]) and np.isfinite(np.delete(filtered.reshape(-1), 3*32 + 4)).all()
+
+
+def test_output_buffer_is_reused():
+    denoiser = TemporalFilter()
+    out = np.zeros(24*32, dtype=np.float32)  # Flat, as the pipeline's own buffers are
+    frame = np.full(24*32, 22.0, dtype=np.float32)
+    internal = [denoiser._estimate, denoiser._variance, denoiser._innovation, denoiser._gain, denoiser._scratch]
+    for _ in range(3):
+        assert denoiser.update(frame, out=out) is out
+    assert np.allclose(out, 22.0)
+    assert all(a is b for a, b in zip(internal, [denoiser._estimate, denoiser._variance, denoiser._innovation,
+                                                 denoiser._gain, denoiser._scratch]))
+    copy = denoiser.update(frame)
+    assert copy is not denoiser._estimate and copy.shape == (24, 32)
+
+
+@pytest.mark.parametrize('value, mode', [(True, 'bilateral'), (False, 'off'), ('temporal', 'temporal'), ('ON', 'bilateral'),
+                                         ('none', 'off')])
+def test_filter_mode(value, mode):
+    assert filter_mode(value) == mode
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from scipy import ndimage
+from pithermalcam.interpolation import SeparableZoom
+from pithermalcam.sensors import SyntheticSensor
+
+# SeparableZoom works in float32, ndimage.zoom in float64; well under the sensor's own 0.01C resolution
+TOLERANCE = 1e-3  # C
+
+
+def sensor_frames(count):
+    sensor = SyntheticSensor(realtime=False, seed=4)
+    frames = np.zeros((count, 24*32), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames.reshape(count, 24, 32)
+
+
+@pytest.mark.parametrize('flip_horizontal', [False, True])
+@pytest.mark.parametrize('mode, zoom', [('Pure Scipy', 25), ('Scipy/CV2 Mixed', 10)])
+def test_separable_zoom_matches_ndimage_zoom(mode, zoom, flip_horizontal):
+    operator = SeparableZoom((24, 32), (24*zoom, 32*zoom), flip_horizontal=flip_horizontal)
+    out = np.empty((24*zoom, 32*zoom), dtype=np.float32)
+    for frame in sensor_frames(5):
+        expected = ndimage.zoom(frame.astype(np.float64), zoom)
+        if flip_horizontal:
+            expected = expected[:, ::-1]
+        assert operator(frame, out=out) is out
+        assert np.abs(out - expected).max() < TOLERANCE, mode
+
+
+@pytest.mark.parametrize('order', [1, 2, 3])
+def test_zoom_matrix_matches_each_spline_order(order):
+    frame = sensor_frames(1)[0]
+    operator = SeparableZoom((24, 32), (240, 320), order=order)
+    assert np.abs(operator(frame) - ndimage.zoom(frame.astype(np.float64), 10, order=order)).max() < TOLERANCE
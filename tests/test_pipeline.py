@@ -0,0 +1,117 @@
+import tracemalloc
+import cv2
+import numpy as np
+import pytest
+from scipy import ndimage
+from pithermalcam.pipeline import FramePipeline
+from pithermalcam.pi_therm_cam import pithermalcam
+from pithermalcam.sensors import SyntheticSensor, SENSOR_ROWS, SENSOR_COLS
+
+INTERPOLATIONS = list(enumerate(pithermalcam._interpolation_list))
+COLORMAP = cv2.COLORMAP_JET
+
+
+def sensor_frames(count):
+    sensor = SyntheticSensor(realtime=False, seed=3)
+    frames = np.zeros((count, 24*32), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames
+
+
+def previous_render(temps, index, interpolation, filter_image):
+    """The frame rendering pithermalcam did before FramePipeline, kept as the reference it must reproduce"""
+    temp_min, temp_max = np.min(temps), np.max(temps)
+    raw_image = np.uint8((np.nan_to_num(temps) - temp_min)*255/(temp_max - temp_min)).reshape(24, 32)
+    if index == 5:
+        image = cv2.applyColorMap(ndimage.zoom(raw_image, 25), COLORMAP)
+    elif index == 6:
+        image = cv2.resize(cv2.applyColorMap(ndimage.zoom(raw_image, 10), COLORMAP), (800, 600), interpolation=cv2.INTER_CUBIC)
+    else:
+        image = cv2.resize(cv2.applyColorMap(raw_image, COLORMAP), (800, 600), interpolation=interpolation)
+    image = cv2.flip(image, 1)
+    return cv2.bilateralFilter(image, 15, 80, 80) if filter_image else image
+
+
+def previous_rescale(temps):
+    temp_min, temp_max = np.min(temps), np.max(temps)
+    return np.uint8((np.nan_to_num(temps) - temp_min)*255/(temp_max - temp_min)).reshape(24, 32)
+
+
+def test_rescale_matches_the_previous_implementation():
+    pipeline = FramePipeline(800, 600, preallocate=True)
+    for temps in sensor_frames(10):
+        rescaled = pipeline.rescale(temps, float(np.min(temps)), float(np.max(temps)))
+        diff = np.abs(rescaled.astype(int) - previous_rescale(temps))
+        assert rescaled.shape == (24, 32) and rescaled.dtype == np.uint8
+        assert diff.max() <= 1 and np.count_nonzero(diff) <= 2  # Float rounding at a level boundary, nothing more
+
+
+@pytest.mark.parametrize('preallocate', [False, True])
+@pytest.mark.parametrize('filter_image', [False, True])
+@pytest.mark.parametrize('index, interpolation', INTERPOLATIONS[:5])
+def test_cv2_modes_match_the_previous_rendering(index, interpolation, filter_image, preallocate):
+    pipeline = FramePipeline(800, 600, preallocate=preallocate)
+    for temps in sensor_frames(2):
+        image = pipeline.render(previous_rescale(temps), COLORMAP, index, interpolation, filter_image)
+        expected = previous_render(temps, index, interpolation, filter_image)
+        assert image.shape == expected.shape == (600, 800, 3) and image.dtype == np.uint8
+        # Mirroring before the resize rather than after is exact, bar cubic's rounding
+        tolerance = 1 if interpolation == cv2.INTER_CUBIC else 0
+        assert np.abs(image.astype(int) - expected).max() <= tolerance
+
+
+@pytest.mark.parametrize('preallocate', [False, True])
+@pytest.mark.parametrize('index, interpolation', INTERPOLATIONS[5:])
+def test_spline_modes_stay_close_to_the_previous_rendering(index, interpolation, preallocate):
+    # These now interpolate the temperatures and quantize afterwards, rather than interpolating the uint8 image
+    pipeline = FramePipeline(800, 600, preallocate=preallocate)
+    for temps in sensor_frames(3):
+        temp_range = (float(np.min(temps)), float(np.max(temps)))
+        image = pipeline.render(pipeline.rescale(temps, *temp_range), COLORMAP, index, interpolation, temps=temps, temp_range=temp_range)
+        diff = np.abs(image.astype(int) - previous_render(temps, index, interpolation, False))
+        assert image.shape == (600, 800, 3) and image.dtype == np.uint8
+        assert diff.max() <= 8 and diff.mean() < 0.5
+
+
+@pytest.mark.parametrize('filter_image', [False, True])
+@pytest.mark.parametrize('index, interpolation', INTERPOLATIONS)
+def test_preallocated_buffers_render_the_same_frames(index, interpolation, filter_image):
+    fresh, preallocated = FramePipeline(800, 600, preallocate=False), FramePipeline(800, 600, preallocate=True)
+    previous = None
+    for temps in sensor_frames(3):
+        images = []
+        for pipeline in (fresh, preallocated):
+            temp_range = (float(np.min(temps)), float(np.max(temps)))
+            raw_image = pipeline.rescale(temps, *temp_range)
+            images.append(pipeline.render(raw_image, COLORMAP, index, interpolation, filter_image, temps=temps, temp_range=temp_range))
+        assert np.array_equal(images[0], images[1])
+        if previous is not None:  # The last image handed out isn't drawn over by the next
+            assert np.array_equal(previous[1], previous[0]) and images[1] is not previous[1]
+        previous = images
+
+
+@pytest.mark.parametrize('filter_image', [False, True])
+@pytest.mark.parametrize('index, interpolation', INTERPOLATIONS)
+def test_preallocated_frames_make_no_image_sized_allocations(index, interpolation, filter_image):
+    pipeline = FramePipeline(800, 600, preallocate=True)
+    sensor = SyntheticSensor(realtime=False, seed=3)
+
+    def next_frame():
+        sensor.getFrame(pipeline.temps)
+        temp_range = (float(np.min(pipeline.temps)), float(np.max(pipeline.temps)))
+        raw_image = pipeline.rescale(pipeline.temps, *temp_range)
+        return pipeline.render(raw_image, COLORMAP, index, interpolation, filter_image, temps=pipeline.temps, temp_range=temp_range)
+
+    for _ in range(3):  # Buffers and spline weights are created on the first frames
+        next_frame()
+    tracemalloc.start()
+    try:
+        baseline = tracemalloc.get_traced_memory()[0]
+        outputs = {id(next_frame()) for _ in range(6)}
+        peak = tracemalloc.get_traced_memory()[1]
+    finally:
+        tracemalloc.stop()
+    # Smaller than the smallest upscaled intermediate (the 10x zoom's uint8 frame), let alone a finished image
+    assert peak - baseline < SENSOR_ROWS*10*SENSOR_COLS*10
+    assert len(outputs) == 2  # The two output buffers, taken in turn
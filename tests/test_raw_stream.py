@@ -0,0 +1,64 @@
+import threading, time
+import numpy as np
+from pithermalcam.codec import FrameEncoder, FrameDecoder
+from pithermalcam.raw_stream import RawFrameBroadcaster, decode_frame, is_keyframe
+from pithermalcam.sensors import SyntheticSensor
+
+
+def source_frames(count):
+    sensor = SyntheticSensor(realtime=False, seed=1)
+    frames = np.zeros((count, 24, 32), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames
+
+
+def test_slow_delta_subscriber_gets_each_keyframe_before_its_deltas():
+    frames = source_frames(200)
+    broadcaster = RawFrameBroadcaster(FrameEncoder(keyframe_interval=5))
+    broadcaster.subscribe()
+    decoder = FrameDecoder()
+    seq, keyframe_seq, received = 0, 0, 0
+    for n, frame in enumerate(frames, start=1):
+        broadcaster.write(n, float(n), frame)
+        if n % 7:  # The subscriber only gets round to reading every 7th frame, skipping keyframes in between
+            continue
+        while True:
+            seq, data = broadcaster.get(seq, timeout=0, keyframe_seq=keyframe_seq)
+            if data is None:
+                break
+            if is_keyframe(data):
+                keyframe_seq = seq
+            message_seq, _, decoded = decode_frame(data, decoder)
+            assert message_seq == seq
+            np.testing.assert_allclose(decoded, frames[seq - 1], atol=0.006)
+            received += 1
+    assert received > 200//7
+
+
+def test_blocking_delta_subscriber_that_falls_behind_decodes_exactly():
+    frames = source_frames(120)
+    broadcaster = RawFrameBroadcaster(FrameEncoder(keyframe_interval=4))
+    errors, decoded_seqs = [], []
+
+    def consume():
+        decoder = FrameDecoder()
+        for seq, data in broadcaster.frames():
+            _, _, decoded = decode_frame(data, decoder)
+            errors.append(float(np.abs(decoded - frames[seq - 1]).max()))
+            decoded_seqs.append(seq)
+            time.sleep(0.003)  # Slower than the frames arrive
+
+    consumer = threading.Thread(target=consume)
+    consumer.start()
+    while broadcaster.subscribers == 0:
+        time.sleep(0.001)
+    for n, frame in enumerate(frames, start=1):
+        broadcaster.write(n, float(n), frame)
+        time.sleep(0.001)
+    time.sleep(0.05)
+    broadcaster.close()
+    consumer.join(timeout=5)
+    assert decoded_seqs and len(decoded_seqs) < len(frames)  # It did skip frames
+    assert decoded_seqs == sorted(decoded_seqs)
+    assert max(errors) <= 0.006
@@ -0,0 +1,92 @@
+import os
+import numpy as np
+import pytest
+from pithermalcam.recording import RecordingWriter, RecordingReader, INDEX_DTYPE, DELTA_INDEX_DTYPE, HEADER_SIZE, index_path
+from pithermalcam.sensors import SyntheticSensor
+
+DTYPES = ['int16', 'float16', 'delta']
+TOLERANCE = {'int16': 0.0051, 'float16': 0.02, 'delta': 0.0051}  # Half a step of each storage format at these temperatures, and float32 rounding
+
+
+def sensor_frames(count, seed=4):
+    sensor = SyntheticSensor(realtime=False, seed=seed)
+    frames = np.zeros((count, 24, 32), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames
+
+
+def write(path, frames, first_seq=1, dtype='int16', **kwargs):
+    writer = RecordingWriter(path, dtype=dtype, **kwargs)
+    for n, frame in enumerate(frames, first_seq):
+        writer.write(n, n/8.0, frame)
+    writer.close()
+    return writer
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_frames_read_back_as_written(tmp_path, dtype):
+    path = str(tmp_path/'rec.rec')
+    frames = sensor_frames(40)
+    write(path, frames, dtype=dtype, chunk_frames=16, keyframe_interval=8)  # Two full chunks and a partial one
+    reader = RecordingReader(path)
+    assert len(reader) == 40
+    assert reader.seqs.tolist() == list(range(1, 41))
+    assert np.allclose(reader.timestamps, np.arange(1, 41)/8.0)
+    assert np.abs(reader.frames() - frames).max() <= TOLERANCE[dtype]
+    assert np.array_equal(reader.frame(-1), reader.frames()[-1])
+    seqs, timestamps, selected = reader.time_range(2.0, 3.0)
+    assert seqs.tolist() == list(range(16, 24)) and np.array_equal(selected, reader.frames(15, 23))
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_reopening_appends(tmp_path, dtype):
+    path = str(tmp_path/'rec.rec')
+    frames = sensor_frames(30)
+    write(path, frames[:20], dtype=dtype, keyframe_interval=8)
+    clock_offset = RecordingReader(path).clock_offset
+    write(path, frames[20:], first_seq=21, dtype=dtype, keyframe_interval=8)
+    reader = RecordingReader(path)
+    assert reader.clock_offset == clock_offset
+    assert reader.seqs.tolist() == list(range(1, 31))
+    assert np.abs(reader.frames() - frames).max() <= TOLERANCE[dtype]
+    with pytest.raises(ValueError):
+        RecordingWriter(path, dtype='float16' if dtype == 'int16' else 'int16')
+
+
+def test_reader_refresh_picks_up_appended_frames(tmp_path):
+    path = str(tmp_path/'rec.rec')
+    writer = RecordingWriter(path, chunk_frames=4)
+    reader = RecordingReader(path)
+    assert len(reader) == 0
+    for n, frame in enumerate(sensor_frames(6), 1):
+        writer.write(n, float(n), frame)
+    reader.refresh()
+    assert len(reader) == 4  # Only the full chunk is on disk yet
+    writer.close()
+    reader.refresh()
+    assert len(reader) == 6
+
+
+@pytest.mark.parametrize('dtype', DTYPES)
+def test_truncated_final_frame_is_dropped_and_appending_carries_on(tmp_path, dtype):
+    path = str(tmp_path/'rec.rec')
+    frames = sensor_frames(12)
+    write(path, frames[:10], dtype=dtype, keyframe_interval=4)
+    # A crash partway through writing the last frame: half its data and half its index record are missing
+    if dtype == 'delta':
+        last = np.fromfile(index_path(path), dtype=DELTA_INDEX_DTYPE)[-1]
+        os.truncate(path, HEADER_SIZE + int(last['offset']) + int(last['size'])//2)
+        record_size = DELTA_INDEX_DTYPE.itemsize
+    else:
+        os.truncate(path, os.path.getsize(path) - 24*32)
+        record_size = INDEX_DTYPE.itemsize
+    os.truncate(index_path(path), os.path.getsize(index_path(path)) - record_size//2)
+    reader = RecordingReader(path)
+    assert len(reader) == 9
+    assert np.abs(reader.frames() - frames[:9]).max() <= TOLERANCE[dtype]
+
+    write(path, frames[10:], first_seq=11, dtype=dtype, keyframe_interval=4)
+    reader = RecordingReader(path)
+    assert reader.seqs.tolist() == list(range(1, 10)) + [11, 12]
+    assert np.abs(reader.frames() - np.concatenate([frames[:9], frames[10:]])).max() <= TOLERANCE[dtype]
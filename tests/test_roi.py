@@ -0,0 +1,78 @@
+import numpy as np
+import pytest
+from pithermalcam.roi import RoiStats, rectangle_mask, polygon_mask, definition_mask
+from pithermalcam.sensors import SyntheticSensor, SENSOR_ROWS, SENSOR_COLS
+
+
+def test_rectangle_covers_width_by_height_pixels():
+    mask = rectangle_mask(3, 2, 4, 5)
+    assert mask.shape == (SENSOR_ROWS, SENSOR_COLS) and mask.sum() == 20
+    assert mask[2:7, 3:7].all()
+
+
+@pytest.mark.parametrize('x, y, width, height, pixels', [
+    (-2, -3, 4, 5, 2*2),  # Over the top left corner
+    (30, 22, 5, 5, 2*2),  # Over the bottom right corner
+    (-40, 0, 10, 4, 0),  # Wholly left of the frame, rather than wrapping around to its right edge
+    (0, -30, 4, 10, 0),  # Wholly above it
+    (40, 30, 3, 3, 0),
+])
+def test_rectangle_is_clipped_to_the_frame(x, y, width, height, pixels):
+    assert rectangle_mask(x, y, width, height).sum() == pixels
+
+
+def test_empty_regions_are_rejected():
+    rois = RoiStats()
+    with pytest.raises(ValueError):
+        rectangle_mask(0, 0, 0, 3)
+    with pytest.raises(ValueError):
+        rois.add_rectangle('off', -40, 0, 10, 4)
+    with pytest.raises(ValueError):
+        rois.add('none', {'mask': [[0]*SENSOR_COLS]*SENSOR_ROWS})
+    with pytest.raises(ValueError):
+        rois.add('line', {'polygon': [[0, 0], [1, 1]]})
+    assert rois.names == []
+
+
+def test_polygon_includes_the_pixels_its_edges_cross():
+    mask = polygon_mask([[0, 0], [9, 0], [0, 9]])
+    assert mask[0, :10].all() and mask[:10, 0].all() and mask[5, 4]
+    assert not mask[9, 9] and not mask[0, 10]
+    square = polygon_mask([[2, 2], [5, 2], [5, 5], [2, 5]])
+    assert np.array_equal(square, rectangle_mask(2, 2, 4, 4))
+
+
+def test_definitions_round_trip_in_the_image_orientation():
+    rois = RoiStats()
+    mask = np.zeros((SENSOR_ROWS, SENSOR_COLS), dtype=bool)
+    mask[4:6, 1:3] = True
+    rois.add('mask', {'mask': mask.astype(int).tolist()})
+    rois.add('rect', {'rectangle': [1, 4, 2, 2]})
+    assert np.array_equal(rois.mask('mask'), mask[:, ::-1])  # Stored as the sensor sees it
+    assert rois.definitions()['mask'] == rois.definitions()['rect'] == mask.astype(np.uint8).tolist()
+    with pytest.raises(ValueError):
+        definition_mask({'circle': [1, 2, 3]})
+
+
+def test_vectorized_stats_match_numpy_per_region():
+    rois = RoiStats(percentiles=(5, 25, 50, 95))
+    rois.add_rectangle('rect', 3, 2, 7, 5)
+    rois.add_polygon('poly', [[10, 3], [28, 8], [14, 20]])
+    rois.add_rectangle('corner', 30, 22, 5, 5)
+    rois.add_rectangle('pixel', 17, 11, 1, 1)
+    rois.add_mask('checks', (np.indices((SENSOR_ROWS, SENSOR_COLS)).sum(axis=0) % 2).astype(bool))
+    sensor = SyntheticSensor(realtime=False, seed=5)
+    frame = np.zeros(SENSOR_ROWS*SENSOR_COLS, dtype=np.float32)
+    for seq in range(1, 4):
+        sensor.getFrame(frame)
+        rois.update(seq, float(seq), frame)
+        stats = rois.stats()
+        assert stats['seq'] == seq
+        for name in rois.names:
+            values = frame[rois.mask(name).reshape(-1)]
+            region = stats['regions'][name]
+            assert region['pixels'] == len(values)
+            assert region['min'] == values.min() and region['max'] == values.max()
+            assert region['mean'] == pytest.approx(values.mean(), abs=1e-4)
+            for q in rois.percentiles:
+                assert region[f'p{q:g}'] == pytest.approx(np.percentile(values, q), abs=1e-4)
@@ -0,0 +1,78 @@
+import threading
+import numpy as np
+import pytest
+from pithermalcam.roi import RoiStats, FRAME_REGION
+from pithermalcam.rollup import RollupStore
+
+TIERS = ((1, 60),)
+
+
+def feed(store, rois, seq, value=20.0):
+    frame = np.full((24, 32), value, dtype=np.float32)
+    rois.update(seq, float(seq), frame)
+    store.update(seq, float(seq), frame)
+
+
+def test_no_roi_can_be_named_frame():
+    rois = RoiStats()
+    with pytest.raises(ValueError):
+        rois.add_rectangle(FRAME_REGION, 0, 0, 4, 4)
+    with pytest.raises(ValueError):
+        rois.add(FRAME_REGION, {'rectangle': [0, 0, 4, 4]})
+    assert rois.names == []
+
+
+def test_new_regions_take_over_the_rows_of_removed_ones(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr('pithermalcam.rollup.time.time', lambda: now[0])
+    rois = RoiStats()
+    store = RollupStore(rois, tiers=TIERS, max_regions=3)
+    seq = 0
+    for name in ('a', 'b'):
+        rois.add_rectangle(name, 0, 0, 4, 4)
+    for _ in range(2):
+        seq += 1
+        feed(store, rois, seq)
+        now[0] += 1
+    rois.remove('b')
+    rois.remove('a')
+    rois.add_rectangle('c', 0, 0, 4, 4)
+    seq += 1
+    feed(store, rois, seq, 30.0)
+    now[0] += 1
+    feed(store, rois, seq + 1, 30.0)  # Folds the second before into the rings
+    assert store.names == [FRAME_REGION, 'c', 'b']  # 'a' and 'b' were updated together; the first of them goes
+    assert len(store.query('b', start=0)) == 2
+    records = store.query('c', start=0)
+    assert len(records) == 1 and records['max'][0] == 30.0  # None of 'a's history carried over
+    with pytest.raises(KeyError):
+        store.query('a', start=0)
+
+
+def test_regions_that_are_all_current_are_not_evicted():
+    rois = RoiStats()
+    store = RollupStore(rois, tiers=TIERS, max_regions=2)
+    rois.add_rectangle('a', 0, 0, 4, 4)
+    rois.add_rectangle('b', 4, 4, 4, 4)
+    feed(store, rois, 1)
+    assert store.names == [FRAME_REGION, 'a']
+
+
+def test_saving_while_regions_are_added_stays_consistent():
+    rois = RoiStats()
+    store = RollupStore(rois, tiers=TIERS, max_regions=64)
+    done = threading.Event()
+
+    def add_regions():
+        for i in range(60):
+            rois.add_rectangle(f'r{i}', 0, 0, 2, 2)
+            feed(store, rois, i + 1)
+        done.set()
+
+    thread = threading.Thread(target=add_regions)
+    thread.start()
+    while not done.is_set():
+        arrays = store._arrays()
+        assert len(arrays['names']) <= store.max_regions
+    thread.join()
+    assert len(store.names) == 61
@@ -0,0 +1,158 @@
+import sys, types
+import numpy as np
+import pytest
+from pithermalcam.sensors import I2CSensor, SyntheticSensor, ReplaySensor, get_sensor
+
+
+def fake_driver_modules():
+    """
+    Stand-ins for board, busio, adafruit_bus_device and adafruit_mlx90640, built afresh for each start as a new process
+    would import them. Like the real driver, MLX90640 keeps most of its calibration in lists defined on the class and
+    filled in place by the constructor's EEPROM read, and divides by alpha when working out temperatures.
+    """
+    driver = types.ModuleType('adafruit_mlx90640')
+    driver.__version__ = '1.3.0'
+    driver.eeprom_reads = 0
+
+    class I2CDevice:
+        def __init__(self, i2c, address):
+            self.i2c, self.address = i2c, address
+
+    class MLX90640:
+        alpha = [0]*768
+        offset = [0]*768
+        kta = [0]*768
+        ksTo = [0]*5
+        brokenPixels = []
+        kVdd = 0
+
+        def __init__(self, i2c, address=0x33):
+            self.i2c_device = I2CDevice(i2c, address)
+            driver.eeprom_reads += 1
+            for i in range(768):
+                self.alpha[i] = 1e-7*(1 + i % 7)
+                self.offset[i] = i % 5
+                self.kta[i] = 0.001*(i % 3)
+            self.ksTo[1] = -0.0008
+            self.brokenPixels.append(0xFFFF)
+            self.kVdd = -3200
+            self.vdd25 = -12000  # Only ever on the instance
+
+        @property
+        def serial_number(self):
+            return [0x1234, 0x5678, 0x9ABC]
+
+        def _GetFrameData(self, frame_data):
+            frame_data[833] = 1 - frame_data[833]
+            return 0
+
+        def _GetTa(self, frame_data):
+            return 25.0 + self.kVdd/self.vdd25
+
+        def _CalculateTo(self, frame_data, emissivity, tr, result):
+            for i in range(768):
+                if i % 2 == frame_data[833]:
+                    result[i] = (self.offset[i] + self.kta[i]*tr)*1e-7/self.alpha[i] + self.ksTo[1]*tr + emissivity
+
+        def getFrame(self, framebuf):
+            frame_data = [0]*834
+            for _ in range(2):
+                self._GetFrameData(frame_data)
+                self._CalculateTo(frame_data, 0.95, self._GetTa(frame_data) - 8, framebuf)
+
+    driver.MLX90640 = MLX90640
+    i2c_device = types.ModuleType('adafruit_bus_device.i2c_device')
+    i2c_device.I2CDevice = I2CDevice
+    board = types.ModuleType('board')
+    board.SCL = board.SDA = None
+    busio = types.ModuleType('busio')
+    busio.I2C = lambda scl, sda, frequency=None: types.SimpleNamespace(deinit=lambda: None)
+    return {'adafruit_mlx90640': driver, 'adafruit_bus_device': types.ModuleType('adafruit_bus_device'),
+            'adafruit_bus_device.i2c_device': i2c_device, 'board': board, 'busio': busio}
+
+
+def start_sensor(monkeypatch, cache):
+    modules = fake_driver_modules()
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    monkeypatch.setattr('pithermalcam.sensors.time.sleep', lambda seconds: None)
+    sensor = I2CSensor(calibration_cache=cache)
+    frame = np.zeros(768, dtype=np.float32)
+    sensor.getFrame(frame)
+    return modules['adafruit_mlx90640'], sensor, frame
+
+
+def test_cached_calibration_reads_the_same_temperatures_as_the_eeprom(monkeypatch, tmp_path):
+    driver, fresh, fresh_frame = start_sensor(monkeypatch, str(tmp_path))
+    assert driver.eeprom_reads == 1
+    driver, cached, cached_frame = start_sensor(monkeypatch, str(tmp_path))
+    assert driver.eeprom_reads == 0  # Only the serial number was read
+    assert driver.MLX90640.alpha[0] == 0  # The cache went on the instance, not into the class's lists
+    assert np.array_equal(cached_frame, fresh_frame)
+    frames = [np.zeros(768, dtype=np.float32) for _ in range(2)]
+    assert fresh.getSubpage(frames[0]) == cached.getSubpage(frames[1])
+    assert np.array_equal(frames[0], frames[1])
+
+
+def test_cache_from_another_driver_version_is_ignored(monkeypatch, tmp_path):
+    start_sensor(monkeypatch, str(tmp_path))
+    modules = fake_driver_modules()
+    modules['adafruit_mlx90640'].__version__ = '2.0.0'
+    for name, module in modules.items():
+        monkeypatch.setitem(sys.modules, name, module)
+    I2CSensor(calibration_cache=str(tmp_path))
+    assert modules['adafruit_mlx90640'].eeprom_reads == 1
+
+
+
+def read_frames(sensor, count):
+    frames = np.zeros((count, 768), dtype=np.float32)
+    for frame in frames:
+        sensor.getFrame(frame)
+    return frames
+
+
+def test_synthetic_frames_are_deterministic_by_seed():
+    first, again, other = (read_frames(SyntheticSensor(realtime=False, seed=seed), 5) for seed in (7, 7, 8))
+    assert np.array_equal(first, again)
+    assert not np.array_equal(first, other)
+    assert 15 < first.min() and first.max() < 40
+
+
+def test_synthetic_read_errors_are_deterministic_by_seed():
+    def failures(seed):
+        sensor = SyntheticSensor(realtime=False, error_rate=0.3, seed=seed)
+        frame = np.zeros(768, dtype=np.float32)
+        outcomes = []
+        for _ in range(40):
+            try:
+                sensor.getFrame(frame)
+                outcomes.append(None)
+            except (ValueError, OSError, RuntimeError) as e:
+                outcomes.append(type(e))
+        return outcomes
+    outcomes = failures(3)
+    assert outcomes == failures(3) and 0 < len([o for o in outcomes if o]) < 40
+
+
+@pytest.mark.parametrize('extension', ['.npy', '.npz'])
+def test_replay_plays_the_frames_back_then_reaches_the_end(tmp_path, extension):
+    frames = read_frames(SyntheticSensor(realtime=False, seed=2), 3).reshape(3, 24, 32)
+    path = str(tmp_path/('frames' + extension))
+    if extension == '.npz':
+        np.savez(path, frames=frames)
+    else:
+        np.save(path, frames)
+    sensor = get_sensor(path, loop=False, realtime=False)
+    assert isinstance(sensor, ReplaySensor) and len(sensor) == 3
+    assert np.array_equal(read_frames(sensor, 3), frames.reshape(3, 768))
+    with pytest.raises(EOFError):
+        sensor.getFrame(np.zeros(768, dtype=np.float32))
+
+
+def test_replay_loops_by_default():
+    frames = np.arange(2*768, dtype=np.float32).reshape(2, 768)
+    sensor = ReplaySensor(frames, realtime=False)
+    assert np.array_equal(read_frames(sensor, 5), frames[[0, 1, 0, 1, 0]])
+    with pytest.raises(ValueError):
+        ReplaySensor(np.zeros((0, 768)))
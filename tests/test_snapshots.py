@@ -0,0 +1,74 @@
+import datetime, os, types
+import numpy as np
+import cv2
+import pytest
+from pithermalcam import snapshots
+from pithermalcam.snapshots import SnapshotWriter, SnapshotNames, PNG_SCALE, PNG_OFFSET
+
+IMAGE = np.full((60, 80, 3), 128, dtype=np.uint8)
+
+
+@pytest.fixture
+def frozen_clock(monkeypatch):
+    """Every name asked for lands in the same second"""
+    now = datetime.datetime(2024, 5, 6, 7, 8, 9)
+    monkeypatch.setattr(snapshots, 'dt', types.SimpleNamespace(datetime=types.SimpleNamespace(now=lambda: now)))
+    return now
+
+
+def temps():
+    values = np.linspace(15, 45, 24*32, dtype=np.float32).reshape(24, 32)
+    values[0, 0] = -5.25
+    return values
+
+
+def test_names_in_the_same_second_get_a_suffix_and_skip_existing_files(tmp_path, frozen_clock):
+    names = SnapshotNames('pic_', '.jpg')
+    base = str(tmp_path/'pic_2024-05-06_07-08-09')
+    assert names.next(str(tmp_path)) == base
+    assert names.next(str(tmp_path)) == base + '_2'
+    open(base + '_3.jpg', 'w').close()  # Left by a run that was restarted within the second
+    assert names.next(str(tmp_path)) == base + '_4'
+
+
+def test_npz_snapshot_is_written_in_the_background(tmp_path, frozen_clock):
+    writer = SnapshotWriter(str(tmp_path/'shots'))
+    path = writer.save(IMAGE, temps(), seq=7, timestamp=12.5)
+    assert path == str(tmp_path/'shots'/'pic_2024-05-06_07-08-09.jpg')
+    assert writer.flush(timeout=5) and writer.pending == 0
+    assert np.array_equal(cv2.imread(path).shape, IMAGE.shape)
+    raw = np.load(path[:-4] + '_raw.npz')
+    assert raw['temps'].dtype == np.int16 and int(raw['seq']) == 7 and float(raw['timestamp']) == 12.5
+    assert np.allclose(raw['temps']*raw['scale'], np.fliplr(temps()), atol=0.005)  # Mirrored to match the image
+    assert writer.metrics.summary()['counters']['snapshots_saved'] == 1
+
+
+def test_png_snapshot_holds_kelvin_hundredths(tmp_path, frozen_clock):
+    writer = SnapshotWriter(str(tmp_path), raw_format='png')
+    path = writer.save(IMAGE, temps())
+    assert writer.flush(timeout=5)
+    kelvin = cv2.imread(path[:-4] + '_raw.png', cv2.IMREAD_UNCHANGED)
+    assert kelvin.dtype == np.uint16
+    assert np.allclose(kelvin*PNG_SCALE + PNG_OFFSET, np.fliplr(temps()), atol=0.005)
+
+
+def test_without_raw_format_only_the_image_is_written(tmp_path, frozen_clock):
+    writer = SnapshotWriter(str(tmp_path), raw_format=None)
+    writer.save(IMAGE, temps())
+    assert writer.flush(timeout=5)
+    assert os.listdir(str(tmp_path)) == ['pic_2024-05-06_07-08-09.jpg']
+
+
+def test_full_queue_drops_the_snapshot_and_returns_none(tmp_path, frozen_clock, monkeypatch):
+    writer = SnapshotWriter(str(tmp_path), max_pending=2)
+    start = writer._start
+    monkeypatch.setattr(writer, '_start', lambda: None)  # Hold the writer thread back, as a slow SD card would
+    paths = [writer.save(IMAGE, temps()) for _ in range(3)]
+    base = str(tmp_path/'pic_2024-05-06_07-08-09')
+    assert paths == [base + '.jpg', base + '_2.jpg', None]
+    assert writer.pending == 2 and writer.metrics.summary()['counters']['snapshots_dropped'] == 1
+    start()
+    assert writer.flush(timeout=5)
+    assert sorted(os.listdir(str(tmp_path))) == ['pic_2024-05-06_07-08-09.jpg', 'pic_2024-05-06_07-08-09_2.jpg',
+                                                 'pic_2024-05-06_07-08-09_2_raw.npz', 'pic_2024-05-06_07-08-09_raw.npz']
+    assert writer.save(IMAGE) == base + '_4.jpg'  # The dropped snapshot's name isn't handed out again
@@ -0,0 +1,100 @@
+import time
+import numpy as np
+import cv2
+import pytest
+from pithermalcam.stream_hub import StreamHub, ClientStream, LEVELS
+
+
+def frame(value:int = 0):
+    image = np.zeros((120, 160, 3), dtype=np.uint8)
+    image[:, :value % 160] = 200
+    return image
+
+
+def jpeg_of(chunk:bytes):
+    return cv2.imdecode(np.frombuffer(chunk.split(b'\r\n\r\n', 1)[1][:-2], dtype=np.uint8), cv2.IMREAD_COLOR)
+
+
+def test_each_frame_is_encoded_once_per_level():
+    hub = StreamHub()
+    hub.publish(frame(10))
+    first = hub.get_jpeg(0)
+    assert first[0] == 1 and hub.get_jpeg(0) is first  # A second client gets the same bytes
+    half = hub.get_jpeg(0, level=3)
+    assert cv2.imdecode(np.frombuffer(half[1], dtype=np.uint8), cv2.IMREAD_COLOR).shape == (60, 80, 3)
+    assert hub.metrics.summary()['stages']['jpeg_encode']['count'] == 2
+    assert hub.get_jpeg(1, timeout=0.01) == (1, None)  # Nothing newer
+
+
+def test_client_steps_down_when_slow_and_back_up_when_fast():
+    client = ClientStream()
+    for _ in range(ClientStream.SLOW_FRAMES*3):
+        client.sent(0, 1000, 0.24, 0.25)
+    assert client.level == 3
+    for _ in range(ClientStream.SLOW_FRAMES*(len(LEVELS) + 2)):
+        client.sent(0, 1000, 0.24, 0.25)
+    assert client.level == len(LEVELS) - 1  # No further than the last level
+    client.sent(0, 1000, 0.01, 0.25)
+    for _ in range(ClientStream.FAST_FRAMES - 2):
+        client.sent(0, 1000, 0.01, 0.25)
+    assert client.level == len(LEVELS) - 1  # One short of a long enough run
+    client.sent(0, 1000, 0.01, 0.25)
+    assert client.level == len(LEVELS) - 2
+    client.sent(0, 1000, 0.1, 0.25)  # In between: neither slow nor fast, and restarts the count
+    for _ in range(ClientStream.FAST_FRAMES - 1):
+        client.sent(0, 1000, 0.01, 0.25)
+    assert client.level == len(LEVELS) - 2
+
+
+def test_non_adaptive_client_keeps_full_quality():
+    client = ClientStream(adaptive=False)
+    for _ in range(10):
+        client.sent(0, 1000, 1.0, 0.25)
+    assert client.level == 0
+
+
+def test_slow_client_skips_to_the_newest_frame_and_steps_down_a_level():
+    hub = StreamHub()
+    stream = hub.frames('slow')
+    seq = 0
+    for _ in range(4):
+        for _ in range(3):  # Three frames published while the client was still taking the last
+            seq += 1
+            hub.publish(frame(seq*10))
+        hub.frame_interval = 0.02
+        chunk = next(stream)
+        time.sleep(0.05)  # The client takes longer than a frame interval to accept each frame
+    stats = hub.client_stats()[0]
+    assert stats['name'] == 'slow' and stats['frames_sent'] == 3  # The fourth send isn't timed until the next frame is asked for
+    assert stats['frames_skipped'] == 2*2  # Two of every three frames after the first one sent
+    assert hub.viewers == 1
+    # Two slow sends step it down a level
+    assert stats['level'] == 1 and stats['jpeg_quality'] == LEVELS[1][0]
+    assert jpeg_of(chunk).shape == (120, 160, 3)
+    stream.close()
+    assert hub.viewers == 0 and hub.client_stats() == []
+
+
+def test_levels_reduce_the_resolution_sent():
+    hub = StreamHub()
+    stream = hub.frames('slow')
+    sizes = []
+    for seq in range(1, 12):
+        hub.publish(frame(seq))
+        hub.frame_interval = 0.02
+        sizes.append(jpeg_of(next(stream)).shape)
+        time.sleep(0.03)
+    stream.close()
+    assert sizes[0] == (120, 160, 3)
+    assert (60, 80, 3) in sizes and sizes[-1] == (30, 40, 3)
+
+
+def test_close_ends_every_stream():
+    hub = StreamHub()
+    stream = hub.frames()
+    hub.publish(frame())
+    next(stream)
+    hub.close()
+    with pytest.raises(StopIteration):
+        next(stream)
+    assert hub.viewers == 0
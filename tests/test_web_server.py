@@ -0,0 +1,72 @@
+import importlib, sys, types
+import pytest
+from pithermalcam import web_server
+
+
+class FakeSock:
+    """Records the WebSocket views registered like flask_sock.Sock does"""
+
+    def __init__(self, app):
+        self.views = {}
+
+    def route(self, path):
+        def register(view):
+            self.views[path] = view
+            return view
+        return register
+
+
+@pytest.fixture
+def client():
+    return web_server.app.test_client()
+
+
+def test_browser_rendering_is_offered_when_flask_sock_serves_the_raw_socket(monkeypatch):
+    flask_sock = types.ModuleType('flask_sock')
+    flask_sock.Sock = FakeSock
+    monkeypatch.setitem(sys.modules, 'flask_sock', flask_sock)
+    monkeypatch.delitem(sys.modules, 'pithermalcam.web_server')
+    server = importlib.import_module('pithermalcam.web_server')
+    assert server.raw_socket is True
+    assert server.sock.views['/ws/raw'] is server.raw_frames_socket
+    client = server.app.test_client()
+    assert 'Render in the browser' in client.get('/').get_data(as_text=True)
+    page = client.get('/?render=browser').get_data(as_text=True)
+    assert '<canvas' in page and "'?codec=delta'" in page
+
+
+def test_browser_rendering_is_only_offered_when_the_raw_socket_is_served(monkeypatch, client):
+    monkeypatch.setattr(web_server, 'raw_socket', False)
+    assert 'Render in the browser' not in client.get('/').get_data(as_text=True)
+    assert '<canvas' not in client.get('/?render=browser').get_data(as_text=True)
+
+
+@pytest.fixture
+def camera(monkeypatch, tmp_path):
+    from pithermalcam.pi_therm_cam import pithermalcam
+    from pithermalcam.sensors import SyntheticSensor
+    thermcam = pithermalcam(sensor=SyntheticSensor(realtime=False, seed=1), output_folder=str(tmp_path))
+    monkeypatch.setattr(web_server, 'thermcam', thermcam)
+    return thermcam
+
+
+def test_shared_routes_use_the_servers_current_camera(client, camera):
+    assert client.put('/api/roi/pump', json={'rectangle': [0, 0, 4, 4]}).status_code == 200
+    assert client.put('/api/roi/frame', json={'rectangle': [0, 0, 4, 4]}).status_code == 400
+    assert camera.rois.names == ['pump']
+    for _ in range(3):
+        camera.update_raw_image_only()
+    assert 'pump' in client.get('/api/roi').get_json()['regions']
+
+    assert client.put('/api/alarms/hot', json={'above': 70, 'roi': 'pump'}).status_code == 200
+    assert client.put('/api/alarms/slow', json={'above': 1, 'window': 3600}).status_code == 400
+    assert client.get('/api/alarms?definitions=1').get_json()['definitions'].keys() == {'hot'}
+    assert client.delete('/api/alarms/missing').status_code == 404
+
+    assert client.get('/api/history?region=nowhere').status_code == 404
+    assert client.get('/api/history?resolution=7').status_code == 400
+    assert b'frames_acquired' in client.get('/metrics').data
+    assert client.get('/api/render_settings').get_json()['use_f'] is False
+    client.get('/units')
+    assert camera.use_f
+    assert len(client.get('/api/colormap/jet').data) == 768
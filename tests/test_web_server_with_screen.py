@@ -0,0 +1,54 @@
+import importlib, sys, types
+import pytest
+
+
+class FakeTrackball:
+    """Plays back (up, down, left, right, switch, state) readings like trackball.TrackBall.read()"""
+
+    def __init__(self, interrupt_pin=None):
+        self.readings = []
+
+    def read(self):
+        return self.readings.pop(0) if self.readings else (0, 0, 0, 0, 0, False)
+
+    def set_rgbw(self, r, g, b, w):
+        pass
+
+
+class FakeCamera:
+    def __init__(self):
+        self.changes = []
+
+    def change_colormap(self, forward:bool = True):
+        self.changes.append(forward)
+
+
+@pytest.fixture
+def screen_server(monkeypatch):
+    # The screen, trackball and rotary encoder drivers only exist on the Pi
+    monkeypatch.setitem(sys.modules, 'ioexpander', types.ModuleType('ioexpander'))
+    monkeypatch.setitem(sys.modules, 'ST7789', types.ModuleType('ST7789'))
+    trackball = types.ModuleType('trackball')
+    trackball.TrackBall = FakeTrackball
+    monkeypatch.setitem(sys.modules, 'trackball', trackball)
+    flask_sock = types.ModuleType('flask_sock')
+    flask_sock.Sock = lambda app: types.SimpleNamespace(route=lambda path: lambda view: view)
+    monkeypatch.setitem(sys.modules, 'flask_sock', flask_sock)
+    monkeypatch.delitem(sys.modules, 'pithermalcam.web_server_with_screen', raising=False)
+    module = importlib.import_module('pithermalcam.web_server_with_screen')
+    monkeypatch.setattr(module, 'thermcam', FakeCamera())
+    return module
+
+
+def test_trackball_gestures_change_the_colormap(screen_server):
+    ball = screen_server.trackball
+    ball.readings = [(0, 2, 0, 0, 0, False)] + [(0, 0, 0, 2, 0, False)]*2 + [(0, 0, 2, 0, 0, False)]*2
+    for _ in range(5):
+        screen_server.update_trackball()
+    assert screen_server.thermcam.changes == [True, False]
+    assert screen_server.trackball_msg == 'Colour Map Dec'
+
+
+def test_raw_socket_flag_survives_the_websocket_view(screen_server):
+    assert screen_server.raw_socket is True
+    assert callable(screen_server.raw_frames_socket)